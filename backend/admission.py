@@ -0,0 +1,175 @@
+import asyncio
+import bisect
+import itertools
+import math
+import time
+from contextvars import ContextVar
+
+# Call priorities: interactive requests (chat) are admitted before bulk work (ingestion)
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+# Priority of the Gemini calls made by the current task; ingest workers set BULK
+call_priority = ContextVar("call_priority", default=INTERACTIVE)
+# Arrival time of the request the calls belong to. Waiters are admitted oldest request
+# first, so the second call of a chat (generation after the query embedding) does not
+# queue again behind requests that arrived later
+call_arrival = ContextVar("call_arrival", default=None)
+
+
+class Overloaded(Exception):
+    """The call was shed instead of queued; the client should retry after `retry_after` seconds."""
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionController:
+    """
+    Priority-aware gate in front of an API: a token bucket for the request rate and
+    a cap on calls in flight, shared by every coroutine in the process.
+
+    Waiting interactive calls are always admitted before bulk ones. Bulk calls may
+    also hold at most `bulk_max_concurrency` slots, and they may not spend the last
+    `interactive_reserve` tokens, so a chat arriving during a large ingest finds
+    capacity at once. An interactive call that would queue longer than `max_wait`
+    seconds is rejected immediately with Overloaded. Bulk calls always queue.
+    Within a priority, calls are admitted in order of their request's arrival.
+    """
+
+    def __init__(self, rate: float, burst: int, max_concurrency: int, bulk_max_concurrency: int,
+                 interactive_reserve: int, max_wait: float, max_queue: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_concurrency = max_concurrency
+        self.bulk_max_concurrency = bulk_max_concurrency
+        # A bulk call needs 1 + reserve tokens and the bucket never holds more than burst
+        if interactive_reserve >= self.burst:
+            print(f"[Admission] Interactive reserve {interactive_reserve} would block all bulk calls "
+                  f"with a burst of {self.burst}; using {self.burst - 1}")
+            interactive_reserve = self.burst - 1
+        self.interactive_reserve = max(0, interactive_reserve)
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.in_flight = {INTERACTIVE: 0, BULK: 0}
+        # Sorted (arrival, sequence, event) entries; only the head may be admitted
+        self._queues = {INTERACTIVE: [], BULK: []}
+        self._sequence = itertools.count()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _tokens_needed(self, priority: str) -> float:
+        return 1 + (self.interactive_reserve if priority == BULK else 0)
+
+    def _admissible(self, priority: str, waiter: asyncio.Event) -> bool:
+        self._refill()
+        if self._queues[priority][0][2] is not waiter:
+            return False
+        if priority == BULK and (self._queues[INTERACTIVE] or self.in_flight[BULK] >= self.bulk_max_concurrency):
+            return False
+        if sum(self.in_flight.values()) >= self.max_concurrency:
+            return False
+        return self.rate <= 0 or self.tokens >= self._tokens_needed(priority)
+
+    def _token_eta(self, priority: str) -> float | None:
+        """Seconds until enough tokens have accrued (None when only a release can help)."""
+        if self.rate <= 0:
+            return None
+        missing = self._tokens_needed(priority) - self.tokens
+        return max(0.001, missing / self.rate) if missing > 0 else None
+
+    def _wake(self):
+        for queue in self._queues.values():
+            if queue:
+                queue[0][2].set()
+
+    def _ahead(self, arrival: float) -> int:
+        return bisect.bisect_right(self._queues[INTERACTIVE], (arrival, math.inf))
+
+    def estimated_wait(self, arrival: float | None = None) -> float:
+        """Expected queueing time of an interactive call (rate limit only)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        ahead = self._ahead(arrival or time.monotonic()) + 1
+        return max(0.0, (ahead - self.tokens) / self.rate)
+
+    def check(self):
+        """Raise Overloaded if an interactive call of this request would not be admitted within max_wait."""
+        arrival = call_arrival.get() or time.monotonic()
+        if self._ahead(arrival) >= self.max_queue:
+            raise Overloaded("Too many requests are waiting for the model", self.max_wait)
+        wait = self.estimated_wait(arrival)
+        if wait > self.max_wait:
+            raise Overloaded("The model is at capacity", wait)
+
+    async def acquire(self, priority: str = INTERACTIVE):
+        if priority == INTERACTIVE:
+            self.check()
+        waiter = asyncio.Event()
+        queue = self._queues[priority]
+        entry = (call_arrival.get() or time.monotonic(), next(self._sequence), waiter)
+        bisect.insort(queue, entry)
+        # The estimate in check() cannot see calls that requests already admitted will
+        # make next, so interactive waits are also bounded by max_wait
+        give_up = time.monotonic() + self.max_wait if priority == INTERACTIVE else math.inf
+        try:
+            while not self._admissible(priority, waiter):
+                remaining = give_up - time.monotonic()
+                if remaining <= 0:
+                    raise Overloaded("The model is at capacity", self.max_wait)
+                waiter.clear()
+                eta = self._token_eta(priority)
+                timeout = min(eta, remaining) if eta is not None else remaining
+                try:
+                    await asyncio.wait_for(waiter.wait(), timeout=None if math.isinf(timeout) else timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            queue.remove(entry)
+            # The next waiter may be admissible now (or was blocked behind this one)
+            self._wake()
+        if self.rate > 0:
+            self.tokens -= 1
+        self.in_flight[priority] += 1
+
+    def release(self, priority: str = INTERACTIVE):
+        self.in_flight[priority] -= 1
+        self._wake()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while a call for a key is running, later
+    callers with the same key await its result instead of making their own.
+    The shared call runs as its own task, so one caller cancelling (e.g. a client
+    disconnecting) does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def __contains__(self, key) -> bool:
+        return key in self._calls
+
+    def _done(self, key, task: asyncio.Task):
+        self._calls.pop(key, None)
+        # Retrieve the error even if every caller went away, so it is not logged as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key, factory):
+        """Return factory()'s result, or that of the identical call already running."""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        return await asyncio.shield(task)
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() != "false"
+# Minimum cosine similarity between query embeddings to reuse an answer
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "256"))
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "3600"))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split()).strip(" ?!.")
+
+
+class AnswerCache:
+    """
+    Per-user cache of RAG answers (with their citations).
+    Lookups try the normalized query hash first, then the nearest cached query
+    embedding. A user's entries are dropped whenever their documents change.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, similarity: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.hits = 0
+        self.misses = 0
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def _entries(self, user_id: str) -> OrderedDict:
+        return self._users.setdefault(user_id, OrderedDict())
+
+    def _expire(self, entries: OrderedDict):
+        cutoff = time.time() - self.ttl_seconds
+        for key in [key for key, entry in entries.items() if entry["created_at"] < cutoff]:
+            del entries[key]
+
+    def get(self, user_id: str, query: str, query_embedding: list[float] | None = None) -> dict | None:
+        """Exact match by normalized query, or nearest match by embedding if one is given."""
+        key = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        with self._lock:
+            entries = self._entries(user_id)
+            self._expire(entries)
+            entry = entries.get(key)
+
+            if entry is None and query_embedding is not None and entries:
+                query_vector = _unit(query_embedding)
+                keys = list(entries)
+                matrix = np.stack([entries[k]["embedding"] for k in keys])
+                scores = matrix @ query_vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity:
+                    key = keys[best]
+                    entry = entries[key]
+
+            if entry is None:
+                if query_embedding is not None:
+                    self.misses += 1
+                return None
+            entries.move_to_end(key)
+            self.hits += 1
+            return {**entry["response"], "cached": True}
+
+    def contains(self, user_id: str, query: str) -> bool:
+        """Whether an exact-match answer is cached (does not count as a hit or refresh the entry)."""
+        key = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        with self._lock:
+            entry = self._users.get(user_id, {}).get(key)
+            return entry is not None and entry["created_at"] >= time.time() - self.ttl_seconds
+
+    def put(self, user_id: str, query: str, query_embedding: list[float], response: dict):
+        key = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        with self._lock:
+            entries = self._entries(user_id)
+            entries[key] = {
+                "embedding": _unit(query_embedding),
+                "response": response,
+                "created_at": time.time(),
+            }
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        """Drop a user's cached answers (called when their documents change)."""
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+def _unit(vector: list[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    return array / max(float(np.linalg.norm(array)), 1e-12)
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY)
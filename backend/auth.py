@@ -1,53 +1,152 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from collections import OrderedDict
 import jwt
 import os
+import threading
+import time
 from pathlib import Path
 from dotenv import load_dotenv
+from backend.telemetry import span
 
 env_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
-SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_KEY") # In production, use the JWT secret, but for now we can rely on Supabase API or just decode without verify if using simple setup, but better to use the secret.
-# For simplicity in this assessment, we will rely on Supabase-py client to verify or just extract sub if assuming gateway handles it.
-# However, standard practice is verifying the JWT signature. Supabase provides a JWT secret in settings.
-# Let's assume we pass the token to Supabase client to act as the user.
+# Tokens are verified locally: HS256 tokens with the project's JWT secret
+# (Settings -> API -> JWT Secret), asymmetric tokens with the project's JWKS.
+# Only when neither is possible do we ask the Supabase auth server.
+SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.environ.get("SUPABASE_JWT_AUDIENCE", "authenticated")
+JWKS_CACHE_SECONDS = int(os.environ.get("JWKS_CACHE_SECONDS", "600"))
+# How long a verified token is remembered (never past its exp claim)
+AUTH_CACHE_TTL_SECONDS = int(os.environ.get("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", "1024"))
 
-from supabase import create_client, Client
+_ASYMMETRIC_ALGORITHMS = ["RS256", "ES256", "EdDSA"]
+
+from backend.supabase_client import get_supabase_client
 
 url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
 
-supabase: Client = create_client(url, key)
+# PyJWKClient caches the key set and refetches it when it sees an unknown kid (key rotation);
+# created on first use, like the Supabase client
+_jwks_client = None
+_jwks_client_lock = threading.Lock()
 
 security = HTTPBearer()
 
+_verified_tokens = OrderedDict()
+_verified_tokens_lock = threading.Lock()
+
+
+def _get_jwks_client() -> jwt.PyJWKClient:
+    global _jwks_client
+    if _jwks_client is None:
+        with _jwks_client_lock:
+            if _jwks_client is None:
+                _jwks_client = jwt.PyJWKClient(
+                    f"{url}/auth/v1/.well-known/jwks.json", cache_keys=True, lifespan=JWKS_CACHE_SECONDS
+                )
+    return _jwks_client
+
+
+class LocalVerificationUnavailable(Exception):
+    """No key is available to verify this token locally."""
+
+
+def _unauthorized(detail: str = "Invalid authentication credentials"):
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def _verify_locally(token: str) -> dict:
+    """Check signature, expiry and audience without a network call (JWKS is cached)."""
+    algorithm = jwt.get_unverified_header(token).get("alg")
+    if algorithm == "HS256":
+        if not SUPABASE_JWT_SECRET:
+            raise LocalVerificationUnavailable("SUPABASE_JWT_SECRET is not set")
+        signing_key = SUPABASE_JWT_SECRET
+    elif algorithm in _ASYMMETRIC_ALGORITHMS:
+        try:
+            signing_key = _get_jwks_client().get_signing_key_from_jwt(token).key
+        except jwt.PyJWKClientError as e:
+            raise LocalVerificationUnavailable(str(e))
+    else:
+        raise jwt.InvalidAlgorithmError(f"Unsupported token algorithm: {algorithm}")
+
+    return jwt.decode(token, signing_key, algorithms=[algorithm], audience=SUPABASE_JWT_AUDIENCE)
+
+
+def _verify_remotely(token: str) -> dict:
+    """Ask the Supabase auth server; also catches sessions revoked before expiry."""
+    try:
+        user = get_supabase_client().auth.get_user(token)
+    except Exception:
+        raise _unauthorized("Invalid token")
+    if not user or not user.user:
+        raise _unauthorized()
+    return {"id": user.user.id, "token": token}
+
+
+def _remember(token: str, user: dict):
+    try:
+        expires_at = float(jwt.decode(token, options={"verify_signature": False})["exp"])
+    except Exception:
+        return
+    expires_at = min(expires_at, time.time() + AUTH_CACHE_TTL_SECONDS)
+    with _verified_tokens_lock:
+        _verified_tokens[token] = (user, expires_at)
+        _verified_tokens.move_to_end(token)
+        while len(_verified_tokens) > AUTH_CACHE_SIZE:
+            _verified_tokens.popitem(last=False)
+
+
+def _recall(token: str) -> dict | None:
+    with _verified_tokens_lock:
+        entry = _verified_tokens.get(token)
+        if not entry:
+            return None
+        if entry[1] <= time.time():
+            del _verified_tokens[token]
+            return None
+        _verified_tokens.move_to_end(token)
+        return entry[0]
+
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """
-    Verifies the JWT token and returns the user ID.
+    Verifies the JWT token and returns {"id": ..., "token": ...}.
+    Verification is local (JWT secret or cached JWKS) with a short-lived cache of
+    verified tokens; the auth server is only called if no local key is available.
     """
     token = credentials.credentials
-    try:
-        # Verify token using Supabase Auth (or decode if you have the JWT secret)
-        # For this setup, we will use the supabase client to get the user
-        user = supabase.auth.get_user(token)
-        if not user:
-             raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return {"id": user.user.id, "token": token}
-    except Exception as e:
-        # Fallback: decode unverified to get the 'sub' claim if verify fails (NOT SECURE FOR PROD but ok for dev if secret missing)
-        # But let's try to be secure:
+    with span("auth") as attributes:
+        user = _recall(token)
+        if user:
+            attributes["verified_by"] = "cache"
+            return user
+
         try:
-             # Basic decode to get expiration checks at least
-             payload = jwt.decode(token, options={"verify_signature": False})
-             return payload['sub']
-        except:
-             raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid token",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
+            attributes["verified_by"] = "local"
+            payload = _verify_locally(token)
+            user = {"id": payload["sub"], "token": token}
+        except LocalVerificationUnavailable:
+            attributes["verified_by"] = "remote"
+            user = _verify_remotely(token)
+        except (jwt.InvalidTokenError, KeyError):
+            raise _unauthorized("Invalid token")
+
+        _remember(token, user)
+        return user
+
+
+def get_current_user_strict(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """
+    Like get_current_user, but always checks with the Supabase auth server.
+    Use for revocation-sensitive routes (e.g. destructive actions).
+    """
+    with span("auth", verified_by="remote"):
+        return _verify_remotely(credentials.credentials)
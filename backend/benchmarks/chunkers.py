@@ -0,0 +1,108 @@
+"""
+Compare the chunking engines on chunk count, throughput and retrieval hit-rate.
+
+    python -m backend.benchmarks.chunkers [FILE ...] [--queries 200] [--top-k 1]
+
+Without files, a synthetic markdown corpus (headings, prose, tables) is used.
+Hit-rate is measured offline: short passages (a few consecutive sentences of one
+paragraph) sampled from the document are used as queries against a BM25 index
+of each chunker's output, and a query hits when one of the top-k chunks
+contains the whole passage (so passages cut by a chunk boundary miss).
+"""
+import argparse
+import math
+import random
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from backend.chunking import CHUNKERS, count_tokens, _SENTENCE_END
+from backend.utils import tokenize
+from backend.benchmarks.common import synthetic_corpus
+
+_PASSAGE_SENTENCES = 3
+_BOUNDARY_END = re.compile(r"([.!?:|]\s*|\n)$")
+
+
+class _BM25:
+    def __init__(self, docs: list[str], k1: float = 1.2, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.terms = [Counter(tokenize(doc)) for doc in docs]
+        self.lengths = [sum(t.values()) for t in self.terms]
+        self.avg_length = sum(self.lengths) / max(1, len(docs))
+        df = Counter(term for t in self.terms for term in t)
+        self.idf = {term: math.log(1 + (len(docs) - n + 0.5) / (n + 0.5)) for term, n in df.items()}
+
+    def top(self, query: str, k: int) -> list[int]:
+        query_terms = set(tokenize(query))
+        scores = []
+        for i, terms in enumerate(self.terms):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / self.avg_length)
+            for term in query_terms:
+                tf = terms.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return sorted(range(len(scores)), key=scores.__getitem__, reverse=True)[:k]
+
+
+def _segments(text: str, size: int = 3000) -> list[str]:
+    """Feed the chunkers page-sized segments, as ingestion does."""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def benchmark(text: str, queries: int, top_k: int, repeats: int = 3) -> list[dict]:
+    segments = _segments(text)
+    passages = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        sentences = _SENTENCE_END.split(paragraph.strip())
+        for i in range(len(sentences) - _PASSAGE_SENTENCES + 1):
+            passages.append(" ".join(sentences[i:i + _PASSAGE_SENTENCES]))
+    sample = random.Random(0).sample(passages, min(queries, len(passages)))
+
+    results = []
+    for name, chunker in CHUNKERS.items():
+        start = time.perf_counter()
+        for _ in range(repeats):
+            chunks = list(chunker(segments))
+        elapsed = (time.perf_counter() - start) / repeats
+
+        tokens = [count_tokens(chunk) for chunk in chunks]
+        index = _BM25(chunks)
+        hits = sum(1 for passage in sample if any(passage in chunks[i] for i in index.top(passage, top_k)))
+        results.append({
+            "chunker": name,
+            "chunks": len(chunks),
+            "avg_tokens": sum(tokens) / max(1, len(tokens)),
+            "max_tokens": max(tokens, default=0),
+            "embedded_tokens": sum(tokens),
+            "aligned_ends": sum(1 for c in chunks if _BOUNDARY_END.search(c)) / max(1, len(chunks)),
+            "mb_per_s": len(text.encode("utf-8")) / 1e6 / elapsed if elapsed else float("inf"),
+            "hit_rate": hits / max(1, len(sample)),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.files:
+        from backend.file_processor import iter_path_text
+        text = "".join(segment for path in args.files for segment in iter_path_text(path, Path(path).name))
+    else:
+        text = synthetic_corpus()
+    print(f"Corpus: {len(text):,} chars, {count_tokens(text):,} est. tokens")
+
+    columns = ["chunker", "chunks", "avg_tokens", "max_tokens", "embedded_tokens", "aligned_ends", "mb_per_s", "hit_rate"]
+    print(" ".join(f"{c:>15}" for c in columns))
+    for row in benchmark(text, args.queries, args.top_k):
+        print(" ".join(f"{row[c]:>15.3f}" if isinstance(row[c], float) else f"{row[c]:>15}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
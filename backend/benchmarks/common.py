@@ -0,0 +1,85 @@
+import random
+
+
+def synthetic_corpus(sections: int = 60, seed: int = 7) -> str:
+    """Markdown-like document: headed sections of prose plus the occasional table."""
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "tre", "sun", "dar", "vel", "io", "pra", "zen", "qui", "bo", "rast", "el"]
+    words = ["".join(rng.choice(syllables) for _ in range(rng.randint(1, 4))) for _ in range(3000)]
+
+    def sentence():
+        body = " ".join(rng.choice(words) for _ in range(rng.randint(8, 30)))
+        return body[0].upper() + body[1:] + rng.choice(".!?")
+
+    parts = []
+    for section in range(sections):
+        parts.append(f"## Section {section}: {rng.choice(words)} {rng.choice(words)}")
+        for _ in range(rng.randint(2, 6)):
+            parts.append(" ".join(sentence() for _ in range(rng.randint(2, 8))))
+        if section % 4 == 0:
+            rows = [f"| {rng.choice(words)} | {rng.randint(1, 999)} | {rng.choice(words)} |" for _ in range(rng.randint(5, 40))]
+            parts.append("| name | value | note |\n|---|---|---|\n" + "\n".join(rows))
+    return "\n\n".join(parts) + "\n"
+
+
+def make_pdf(lines_per_page: list[list[str]]) -> bytes:
+    """Minimal text PDF (Helvetica, one text line per entry) without extra dependencies."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(len(lines_per_page)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(lines_per_page)} >>")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, lines in enumerate(lines_per_page):
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        stream = "BT /F1 10 Tf 12 TL 40 760 Td " + " ".join(f"({line}) Tj T*" for line in escaped) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    out = "%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+
+def percentile(sorted_samples: list[float], fraction: float) -> float:
+    if not sorted_samples:
+        return float("nan")
+    index = min(len(sorted_samples) - 1, max(0, round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize(name: str, latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    """Throughput and latency percentiles (latencies in seconds, reported in ms)."""
+    samples = sorted(latencies)
+    return {
+        "name": name,
+        "count": len(samples),
+        "errors": errors,
+        "per_s": len(samples) / elapsed if elapsed else float("nan"),
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+    }
+
+
+def print_rows(rows: list[dict]):
+    """Print result dicts as an aligned table (union of their keys, in first-seen order)."""
+    if not rows:
+        return
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    widths = {c: max(len(c), *(len(_format(row.get(c))) for row in rows)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(_format(row.get(c)).rjust(widths[c]) for c in columns))
+
+
+def _format(value) -> str:
+    if value is None:
+        return "-"
+    return f"{value:.2f}" if isinstance(value, float) else str(value)
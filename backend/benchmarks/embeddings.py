@@ -0,0 +1,129 @@
+"""
+Recall loss, storage and search time of reduced-dimension and quantized embeddings.
+
+    python -m backend.benchmarks.embeddings [--dims 3072,1536,768] [--dtypes float32,int8,binary]
+    python -m backend.benchmarks.embeddings --embeddings docs.npy [--queries queries.npy]
+    python -m backend.benchmarks.embeddings --gemini   # embed a synthetic corpus (needs GEMINI_API_KEY)
+
+Every configuration is a LocalUserIndex (the same code the local retrieval backend
+runs); recall@k is measured against exact float32 search over the full-size vectors.
+Reduced sizes are prefixes of the full vectors, which is what output_dimensionality
+returns for gemini-embedding-001. Without --embeddings or --gemini the vectors are
+synthetic (clustered, with variance decaying over the dimensions like Matryoshka
+embeddings), so use real embeddings for numbers that carry over to production.
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from backend.benchmarks.common import print_rows, summarize, synthetic_corpus
+
+
+def synthetic_embeddings(n_docs: int, n_queries: int, dim: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    decay = 1 / np.sqrt(1 + np.arange(dim) / 32)
+    centers = rng.normal(size=(max(8, n_docs // 100), dim))
+    docs = centers[rng.integers(0, len(centers), n_docs)] + 0.7 * rng.normal(size=(n_docs, dim))
+    # Queries are perturbed documents, so each has a known neighbourhood
+    queries = docs[rng.choice(n_docs, n_queries, replace=False)] + 0.5 * rng.normal(size=(n_queries, dim))
+    return (docs * decay).astype(np.float32), (queries * decay).astype(np.float32)
+
+
+def gemini_embeddings(n_queries: int) -> tuple[np.ndarray, np.ndarray]:
+    import asyncio
+    from backend.gemini_service import EMBEDDING_DIMENSIONS, aget_embedding, aget_embeddings_batch
+    from backend.utils import recursive_character_text_splitter
+
+    if EMBEDDING_DIMENSIONS:
+        raise SystemExit("Unset EMBEDDING_DIMENSIONS: the baseline needs full-size embeddings")
+    text = synthetic_corpus(sections=300)
+    chunks = recursive_character_text_splitter(text, chunk_size=800, chunk_overlap=0)
+    sentences = [s.strip() for s in text.split(".") if len(s.split()) > 8][:n_queries]
+
+    async def embed():
+        docs = await aget_embeddings_batch(chunks)
+        queries = [await aget_embedding(s, task_type="retrieval_query") for s in sentences]
+        return docs, queries
+
+    docs, queries = asyncio.run(embed())
+    return np.asarray(docs, dtype=np.float32), np.asarray(queries, dtype=np.float32)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def bench_config(docs: np.ndarray, queries: np.ndarray, truth: list[set], dim: int, dtype: str,
+                 rescore_factor: int, k: int) -> dict:
+    from backend import vector_store
+    vector_store.LOCAL_INDEX_RESCORE_FACTOR = rescore_factor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = vector_store.LocalUserIndex(Path(tmp), dtype=dtype)
+        index.add([{"id": i, "content": "", "metadata": {}, "embedding": vector}
+                   for i, vector in enumerate(docs[:, :dim])])
+
+        hits, latencies = 0, []
+        for query, expected in zip(queries[:, :dim], truth):
+            start = time.perf_counter()
+            results = index.search(query, match_threshold=-1.0, match_count=k)
+            latencies.append(time.perf_counter() - start)
+            hits += len(expected & {row["id"] for row in results})
+
+        sizes = {name: os.path.getsize(os.path.join(tmp, name)) for name in ("vectors.bin", "scales.bin", "full.bin")
+                 if os.path.exists(os.path.join(tmp, name))}
+
+    label = f"{dim}d {dtype}" + (f" + rescore x{rescore_factor}" if index.rescore else "")
+    row = summarize(label, latencies, sum(latencies))
+    row[f"recall@{k}"] = hits / (len(truth) * k)
+    row["search_bytes_per_vector"] = (sizes["vectors.bin"] + sizes.get("scales.bin", 0)) / len(docs)
+    row["disk_bytes_per_vector"] = sum(sizes.values()) / len(docs)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--embeddings", help=".npy file of full-size document embeddings (N x D)")
+    parser.add_argument("--queries", help=".npy file of query embeddings (default: perturbed documents)")
+    parser.add_argument("--gemini", action="store_true", help="embed a synthetic corpus with the Gemini API")
+    parser.add_argument("--docs", type=int, default=20000, help="synthetic documents")
+    parser.add_argument("--dim", type=int, default=3072, help="synthetic full dimensionality")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--dims", default="3072,1536,768,256")
+    parser.add_argument("--dtypes", default="float32,float16,int8,binary")
+    parser.add_argument("--rescore-factor", type=int, default=10, help="for int8/binary; 0 disables rescoring")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.gemini:
+        docs, queries = gemini_embeddings(args.num_queries)
+    elif args.embeddings:
+        docs = np.load(args.embeddings).astype(np.float32)
+        if args.queries:
+            queries = np.load(args.queries).astype(np.float32)
+        else:
+            rng = np.random.default_rng(0)
+            picked = docs[rng.choice(len(docs), min(args.num_queries, len(docs)), replace=False)]
+            queries = picked + 0.3 * picked.std() * rng.normal(size=picked.shape).astype(np.float32)
+    else:
+        docs, queries = synthetic_embeddings(args.docs, args.num_queries, args.dim)
+    print(f"{len(docs):,} documents, {len(queries)} queries, {docs.shape[1]} dims")
+
+    # Ground truth: exact search over the full-size vectors
+    scores = _normalize(queries) @ _normalize(docs).T
+    truth = [set(np.argsort(-row)[:args.k].tolist()) for row in scores]
+
+    rows = []
+    for dim in [int(d) for d in args.dims.split(",") if int(d) <= docs.shape[1]]:
+        for dtype in args.dtypes.split(","):
+            rows.append(bench_config(docs, queries, truth, dim, dtype, args.rescore_factor, args.k))
+            if dtype == "binary" and args.rescore_factor:
+                # Show what the rescoring pass buys
+                rows.append(bench_config(docs, queries, truth, dim, dtype, 0, args.k))
+    print_rows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+"""
+Deterministic local stand-ins for the external services, for benchmarks.
+
+    from backend.benchmarks import fakes
+    gemini, db = fakes.install(workdir)   # before importing any backend module
+    from backend.main import app
+
+FakeGemini replaces `google.generativeai` (configurable latency, 429 injection,
+fixed-dimension embeddings), FakeSupabase replaces `supabase.create_client`
+(in-memory tables, the match_documents RPCs and per-token row filtering like
+RLS), and FakeRanker can stand in for the FlashRank model.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import numpy as np
+from backend.utils import tokenize
+
+
+class FakeResourceExhausted(Exception):
+    """Raised for injected rate limits; the message matches what the retry logic looks for."""
+
+    def __init__(self):
+        super().__init__("429 Resource has been exhausted (e.g. check quota).")
+
+
+def hashed_embedding(text: str, dim: int) -> list[float]:
+    """Feature-hashed bag of words: deterministic, and similar texts get similar vectors."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for term in tokenize(text) or [""]:
+        digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+class FakeGemini:
+    """
+    Stands in for the `google.generativeai` module.
+    Latencies are in milliseconds; `error_rate` is the probability that a call
+    fails with a 429 before doing any work.
+    """
+
+    def __init__(self, dim: int = 768, embed_latency_ms: float = 60, embed_item_ms: float = 2,
+                 first_token_ms: float = 300, tokens_per_second: float = 150, answer_tokens: int = 120,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.dim = dim
+        self.embed_latency_ms = embed_latency_ms
+        self.embed_item_ms = embed_item_ms
+        self.first_token_ms = first_token_ms
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def _maybe_fail(self, kind: str):
+        with self._rng_lock:
+            failed = self._rng.random() < self.error_rate
+        self.calls[kind] += 1
+        if failed:
+            self.calls["429"] += 1
+            raise FakeResourceExhausted()
+
+    def configure(self, **kwargs):
+        pass
+
+    def _embed(self, content, output_dimensionality: int | None = None) -> dict:
+        # Reduced sizes are prefixes of the full vector, like Matryoshka-trained models
+        dim = min(output_dimensionality or self.dim, self.dim)
+        if isinstance(content, list):
+            self.calls["embedded_texts"] += len(content)
+            return {"embedding": [hashed_embedding(text, self.dim)[:dim] for text in content]}
+        self.calls["embedded_texts"] += 1
+        return {"embedding": hashed_embedding(content, self.dim)[:dim]}
+
+    def _embed_delay(self, content) -> float:
+        items = len(content) if isinstance(content, list) else 1
+        return (self.embed_latency_ms + self.embed_item_ms * items) / 1000
+
+    def embed_content(self, model: str, content, task_type: str = None,
+                      output_dimensionality: int | None = None, **kwargs) -> dict:
+        self._maybe_fail("embed")
+        time.sleep(self._embed_delay(content))
+        return self._embed(content, output_dimensionality)
+
+    async def embed_content_async(self, model: str, content, task_type: str = None,
+                                  output_dimensionality: int | None = None, **kwargs) -> dict:
+        self._maybe_fail("embed")
+        await asyncio.sleep(self._embed_delay(content))
+        return self._embed(content, output_dimensionality)
+
+    def GenerativeModel(self, model_name: str, generation_config=None, **kwargs):
+        return _FakeModel(self)
+
+
+class _FakeModel:
+    def __init__(self, gemini: FakeGemini):
+        self.gemini = gemini
+
+    def _answer_words(self, prompt: str) -> list[str]:
+        sources = re.findall(r"\[Source (\d+)\]", prompt) or ["1"]
+        words = [f"word{i % 50}" for i in range(self.gemini.answer_tokens)]
+        words[-1] += f" [{sources[0]}]."
+        return words
+
+    def generate_content(self, prompt: str, **kwargs):
+        self.gemini._maybe_fail("generate")
+        words = self._answer_words(prompt)
+        time.sleep(self.gemini.first_token_ms / 1000 + len(words) / self.gemini.tokens_per_second)
+        return SimpleNamespace(text=" ".join(words))
+
+    async def generate_content_async(self, prompt: str, stream: bool = False, **kwargs):
+        self.gemini._maybe_fail("generate")
+        words = self._answer_words(prompt)
+        if stream:
+            return _FakeStream(words, self.gemini)
+        await asyncio.sleep(self.gemini.first_token_ms / 1000 + len(words) / self.gemini.tokens_per_second)
+        return SimpleNamespace(text=" ".join(words))
+
+
+class _FakeStream:
+    """Async iterator of response chunks (8 words each) paced at tokens_per_second."""
+
+    def __init__(self, words: list[str], gemini: FakeGemini):
+        self.words = words
+        self.gemini = gemini
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.gemini.first_token_ms / 1000)
+        for start in range(0, len(self.words), 8):
+            piece = self.words[start:start + 8]
+            await asyncio.sleep(len(piece) / self.gemini.tokens_per_second)
+            yield SimpleNamespace(text=" ".join(piece) + " ")
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class FakeDatabase:
+    """In-memory tables shared by every FakeSupabase client."""
+
+    def __init__(self, latency_ms: float = 5):
+        self.latency_ms = latency_ms
+        self.tables = {"documents": [], "chats": [], "messages": []}
+        self.calls = Counter()
+        self.lock = threading.RLock()
+        self._next_document_id = 1
+        self._matrices = {}  # user_id -> (version, ids, matrix)
+        self._versions = Counter()
+
+    def round_trip(self, kind: str):
+        self.calls[kind] += 1
+        time.sleep(self.latency_ms / 1000)
+
+    def new_id(self, table: str):
+        if table == "documents":
+            self._next_document_id += 1
+            return self._next_document_id - 1
+        return str(uuid.uuid4())
+
+    def changed(self, rows: list[dict]):
+        for row in rows:
+            if "user_id" in row:
+                self._versions[row["user_id"]] += 1
+
+    def user_matrix(self, user_id: str):
+        """Normalized embedding matrix of a user's documents (rebuilt after writes)."""
+        version = self._versions[user_id]
+        cached = self._matrices.get(user_id)
+        if cached and cached[0] == version:
+            return cached[1], cached[2]
+        rows = [row for row in self.tables["documents"] if row.get("user_id") == user_id]
+        matrix = np.array([row["embedding"] for row in rows], dtype=np.float32) if rows else np.zeros((0, 1))
+        if len(rows):
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        self._matrices[user_id] = (version, rows, matrix)
+        return rows, matrix
+
+
+def _column(row: dict, column: str):
+    if "->>" in column:
+        name, key = column.split("->>", 1)
+        value = (row.get(name) or {}).get(key)
+        return None if value is None else str(value)
+    return row.get(column)
+
+
+_COMPARISONS = {
+    "eq": lambda a, b: a == b, "neq": lambda a, b: a != b,
+    "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+}
+
+
+def _split_terms(expression: str) -> list[str]:
+    """Split a PostgREST logic list on the commas outside parentheses and quotes."""
+    terms, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(expression):
+        if char == '"':
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            terms.append(expression[start:i])
+            start = i + 1
+    terms.append(expression[start:])
+    return [term.strip() for term in terms if term.strip()]
+
+
+def _logic_filter(term: str):
+    """Row predicate for one PostgREST filter term: column.op.value, and(...) or or(...)."""
+    for combine, prefix in ((all, "and("), (any, "or(")):
+        if term.startswith(prefix) and term.endswith(")"):
+            predicates = [_logic_filter(t) for t in _split_terms(term[len(prefix):-1])]
+            return lambda row: combine(predicate(row) for predicate in predicates)
+
+    column, op, value = term.split(".", 2)
+    if op not in _COMPARISONS:
+        raise NotImplementedError(f"Filter operator {op} is not supported by the fake")
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+    compare = _COMPARISONS[op]
+
+    def predicate(row: dict) -> bool:
+        current = _column(row, column)
+        if current is None:
+            return False
+        # Filter values arrive as text; numeric columns are compared as numbers
+        if isinstance(current, (int, float)):
+            return compare(current, type(current)(value))
+        return compare(str(current), value)
+    return predicate
+
+
+class _FakeQuery:
+    """The subset of the PostgREST query builder the backend uses."""
+
+    def __init__(self, client: "FakeSupabase", table: str):
+        self.client = client
+        self.table = table
+        self.action = "select"
+        self.columns = None
+        self.values = None
+        self.returning = "representation"
+        self.filters = []
+        self.orders = []
+        self.offset = 0
+        self.max_rows = None
+
+    def select(self, columns: str = "*", **kwargs):
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, rows, returning: str = "representation", **kwargs):
+        self.action, self.values, self.returning = "insert", rows if isinstance(rows, list) else [rows], returning
+        return self
+
+    def update(self, values: dict, **kwargs):
+        self.action, self.values = "update", values
+        return self
+
+    def delete(self, **kwargs):
+        self.action = "delete"
+        return self
+
+    def eq(self, column: str, value):
+        self.filters.append(lambda row: _column(row, column) == (str(value) if "->>" in column else value))
+        return self
+
+    def in_(self, column: str, values):
+        values = set(values)
+        self.filters.append(lambda row: _column(row, column) in values)
+        return self
+
+    def or_(self, filters: str, **kwargs):
+        self.filters.append(_logic_filter(f"or({filters})"))
+        return self
+
+    def order(self, column: str, desc: bool = False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def range(self, start: int, end: int):
+        self.offset, self.max_rows = start, end - start + 1
+        return self
+
+    def limit(self, count: int):
+        self.max_rows = count
+        return self
+
+    def _visible(self, row: dict) -> bool:
+        user_id = self.client.user_id
+        if user_id is None:
+            return True
+        if self.table == "messages":
+            return any(chat["id"] == row.get("chat_id") and chat.get("user_id") == user_id
+                       for chat in self.client.db.tables["chats"])
+        return row.get("user_id", user_id) == user_id
+
+    def execute(self):
+        db = self.client.db
+        db.round_trip(f"{self.action}:{self.table}")
+        with db.lock:
+            table = db.tables.setdefault(self.table, [])
+            if self.action == "insert":
+                inserted = []
+                for values in self.values:
+                    row = {"id": db.new_id(self.table), "created_at": _now_iso(), **values}
+                    table.append(row)
+                    inserted.append(row)
+                db.changed(inserted)
+                data = [] if self.returning == "minimal" else [dict(row) for row in inserted]
+                return SimpleNamespace(data=data, count=None)
+
+            rows = [row for row in table if self._visible(row) and all(f(row) for f in self.filters)]
+            if self.action == "update":
+                for row in rows:
+                    row.update(self.values)
+                db.changed(rows)
+                return SimpleNamespace(data=[dict(row) for row in rows], count=None)
+            if self.action == "delete":
+                doomed = {id(row) for row in rows}
+                table[:] = [row for row in table if id(row) not in doomed]
+                db.changed(rows)
+                return SimpleNamespace(data=[dict(row) for row in rows], count=None)
+
+            for column, desc in reversed(self.orders):
+                rows.sort(key=lambda row: (_column(row, column) is None, _column(row, column)), reverse=desc)
+            end = None if self.max_rows is None else self.offset + self.max_rows
+            rows = rows[self.offset:end]
+            if self.columns:
+                rows = [{column: row.get(column) for column in self.columns} for row in rows]
+            return SimpleNamespace(data=[dict(row) for row in rows], count=None)
+
+
+class _FakeRpc:
+    def __init__(self, client: "FakeSupabase", name: str, params: dict):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        db = self.client.db
+        db.round_trip(f"rpc:{self.name}")
+        user_id = self.params.get("filter_user_id") or self.client.user_id
+        with db.lock:
+            if self.name == "update_document_metadata":
+                metadata = {update["id"]: update["metadata"] for update in self.params["updates"]}
+                rows = [row for row in db.tables["documents"]
+                        if row.get("user_id") == user_id and row["id"] in metadata
+                        and self.client.user_id in (None, user_id)]
+                for row in rows:
+                    row["metadata"] = metadata[row["id"]]
+                db.changed(rows)
+                return SimpleNamespace(data=None)
+            rows, matrix = db.user_matrix(user_id)
+            if self.name == "match_documents":
+                if not rows:
+                    return SimpleNamespace(data=[])
+                query = np.asarray(self.params["query_embedding"], dtype=np.float32)
+                query /= max(np.linalg.norm(query), 1e-12)
+                scores = matrix @ query
+                order = np.argsort(-scores)[:self.params["match_count"]]
+                data = [{
+                    "id": rows[i]["id"], "content": rows[i]["content"], "metadata": rows[i]["metadata"],
+                    "user_id": rows[i]["user_id"], "similarity": float(scores[i])
+                } for i in order if scores[i] > self.params["match_threshold"]]
+                return SimpleNamespace(data=data)
+            if self.name == "match_documents_lexical":
+                terms = set(tokenize(self.params["query_text"]))
+                scored = []
+                for row in rows:
+                    score = len(terms & set(tokenize(row["content"])))
+                    if score:
+                        scored.append((score, row))
+                scored.sort(key=lambda pair: pair[0], reverse=True)
+                data = [{
+                    "id": row["id"], "content": row["content"], "metadata": row["metadata"],
+                    "user_id": row["user_id"], "rank": float(score)
+                } for score, row in scored[:self.params["match_count"]]]
+                return SimpleNamespace(data=data)
+        raise NotImplementedError(f"RPC {self.name} is not implemented by the fake")
+
+
+class _FakeAuth:
+    def get_user(self, token: str):
+        import jwt
+        payload = jwt.decode(token, options={"verify_signature": False})
+        return SimpleNamespace(user=SimpleNamespace(id=payload["sub"]))
+
+
+class FakeSupabase:
+    """A Supabase client over a FakeDatabase; scoped clients only see their user's rows."""
+
+    def __init__(self, db: FakeDatabase, user_id: str | None = None):
+        self.db = db
+        self.user_id = user_id
+        self.auth = _FakeAuth()
+
+    def table(self, name: str) -> _FakeQuery:
+        return _FakeQuery(self, name)
+
+    def rpc(self, name: str, params: dict) -> _FakeRpc:
+        return _FakeRpc(self, name, params)
+
+
+class _FakeClientOptions:
+    def __init__(self, headers: dict | None = None):
+        self.headers = headers or {}
+
+    def replace(self, headers: dict | None = None, **kwargs):
+        return _FakeClientOptions(headers)
+
+
+class FakeRanker:
+    """
+    Pairwise FlashRank stand-in (tokenizer + ONNX session interface) scoring
+    query/passage term overlap, with a fixed cost per scored pair.
+    """
+    llm_model = None
+
+    def __init__(self, pair_ms: float = 1.5):
+        self.pair_ms = pair_ms
+        self.tokenizer = self
+        self.session = self
+
+    def encode_batch(self, pairs: list[list[str]]):
+        encoded = []
+        for query, passage in pairs:
+            overlap = len(set(tokenize(query)) & set(tokenize(passage)))
+            encoded.append(SimpleNamespace(ids=[overlap], type_ids=[0], attention_mask=[1]))
+        return encoded
+
+    def run(self, output_names, onnx_input: dict):
+        ids = onnx_input["input_ids"]
+        time.sleep(self.pair_ms * len(ids) / 1000)
+        return [ids.astype(np.float32) - 2.0]
+
+
+def make_token(user_id: str, secret: str, ttl_seconds: int = 3600) -> str:
+    """HS256 access token like Supabase issues (verified locally via SUPABASE_JWT_SECRET)."""
+    import jwt
+    now = int(time.time())
+    return jwt.encode({"sub": user_id, "aud": "authenticated", "iat": now, "exp": now + ttl_seconds},
+                      secret, algorithm="HS256")
+
+
+BENCH_JWT_SECRET = "benchmark-secret-not-for-production-use"
+
+
+def install(workdir: str, gemini: FakeGemini | None = None, db: FakeDatabase | None = None):
+    """
+    Point the backend at the fakes and at a scratch directory for its local
+    state (caches, job queue, indexes). Must run before backend modules are imported.
+    Returns (gemini, db).
+    """
+    if any(name in sys.modules for name in ("backend.gemini_service", "backend.supabase_client", "backend.auth")):
+        raise RuntimeError("fakes.install() must run before the backend services are imported")
+
+    gemini = gemini or FakeGemini()
+    db = db or FakeDatabase()
+
+    os.environ.update({
+        "GEMINI_API_KEY": "fake", "SUPABASE_URL": "http://supabase.invalid", "SUPABASE_KEY": "fake",
+        "SUPABASE_JWT_SECRET": BENCH_JWT_SECRET,
+    })
+    for name, path in [
+        ("EMBEDDING_CACHE_PATH", "embeddings.sqlite"), ("INGEST_JOBS_DB_PATH", "ingest_jobs.sqlite"),
+        ("INGEST_PAYLOAD_DIR", "ingest_payloads"), ("LOCAL_INDEX_DIR", "vectors"),
+        ("CRAWL_STATE_DB_PATH", "crawl_state.sqlite"),
+    ]:
+        os.environ.setdefault(name, os.path.join(workdir, path))
+
+    try:
+        import google
+    except ImportError:
+        google = types.ModuleType("google")
+        google.__path__ = []
+        sys.modules["google"] = google
+    google.generativeai = gemini
+    sys.modules["google.generativeai"] = gemini
+
+    def create_client(url: str, key: str, options: _FakeClientOptions | None = None):
+        user_id = None
+        authorization = (options.headers if options else {}).get("Authorization", "")
+        if authorization.startswith("Bearer "):
+            user_id = _FakeAuth().get_user(authorization[len("Bearer "):]).user.id
+        return FakeSupabase(db, user_id)
+
+    supabase_module = types.ModuleType("supabase")
+    supabase_module.create_client = create_client
+    supabase_module.Client = FakeSupabase
+    supabase_module.ClientOptions = _FakeClientOptions
+    sys.modules["supabase"] = supabase_module
+    return gemini, db
@@ -0,0 +1,299 @@
+"""
+End-to-end load test of the API against local fakes (no network, no API keys).
+
+    python -m backend.benchmarks.load [--users 4] [--clients 8] [--requests 20] [--stream] [--mixed]
+
+Each user ingests synthetic documents through POST /ingest (the job is polled
+to completion), then `--clients` concurrent clients send /chat (and with
+--stream, /chat/stream) requests, and each user's history is read back through
+the keyset-paginated /chats endpoints. With --mixed, the chat load is repeated while
+a second round of ingestion runs, to show chat latency under bulk embedding.
+Requests run in-process over the ASGI app, so the numbers measure the backend
+itself plus the configured fake latencies. Chat requests shed with a 503 are
+counted in the `shed` column, not in the latencies.
+"""
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from backend.benchmarks import fakes
+from backend.benchmarks.common import print_rows, summarize, synthetic_corpus
+
+
+class Shed(Exception):
+    """The API answered 503 (admission control rejected the request)."""
+
+
+async def _ingest(client, headers: dict, source: str, text: str, poll_seconds: float) -> tuple[float, float, dict]:
+    """Queue one text ingestion; returns (request latency, job duration, final job status)."""
+    start = time.perf_counter()
+    response = await client.post("/ingest", data={"text": text, "source": source}, headers=headers)
+    queued = time.perf_counter()
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    while True:
+        status = (await client.get(f"/ingest/jobs/{job_id}", headers=headers)).json()
+        if status["status"] in ("completed", "failed"):
+            return queued - start, time.perf_counter() - start, status
+        await asyncio.sleep(poll_seconds)
+
+
+async def bench_ingest(client, users: dict, docs_per_user: int, sections: int, first_doc: int = 0) -> list[dict]:
+    request_latencies, job_latencies = [], []
+    errors = chunks = 0
+
+    async def run(user_id: str, doc: int):
+        nonlocal errors, chunks
+        text = synthetic_corpus(sections=sections, seed=hash((user_id, doc)) % 10_000)
+        try:
+            request_latency, job_latency, status = await _ingest(
+                client, users[user_id], f"{user_id}-doc-{doc}.md", text, poll_seconds=0.05
+            )
+        except Exception as e:
+            print(f"[Load] Ingest failed: {e}")
+            errors += 1
+            return
+        if status["status"] != "completed":
+            print(f"[Load] Ingest job failed: {status['error']}")
+            errors += 1
+            return
+        request_latencies.append(request_latency)
+        job_latencies.append(job_latency)
+        chunks += status["chunks_committed"]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(user_id, doc) for user_id in users for doc in range(first_doc, first_doc + docs_per_user)))
+    elapsed = time.perf_counter() - start
+
+    jobs = summarize("ingest job (queued -> completed)", job_latencies, elapsed, errors)
+    jobs["chunks_per_s"] = chunks / elapsed if elapsed else None
+    return [summarize("POST /ingest", request_latencies, elapsed, errors), jobs]
+
+
+def _queries(sections: int, count: int, seed: int) -> list[str]:
+    """Sentences from the ingested corpus, so retrieval has something to find."""
+    text = synthetic_corpus(sections=sections, seed=seed)
+    sentences = [s.strip() for s in text.replace("!", ".").replace("?", ".").split(".") if len(s.split()) > 6]
+    rng = random.Random(seed)
+    # Distinct queries, so the answer cache only helps where a real workload would repeat
+    return [f"{rng.choice(sentences)} ({i})" for i in range(count)]
+
+
+async def _chat(client, headers: dict, query: str) -> float:
+    start = time.perf_counter()
+    response = await client.post("/chat", json={"query": query}, headers=headers)
+    if response.status_code == 503:
+        raise Shed(response.headers.get("retry-after"))
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def _chat_stream(app, headers: dict, query: str) -> tuple[float, float]:
+    """
+    Returns (time to first token, total time). Calls the ASGI app directly:
+    httpx's ASGITransport buffers the whole body, which would hide the streaming.
+    """
+    body = json.dumps({"query": query}).encode("utf-8")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream", "query_string": b"",
+        "root_path": "", "client": ("127.0.0.1", 0), "server": ("bench", 80),
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+                   + [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+    }
+    received = False
+    start = time.perf_counter()
+    first_token = None
+    status = None
+    events = b""
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()  # no disconnect while the response streams
+
+    async def send(message):
+        nonlocal first_token, status, events
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            events += message.get("body", b"")
+            if first_token is None and b"event: token" in events:
+                first_token = time.perf_counter() - start
+
+    await app(scope, receive, send)
+    total = time.perf_counter() - start
+    if status == 503:
+        raise Shed()
+    if status != 200:
+        raise RuntimeError(f"/chat/stream returned {status}")
+    if b"event: error" in events:
+        error = events.split(b"event: error", 1)[1].decode("utf-8", "replace").strip()
+        # Shed after the stream started: the error event carries retry_after instead of a 503
+        if '"retry_after"' in error:
+            raise Shed()
+        raise RuntimeError(error)
+    return (first_token if first_token is not None else total), total
+
+
+async def bench_chat(client, app, users: dict, clients: int, requests: int, sections: int, stream: bool,
+                     seed: int = 0) -> list[dict]:
+    user_ids = list(users)
+    latencies, first_tokens = [], []
+    errors = shed = 0
+
+    async def run(client_index: int):
+        nonlocal errors, shed
+        user_id = user_ids[client_index % len(user_ids)]
+        for query in _queries(sections, requests, seed=seed + client_index + (1000 if stream else 0)):
+            try:
+                if stream:
+                    first_token, total = await _chat_stream(app, users[user_id], query)
+                    first_tokens.append(first_token)
+                    latencies.append(total)
+                else:
+                    latencies.append(await _chat(client, users[user_id], query))
+            except Shed:
+                shed += 1
+            except Exception as e:
+                print(f"[Load] Chat failed: {e}")
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(i) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    if not stream:
+        return [{**summarize(f"POST /chat (clients {clients})", latencies, elapsed, errors), "shed": shed}]
+    return [
+        {**summarize(f"POST /chat/stream (clients {clients})", latencies, elapsed, errors), "shed": shed},
+        summarize("  time to first token", first_tokens, elapsed),
+    ]
+
+
+async def _pages(client, headers: dict, path: str, key: str, limit: int, latencies: list[float]) -> list[dict]:
+    """Follow next_cursor through a paginated history endpoint; returns every row."""
+    rows, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        start = time.perf_counter()
+        response = await client.get(path, params=params, headers=headers)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+        page = response.json()
+        rows += page[key]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return rows
+
+
+async def bench_history(client, users: dict, db: fakes.FakeDatabase, page_size: int) -> list[dict]:
+    """Page through every user's chats and their messages with keyset cursors (small pages, many cursors)."""
+    chat_latencies, message_latencies = [], []
+    errors = 0
+
+    async def run(user_id: str):
+        nonlocal errors
+        try:
+            chats = await _pages(client, users[user_id], "/chats", "chats", page_size, chat_latencies)
+            stored = [chat for chat in db.tables["chats"] if chat["user_id"] == user_id]
+            if sorted(chat["id"] for chat in chats) != sorted(chat["id"] for chat in stored):
+                raise RuntimeError(f"paged {len(chats)} chats, {len(stored)} stored")
+            for chat in chats:
+                await _pages(client, users[user_id], f"/chats/{chat['id']}/messages", "messages", 1, message_latencies)
+        except Exception as e:
+            print(f"[Load] History failed: {e}")
+            errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(user_id) for user_id in users))
+    elapsed = time.perf_counter() - start
+    return [
+        summarize(f"GET /chats (limit {page_size})", chat_latencies, elapsed, errors),
+        summarize("GET /chats/{id}/messages (limit 1)", message_latencies, elapsed),
+    ]
+
+
+async def run(args, gemini: fakes.FakeGemini, db: fakes.FakeDatabase):
+    import httpx
+    from backend import main
+    if args.fake_ranker:
+        from backend.reranker import rerank_service
+        rerank_service._ranker = fakes.FakeRanker()
+
+    users = {
+        f"00000000-0000-0000-0000-{i:012d}": {
+            "Authorization": f"Bearer {fakes.make_token(f'00000000-0000-0000-0000-{i:012d}', fakes.BENCH_JWT_SECRET)}"
+        }
+        for i in range(1, args.users + 1)
+    }
+
+    await main.startup()
+    rows = []
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            rows += await bench_ingest(client, users, args.docs_per_user, args.sections)
+            documents = len(db.tables["documents"])
+            rows += await bench_chat(client, main.app, users, args.clients, args.requests, args.sections, stream=False)
+            if args.stream:
+                rows += await bench_chat(client, main.app, users, args.clients, args.requests, args.sections, stream=True)
+            # Flush the write-behind chat writer, then read the history back page by page
+            await main.chat_writer.stop()
+            main.chat_writer.start()
+            rows += await bench_history(client, users, db, args.history_page_size)
+            if args.mixed:
+                ingest_rows, chat_rows = await asyncio.gather(
+                    bench_ingest(client, users, args.docs_per_user, args.sections, first_doc=args.docs_per_user),
+                    bench_chat(client, main.app, users, args.clients, args.requests, args.sections, stream=args.stream,
+                               seed=2000),
+                )
+                for row in chat_rows:
+                    row["name"] += " during ingest"
+                rows += ingest_rows + chat_rows
+                documents = len(db.tables["documents"])
+    finally:
+        await main.shutdown()
+
+    print(f"Indexed chunks: {documents:,}")
+    print_rows(rows)
+    print(f"Gemini calls: {dict(gemini.calls)}")
+    print(f"Database round trips: {dict(db.calls)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--docs-per-user", type=int, default=3)
+    parser.add_argument("--sections", type=int, default=40, help="size of each ingested document")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent chat clients")
+    parser.add_argument("--requests", type=int, default=20, help="chat requests per client")
+    parser.add_argument("--stream", action="store_true", help="also load /chat/stream (time to first token)")
+    parser.add_argument("--mixed", action="store_true", help="also run the chat load while documents are ingested")
+    parser.add_argument("--history-page-size", type=int, default=5, help="page size when reading /chats back")
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimensionality")
+    parser.add_argument("--embed-ms", type=float, default=60, help="fake embedding call latency")
+    parser.add_argument("--first-token-ms", type=float, default=300, help="fake generation latency to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=150)
+    parser.add_argument("--db-ms", type=float, default=5, help="fake database round-trip latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of Gemini calls failing with 429")
+    parser.add_argument("--real-ranker", dest="fake_ranker", action="store_false",
+                        help="rerank with the FlashRank model instead of FakeRanker")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        gemini, db = fakes.install(
+            workdir,
+            fakes.FakeGemini(dim=args.dim, embed_latency_ms=args.embed_ms, first_token_ms=args.first_token_ms,
+                             tokens_per_second=args.tokens_per_second, error_rate=args.error_rate),
+            fakes.FakeDatabase(latency_ms=args.db_ms),
+        )
+        asyncio.run(run(args, gemini, db))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Microbenchmarks for the CPU-bound stages: text splitting, file extraction and reranking.
+
+    python -m backend.benchmarks.micro [--only splitter,files,rerank] [--fake-ranker]
+
+Reranking uses the real FlashRank model (downloaded on first use) unless
+--fake-ranker is given.
+"""
+import argparse
+import asyncio
+import io
+import os
+import tempfile
+import time
+from backend.benchmarks.common import make_pdf, print_rows, summarize, synthetic_corpus
+from backend.utils import iter_text_chunks, recursive_character_text_splitter
+
+
+def _timed(func, repeats: int) -> list[float]:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_splitter(text: str, repeats: int) -> list[dict]:
+    megabytes = len(text.encode("utf-8")) / 1e6
+    rows = []
+    for name, func in [
+        ("recursive_character_text_splitter", lambda: recursive_character_text_splitter(text)),
+        ("iter_text_chunks", lambda: list(iter_text_chunks([text]))),
+    ]:
+        samples = _timed(func, repeats)
+        row = summarize(name, samples, sum(samples))
+        row["mb_per_s"] = megabytes / (sum(samples) / len(samples))
+        rows.append(row)
+    return rows
+
+
+def bench_files(text: str, pdf_pages: int, repeats: int) -> list[dict]:
+    from fastapi import UploadFile
+    from backend.file_processor import iter_path_text, process_file, shutdown_pdf_pool
+
+    lines = [line[:90] for line in text.splitlines() if line.strip()]
+    pdf = make_pdf([lines[(i * 50) % len(lines):(i * 50) % len(lines) + 50] for i in range(pdf_pages)])
+    txt = text.encode("utf-8")
+
+    rows = []
+    for name, filename, payload in [("process_file (txt)", "doc.txt", txt), ("process_file (pdf)", "doc.pdf", pdf)]:
+        samples = _timed(lambda: asyncio.run(process_file(UploadFile(file=io.BytesIO(payload), filename=filename))), repeats)
+        rows.append(summarize(name, samples, sum(samples)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "doc.pdf")
+        with open(path, "wb") as out:
+            out.write(pdf)
+        samples = _timed(lambda: list(iter_path_text(path, "doc.pdf")), repeats)
+        rows.append(summarize("iter_path_text (pdf, pool)", samples, sum(samples)))
+    shutdown_pdf_pool()
+    return rows
+
+
+async def _bench_rerank(passages: list[dict], queries: list[str], concurrency: int) -> dict:
+    from backend.reranker import rerank_service
+
+    latencies = []
+    queue = list(queries)
+
+    async def client():
+        while queue:
+            query = queue.pop()
+            start = time.perf_counter()
+            await rerank_service.rerank(query, passages)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(f"rerank x{len(passages)} (concurrency {concurrency})", latencies, time.perf_counter() - start)
+
+
+def bench_rerank(text: str, queries: int, fake_ranker: bool) -> list[dict]:
+    from backend.reranker import rerank_service
+    if fake_ranker:
+        from backend.benchmarks.fakes import FakeRanker
+        rerank_service._ranker = FakeRanker()
+
+    chunks = recursive_character_text_splitter(text, chunk_size=1500, chunk_overlap=0)
+    passages = [{"id": str(i), "text": chunk, "meta": {}} for i, chunk in enumerate(chunks[:15])]
+    sentences = [s.strip() for s in text.split(".") if len(s.split()) > 5]
+    rows = []
+    for concurrency in (1, 8):
+        # Distinct queries each round so the score cache does not hide model time
+        batch = [f"{sentences[(i * 7 + concurrency) % len(sentences)]} {concurrency}" for i in range(queries)]
+        rows.append(asyncio.run(_bench_rerank(passages, batch, concurrency)))
+    rerank_service.shutdown()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--only", default="splitter,files,rerank")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--pdf-pages", type=int, default=200)
+    parser.add_argument("--rerank-queries", type=int, default=64)
+    parser.add_argument("--fake-ranker", action="store_true")
+    args = parser.parse_args()
+
+    selected = set(args.only.split(","))
+    text = synthetic_corpus(sections=400)
+    print(f"Corpus: {len(text):,} chars")
+    rows = []
+    if "splitter" in selected:
+        rows += bench_splitter(text, args.repeats)
+    if "files" in selected:
+        rows += bench_files(text, args.pdf_pages, args.repeats)
+    if "rerank" in selected:
+        rows += bench_rerank(text, args.rerank_queries, args.fake_ranker)
+    print_rows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,81 @@
 from typing import List, Optional
 from uuid import UUID
+import base64
+import json
 from backend.supabase_client import get_scoped_client
 from backend.models import Chat, Message
 
-def get_user_chats(user_id: str, token: str) -> List[Chat]:
+# Columns returned by the history endpoints (no select("*"))
+CHAT_COLUMNS = "id, user_id, title, created_at"
+MESSAGE_COLUMNS = "id, chat_id, role, content, created_at"
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(row: dict) -> str:
+    """Opaque keyset cursor for the (created_at, id) position of a row."""
+    raw = json.dumps([row["created_at"], str(row["id"])])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    if not all(isinstance(v, str) and '"' not in v and "\\" not in v for v in (created_at, row_id)):
+        raise ValueError("Invalid cursor")
+    return created_at, row_id
+
+def _keyset_filter(cursor: str, op: str) -> str:
+    # (created_at, id) strictly before/after the cursor row; values are quoted for PostgREST
+    created_at, row_id = decode_cursor(cursor)
+    return f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}."{row_id}")'
+
+def _page(rows: list, limit: int) -> tuple[list, Optional[str]]:
+    # One extra row is fetched to know whether another page exists
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+def get_user_chats(user_id: str, token: str, limit: int = 50, cursor: Optional[str] = None) -> dict:
+    """Newest-first page of the user's chats: {"chats": [...], "next_cursor": ...}."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
     supabase = get_scoped_client(token)
-    response = supabase.table("chats") \
-        .select("*") \
+    query = supabase.table("chats") \
+        .select(CHAT_COLUMNS) \
         .order("created_at", desc=True) \
-        .execute()
-    return response.data
+        .order("id", desc=True) \
+        .limit(limit + 1)
+    if cursor:
+        query = query.or_(_keyset_filter(cursor, "lt"))
+    chats, next_cursor = _page(query.execute().data, limit)
+    return {"chats": chats, "next_cursor": next_cursor}
 
-def create_chat(user_id: str, token: str, title: str = "New Chat") -> Chat:
+def create_chat(user_id: str, token: str, title: str = "New Chat", chat_id: Optional[str] = None) -> Chat:
     supabase = get_scoped_client(token)
+    row = {"user_id": user_id, "title": title}
+    if chat_id:
+        row["id"] = chat_id
     response = supabase.table("chats") \
-        .insert({"user_id": user_id, "title": title}) \
+        .insert(row) \
         .execute()
     return response.data[0]
 
-def get_chat_messages(chat_id: str, user_id: str, token: str) -> List[Message]:
+def create_chats(chats: List[dict], token: str):
+    """Bulk insert chat rows (used by the write-behind chat writer)."""
     supabase = get_scoped_client(token)
-    response = supabase.table("messages") \
-        .select("*") \
+    supabase.table("chats").insert(chats, returning="minimal").execute()
+
+def get_chat_messages(chat_id: str, user_id: str, token: str, limit: int = 100, cursor: Optional[str] = None) -> dict:
+    """Oldest-first page of a chat's messages: {"messages": [...], "next_cursor": ...}."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    supabase = get_scoped_client(token)
+    query = supabase.table("messages") \
+        .select(MESSAGE_COLUMNS) \
         .eq("chat_id", chat_id) \
         .order("created_at", desc=False) \
-        .execute()
-    return response.data
+        .order("id", desc=False) \
+        .limit(limit + 1)
+    if cursor:
+        query = query.or_(_keyset_filter(cursor, "gt"))
+    messages, next_cursor = _page(query.execute().data, limit)
+    return {"messages": messages, "next_cursor": next_cursor}
 
 def save_message(chat_id: str, role: str, content: str, user_id: str, token: str) -> Message:
     supabase = get_scoped_client(token)
@@ -38,6 +88,11 @@ def save_message(chat_id: str, role: str, content: str, user_id: str, token: str
         .execute()
     return response.data[0]
 
+def save_messages(messages: List[dict], token: str):
+    """Bulk insert message rows (used by the write-behind chat writer)."""
+    supabase = get_scoped_client(token)
+    supabase.table("messages").insert(messages, returning="minimal").execute()
+
 def delete_chat(chat_id: str, user_id: str, token: str):
     supabase = get_scoped_client(token)
     supabase.table("chats").delete().eq("id", chat_id).execute()
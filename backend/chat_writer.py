@@ -0,0 +1,125 @@
+import asyncio
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from backend.chat_history import create_chats, save_messages
+from backend.telemetry import registry, span
+
+# Writes are coalesced for up to this long (or this many rows) before a flush
+CHAT_WRITE_FLUSH_MS = int(os.environ.get("CHAT_WRITE_FLUSH_MS", "50"))
+CHAT_WRITE_MAX_BATCH = int(os.environ.get("CHAT_WRITE_MAX_BATCH", "500"))
+CHAT_WRITE_RETRIES = 3
+
+dropped_rows = registry.counter("chat_write_dropped_rows_total", "Chat/message rows dropped after all write attempts", ("table",))
+
+
+def new_chat_id() -> str:
+    """Chat ids are generated here so a new chat needs no DB round trip before answering."""
+    return str(uuid.uuid4())
+
+
+def now_iso() -> str:
+    # Explicit timestamps keep message order when several rows land in one insert
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ChatWriter:
+    """
+    Write-behind persistence for chats and messages.
+    Routes enqueue rows and return immediately; a background task coalesces rows
+    from concurrent requests and writes them with one bulk insert per table and
+    token (inserts must go through the user's scoped client for RLS). Pending
+    rows are flushed on shutdown.
+    """
+
+    def __init__(self, flush_ms: int, max_batch: int):
+        self.flush_seconds = flush_ms / 1000
+        self.max_batch = max_batch
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop."""
+        if self._task:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+            self._queue = None
+
+    def write_chat(self, token: str, chat_id: str, user_id: str, title: str):
+        self._enqueue(token, "chats", {"id": chat_id, "user_id": user_id, "title": title, "created_at": now_iso()})
+
+    def write_message(self, token: str, chat_id: str, role: str, content: str, created_at: str | None = None):
+        self._enqueue(token, "messages", {
+            "chat_id": chat_id, "role": role, "content": content, "created_at": created_at or now_iso()
+        })
+
+    def _enqueue(self, token: str, table: str, row: dict):
+        if self._queue is None:
+            # Writer not running (e.g. outside the app): write through in the background
+            asyncio.get_running_loop().create_task(self._flush([(token, table, row)]))
+            return
+        self._queue.put_nowait((token, table, row))
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = asyncio.get_running_loop().time() + self.flush_seconds
+            while len(batch) < self.max_batch:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # Drain anything enqueued after the stop signal
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                remaining.append(item)
+        if remaining:
+            await self._flush(remaining)
+
+    async def _flush(self, batch: list[tuple]):
+        groups = OrderedDict()
+        for token, table, row in batch:
+            groups.setdefault(token, {"chats": [], "messages": []})[table].append(row)
+        await asyncio.gather(*(self._write_group(token, rows) for token, rows in groups.items()))
+
+    async def _write_group(self, token: str, rows: dict):
+        # Chats first: messages reference them
+        for table, write in (("chats", create_chats), ("messages", save_messages)):
+            if not rows[table]:
+                continue
+            for attempt in range(CHAT_WRITE_RETRIES):
+                try:
+                    with span(f"chat_write.{table}", rows=len(rows[table])):
+                        await asyncio.to_thread(write, rows[table], token)
+                    break
+                except Exception as e:
+                    if attempt == CHAT_WRITE_RETRIES - 1:
+                        dropped_rows.inc(len(rows[table]), table=table)
+                        print(f"[ChatWriter] Dropping {len(rows[table])} {table} rows after {CHAT_WRITE_RETRIES} attempts: {e}")
+                    else:
+                        print(f"[ChatWriter] Write of {len(rows[table])} {table} rows failed: {e}. Retrying...")
+                        await asyncio.sleep(0.5 * (2 ** attempt))
+
+
+chat_writer = ChatWriter(CHAT_WRITE_FLUSH_MS, CHAT_WRITE_MAX_BATCH)
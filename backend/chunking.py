@@ -0,0 +1,203 @@
+import os
+import re
+from typing import Iterable, Iterator
+from backend.utils import iter_text_chunks
+
+# Chunker used when an ingest does not choose one: "recursive" (character splitter) or "structured"
+DEFAULT_CHUNKER = os.environ.get("DEFAULT_CHUNKER", "recursive").lower()
+# Structured chunker sizing, in estimated embedding-model tokens
+CHUNK_TOKENS = int(os.environ.get("CHUNK_TOKENS", "900"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "40"))
+
+# Token estimate: one per punctuation mark and per (up to) 8 characters of a word
+_PIECE_PATTERN = re.compile(r"\w{1,8}|[^\w\s]")
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n\s*")
+_HEADING_LINE = re.compile(r"^(#{1,6}\s|[A-Z0-9][^\n.!?]{0,80}:$)")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+_ROW_LINE = re.compile(r"^\s*([|*+-]|\d+[.)])\s")
+
+
+# ASCII character classes of _PIECE_PATTERN: w (\w), space (\s) or p (punctuation)
+_ASCII_CLASSES = bytes(
+    ord("w") if re.match(r"\w", chr(i)) else ord(" ") if chr(i).isspace() else ord("p") for i in range(128)
+) + b"p" * 128
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate model token count (no tokenizer is shipped for Gemini).
+    Chunk sizes and the prompt context budget (context_packing) are both measured with it.
+    """
+    if text.isascii():
+        # Same count as _PIECE_PATTERN, with bytes operations instead of one match per piece:
+        # every punctuation mark, plus ceil(len / 8) for every run of word characters
+        classes = text.encode("ascii").translate(_ASCII_CLASSES)
+        punctuation = classes.count(b"p")
+        classes = b" " + classes.replace(b"p", b" ")
+        runs = classes.count(b" w")
+        # Characters after each run's first: one more token per full 8
+        return punctuation + runs + classes.replace(b" w", b"  ").count(b"wwwwwwww")
+    count = 0
+    for word in text.split():
+        # Plain words need no regex: str.isalnum() is \w without the underscore
+        if word.isalnum():
+            count += (len(word) + 7) // 8
+        else:
+            count += len(_PIECE_PATTERN.findall(word))
+    return count
+
+
+def _iter_paragraphs(segments: Iterable[str], max_chars: int) -> Iterator[str]:
+    """
+    Paragraphs (blank-line separated) across segment boundaries.
+    A paragraph still open at the end of a segment is carried into the next one;
+    past max_chars (e.g. text without blank lines) it is released at a line break.
+    """
+    carry = ""
+    for segment in segments:
+        text = carry + segment if carry else segment
+        start = 0
+        for match in _PARAGRAPH_BREAK.finditer(text):
+            if match.start() > start:
+                yield text[start:match.start()]
+            start = match.end()
+        carry = text[start:]
+        if len(carry) > max_chars:
+            # Release the long paragraph up to its last line break (or space)
+            cut = carry.rfind("\n")
+            if cut <= 0:
+                cut = carry.rfind(" ")
+            if cut <= 0:
+                cut = len(carry)
+            yield carry[:cut]
+            carry = carry[cut:].lstrip()
+    if carry.strip():
+        yield carry
+
+
+def _split_headings(paragraph: str) -> list[str]:
+    """Split a paragraph before heading lines that are not preceded by a blank line."""
+    if "\n#" not in paragraph:
+        return [paragraph]
+    lines = paragraph.split("\n")
+    parts = [[lines[0]]]
+    for line in lines[1:]:
+        if line.startswith("#") and _HEADING_LINE.match(line):
+            parts.append([line])
+        else:
+            parts[-1].append(line)
+    return ["\n".join(part) for part in parts]
+
+
+def _split_oversized(block: str, max_tokens: int) -> Iterator[tuple[str, int, str]]:
+    """Break a block larger than a chunk into rows (tables, lists), sentences, then words."""
+    lines = block.split("\n")
+    if len(lines) > 1 and sum(1 for line in lines if _ROW_LINE.match(line)) * 2 >= len(lines):
+        pieces, separator = lines, "\n"
+    else:
+        pieces, separator = _SENTENCE_END.split(block), " "
+
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if tokens <= max_tokens:
+            yield piece, tokens, separator
+            continue
+        # A single run-on sentence or row: fall back to word windows
+        words = piece.split()
+        window = []
+        window_tokens = 0
+        for word in words:
+            word_tokens = count_tokens(word)
+            if word_tokens > max_tokens:
+                # Unbroken text (e.g. base64): hard-cut it into chunk-sized slices
+                if window:
+                    yield " ".join(window), window_tokens, " "
+                    window, window_tokens = [], 0
+                for start in range(0, len(word), max_tokens * 4):
+                    fragment = word[start:start + max_tokens * 4]
+                    yield fragment, count_tokens(fragment), " "
+                continue
+            if window and window_tokens + word_tokens > max_tokens:
+                yield " ".join(window), window_tokens, " "
+                window, window_tokens = [], 0
+            window.append(word)
+            window_tokens += word_tokens
+        if window:
+            yield " ".join(window), window_tokens, " "
+
+
+def iter_structured_chunks(
+    segments: Iterable[str],
+    chunk_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> Iterator[str]:
+    """
+    Structure-aware chunker sized in tokens.
+    Text is split hierarchically (headings -> paragraphs -> sentences/table rows ->
+    words) and whole units are packed into chunks of at most `chunk_tokens`.
+    A heading starts a new chunk once the current one is half full, and up to
+    `overlap_tokens` of trailing sentences are repeated at the start of the next
+    chunk. Segments are consumed lazily in a single pass, like iter_text_chunks.
+    """
+    units = []  # (text, tokens, separator placed before the text)
+    total = 0
+    fresh = False  # whether units holds more than the overlap carried from the last chunk
+
+    def emit(keep_overlap: bool):
+        nonlocal units, total, fresh
+        fresh = False
+        chunk = units[0][0] + "".join(separator + text for text, _, separator in units[1:])
+        kept = []
+        kept_tokens = 0
+        if keep_overlap:
+            for unit in reversed(units[1:]):
+                if kept_tokens + unit[1] > overlap_tokens:
+                    break
+                kept.insert(0, unit)
+                kept_tokens += unit[1]
+        units, total = kept, kept_tokens
+        return chunk
+
+    for paragraph in _iter_paragraphs(segments, chunk_tokens * 16):
+        for block in _split_headings(paragraph.strip()):
+            if not block.strip():
+                continue
+            if _HEADING_LINE.match(block) and fresh and total >= chunk_tokens // 2:
+                yield emit(keep_overlap=False)
+
+            tokens = count_tokens(block)
+            pieces = [(block, tokens, "\n\n")] if tokens <= chunk_tokens else _split_oversized(block, chunk_tokens)
+            first = True
+            for text, piece_tokens, separator in pieces:
+                if first:
+                    separator, first = "\n\n", False
+                if fresh and total + piece_tokens > chunk_tokens:
+                    yield emit(keep_overlap=True)
+                    # Drop the overlap if it would not leave room for this piece
+                    if total + piece_tokens > chunk_tokens:
+                        units, total = [], 0
+                units.append((text, piece_tokens, separator))
+                total += piece_tokens
+                fresh = True
+
+    if fresh:
+        yield emit(keep_overlap=False)
+
+
+CHUNKERS = {
+    "recursive": iter_text_chunks,
+    "structured": iter_structured_chunks,
+}
+
+
+def chunker_name(name: str | None = None) -> str:
+    """Validated chunker name (defaults to DEFAULT_CHUNKER); raises ValueError for unknown names."""
+    name = (name or DEFAULT_CHUNKER).lower()
+    if name not in CHUNKERS:
+        raise ValueError(f"Unknown chunker '{name}'. Choose one of: {', '.join(CHUNKERS)}")
+    return name
+
+
+def get_chunker(name: str | None = None):
+    """Chunker function by name (defaults to DEFAULT_CHUNKER)."""
+    return CHUNKERS[chunker_name(name)]
@@ -0,0 +1,93 @@
+import os
+from backend.chunking import count_tokens
+
+# Prompt context budget shared by all retrieved passages, in the chunker's token estimate
+# (chunking.count_tokens). The default fits the five reranked chunks the prompt has always
+# carried, even at full size (4000 characters is about 800-850 tokens); a lower budget
+# trades answer recall for shorter, cheaper prompts
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "4500"))
+# Longest overlap looked for between neighbouring chunks of a source (chunk_overlap is 400)
+CONTEXT_MAX_OVERLAP_CHARS = int(os.environ.get("CONTEXT_MAX_OVERLAP_CHARS", "1000"))
+# A block trimmed to fewer tokens than this is dropped instead
+CONTEXT_MIN_BLOCK_TOKENS = int(os.environ.get("CONTEXT_MIN_BLOCK_TOKENS", "100"))
+
+
+def _overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    for size in range(min(len(left), len(right), CONTEXT_MAX_OVERLAP_CHARS), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _trim(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens, at a word boundary."""
+    words = text.split(" ")
+    tokens = 0
+    for kept, word in enumerate(words):
+        tokens += count_tokens(word)
+        if tokens > max_tokens:
+            return " ".join(words[:kept]).rstrip() + " ..."
+    return text
+
+
+def _merge_run(run: list[dict]) -> dict:
+    """Join consecutive chunks of one source, dropping the text they share."""
+    text = run[0]["text"]
+    for doc in run[1:]:
+        overlap = _overlap(text, doc["text"])
+        text += doc["text"][overlap:] if overlap else "\n" + doc["text"]
+    meta = {**run[0]["meta"], "chunk_indices": [doc["meta"].get("chunk_index") for doc in run]}
+    if "page_end" in run[-1]["meta"]:
+        meta["page_end"] = run[-1]["meta"]["page_end"]
+    return {"text": text, "meta": meta, "score": max(doc["score"] for doc in run)}
+
+
+def pack_context(docs: list[dict], token_budget: int = CONTEXT_TOKEN_BUDGET) -> list[dict]:
+    """
+    Assemble reranked passages ({"text", "meta", "score"}) into prompt blocks.
+    Duplicate chunks are dropped, neighbouring chunks of the same source are merged
+    without their overlapping text, and blocks are kept best-score-first until the
+    token budget is spent (the last one is trimmed to fit). Each returned block
+    becomes one citation.
+    """
+    seen = set()
+    unique = []
+    for doc in docs:
+        key = doc["meta"].get("content_hash") or doc["text"]
+        if key not in seen:
+            seen.add(key)
+            unique.append(doc)
+
+    # Group runs of consecutive chunk indices per source
+    by_source = {}
+    for doc in unique:
+        by_source.setdefault(doc["meta"].get("source"), []).append(doc)
+
+    blocks = []
+    for source_docs in by_source.values():
+        source_docs.sort(key=lambda d: d["meta"].get("chunk_index", -1))
+        run = [source_docs[0]]
+        for doc in source_docs[1:]:
+            previous = run[-1]["meta"].get("chunk_index")
+            index = doc["meta"].get("chunk_index")
+            if previous is not None and index == previous + 1:
+                run.append(doc)
+            else:
+                blocks.append(_merge_run(run))
+                run = [doc]
+        blocks.append(_merge_run(run))
+
+    blocks.sort(key=lambda b: b["score"], reverse=True)
+    packed = []
+    remaining = token_budget
+    for block in blocks:
+        tokens = count_tokens(block["text"])
+        if tokens > remaining:
+            if remaining < CONTEXT_MIN_BLOCK_TOKENS:
+                continue
+            block = {**block, "text": _trim(block["text"], remaining)}
+            tokens = count_tokens(block["text"])
+        packed.append(block)
+        remaining -= tokens
+    return packed
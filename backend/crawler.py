@@ -0,0 +1,263 @@
+import asyncio
+import hashlib
+import html
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator
+from urllib.parse import urldefrag, urljoin, urlparse
+import httpx
+from bs4 import BeautifulSoup
+from backend.scraper import USER_AGENT, extract_text
+
+# Per-URL validators and content hashes from earlier crawls (makes re-crawls conditional)
+CRAWL_STATE_DB_PATH = os.environ.get(
+    "CRAWL_STATE_DB_PATH", str(Path(__file__).parent / ".cache" / "crawl_state.sqlite")
+)
+CRAWL_MAX_PAGES = int(os.environ.get("CRAWL_MAX_PAGES", "100"))
+CRAWL_MAX_DEPTH = int(os.environ.get("CRAWL_MAX_DEPTH", "2"))
+# Requests in flight overall (also the connection pool size) and per host
+CRAWL_CONCURRENCY = int(os.environ.get("CRAWL_CONCURRENCY", "16"))
+CRAWL_PER_HOST_CONCURRENCY = int(os.environ.get("CRAWL_PER_HOST_CONCURRENCY", "4"))
+CRAWL_TIMEOUT_SECONDS = float(os.environ.get("CRAWL_TIMEOUT_SECONDS", "10"))
+# Pages larger than this are skipped
+CRAWL_MAX_PAGE_BYTES = int(os.environ.get("CRAWL_MAX_PAGE_BYTES", str(5 * 1024 * 1024)))
+
+_SITEMAP_LOC = re.compile(r"<loc>\s*(.*?)\s*</loc>", re.IGNORECASE | re.DOTALL)
+_SKIPPED_EXTENSIONS = (
+    ".pdf", ".zip", ".gz", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico",
+    ".css", ".js", ".mp3", ".mp4", ".woff", ".woff2",
+)
+
+
+class CrawlState:
+    """SQLite store of what each user's last crawl of a URL saw."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("pragma journal_mode=wal")
+            self._conn.execute(
+                "create table if not exists pages ("
+                " user_id text not null,"
+                " url text not null,"
+                " etag text,"
+                " last_modified text,"
+                " content_hash text,"
+                " links text,"
+                " fetched_at real not null,"
+                " primary key (user_id, url))"
+            )
+        return self._conn
+
+    def get(self, user_id: str, url: str) -> dict | None:
+        with self._lock:
+            row = self._connect().execute(
+                "select etag, last_modified, content_hash, links from pages where user_id = ? and url = ?",
+                (user_id, url)
+            ).fetchone()
+        if not row:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "content_hash": row[2], "links": json.loads(row[3] or "[]")}
+
+    def put(self, user_id: str, url: str, etag: str | None, last_modified: str | None,
+            content_hash: str, links: list[str]):
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "insert or replace into pages (user_id, url, etag, last_modified, content_hash, links, fetched_at)"
+                " values (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, url, etag, last_modified, content_hash, json.dumps(links), time.time())
+            )
+            conn.commit()
+
+
+crawl_state = CrawlState(CRAWL_STATE_DB_PATH)
+
+
+@dataclass
+class CrawledPage:
+    """A fetched page. `text` is None when it is unchanged since the last crawl."""
+    url: str
+    depth: int
+    text: str | None = None
+    content_hash: str | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+    links: list[str] = field(default_factory=list)
+    status: str = "changed"  # changed | not_modified | duplicate | skipped | failed
+
+    def commit(self, user_id: str):
+        """Record the page as ingested, so the next crawl can send conditional requests."""
+        crawl_state.put(user_id, self.url, self.etag, self.last_modified, self.content_hash, self.links)
+
+
+def _normalize(url: str) -> str:
+    return urldefrag(url)[0]
+
+
+def _parse_page(content: bytes, base_url: str) -> tuple[str, list[str]]:
+    """Text and absolute outgoing links of an HTML page (CPU-bound; run in a thread)."""
+    soup = BeautifulSoup(content, "html.parser")
+    links = []
+    for anchor in soup.find_all("a", href=True):
+        link = _normalize(urljoin(base_url, anchor["href"]))
+        if link.startswith(("http://", "https://")):
+            links.append(link)
+    return extract_text(soup), links
+
+
+class Crawler:
+    """
+    Async same-origin crawler (breadth-first over links, or a sitemap's URLs).
+    One pooled HTTP client is shared by all requests; concurrency is capped
+    overall and per host. Known pages are fetched with If-None-Match /
+    If-Modified-Since, so an unchanged page costs a single 304, and pages whose
+    extracted text matches a page already seen (this crawl or the last) are
+    reported as unchanged without their text.
+    """
+
+    def __init__(self, user_id: str, max_pages: int = CRAWL_MAX_PAGES, max_depth: int = CRAWL_MAX_DEPTH):
+        self.user_id = user_id
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.discovered = 0
+        self.fetched = 0
+        self._host_limits = {}
+        self._hashes_seen = set()
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(CRAWL_PER_HOST_CONCURRENCY)
+        return self._host_limits[host]
+
+    async def _fetch(self, client: httpx.AsyncClient, url: str, depth: int) -> CrawledPage:
+        page = CrawledPage(url=url, depth=depth)
+        previous = await asyncio.to_thread(crawl_state.get, self.user_id, url)
+        headers = {}
+        if previous:
+            if previous["etag"]:
+                headers["If-None-Match"] = previous["etag"]
+            if previous["last_modified"]:
+                headers["If-Modified-Since"] = previous["last_modified"]
+
+        try:
+            async with self._host_limit(url):
+                response = await client.get(url, headers=headers)
+        except httpx.HTTPError as e:
+            print(f"[Crawl] Failed to fetch {url}: {e}")
+            page.status = "failed"
+            return page
+        finally:
+            self.fetched += 1
+
+        if response.status_code == 304 and previous:
+            page.status = "not_modified"
+            page.links = previous["links"]
+            page.content_hash = previous["content_hash"]
+            self._hashes_seen.add(previous["content_hash"])
+            return page
+        content_type = response.headers.get("content-type", "")
+        if (response.status_code != 200 or "html" not in content_type
+                or len(response.content) > CRAWL_MAX_PAGE_BYTES):
+            page.status = "skipped"
+            return page
+
+        text, links = await asyncio.to_thread(_parse_page, response.content, str(response.url))
+        page.links = links
+        page.etag = response.headers.get("etag")
+        page.last_modified = response.headers.get("last-modified")
+        page.content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+        if page.content_hash in self._hashes_seen or not text.strip():
+            # Nothing to ingest; remember the validators so the next crawl gets a 304
+            page.status = "duplicate"
+            await asyncio.to_thread(page.commit, self.user_id)
+        elif previous and previous["content_hash"] == page.content_hash:
+            # Same text, new validators (e.g. server without ETag support)
+            page.status = "not_modified"
+            await asyncio.to_thread(page.commit, self.user_id)
+        else:
+            page.text = text
+        self._hashes_seen.add(page.content_hash)
+        return page
+
+    async def _sitemap_urls(self, client: httpx.AsyncClient, sitemap_url: str, levels: int = 2) -> list[str]:
+        """URLs listed in a sitemap (following sitemap indexes `levels` deep)."""
+        try:
+            response = await client.get(sitemap_url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            print(f"[Crawl] Could not read sitemap {sitemap_url}: {e}")
+            return []
+        urls = []
+        for loc in _SITEMAP_LOC.findall(response.text):
+            loc = _normalize(html.unescape(loc))
+            if loc.endswith(".xml") and levels > 0:
+                urls.extend(await self._sitemap_urls(client, loc, levels - 1))
+            else:
+                urls.append(loc)
+        return urls
+
+    async def crawl(self, start_url: str, sitemap: bool = False) -> AsyncIterator[CrawledPage]:
+        """
+        Yield pages as they are fetched (completion order, not discovery order).
+        With sitemap=True, the URLs come from `start_url` if it is a sitemap, or
+        from /sitemap.xml on its origin; otherwise links are followed up to max_depth.
+        """
+        start_url = _normalize(start_url)
+        origin = urlparse(start_url).netloc
+
+        def in_scope(url: str) -> bool:
+            parsed = urlparse(url)
+            return parsed.netloc == origin and not parsed.path.lower().endswith(_SKIPPED_EXTENSIONS)
+
+        limits = httpx.Limits(max_connections=CRAWL_CONCURRENCY, max_keepalive_connections=CRAWL_CONCURRENCY)
+        async with httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT}, limits=limits,
+            timeout=CRAWL_TIMEOUT_SECONDS, follow_redirects=True
+        ) as client:
+            if sitemap:
+                sitemap_url = start_url if start_url.endswith(".xml") else urljoin(start_url, "/sitemap.xml")
+                frontier = deque((url, 0) for url in await self._sitemap_urls(client, sitemap_url) if in_scope(url))
+                follow_links = False
+            else:
+                frontier = deque([(start_url, 0)])
+                follow_links = True
+
+            seen = {url for url, _ in frontier}
+            pending = set()
+            try:
+                while frontier or pending:
+                    while frontier and len(pending) < CRAWL_CONCURRENCY and self.discovered < self.max_pages:
+                        url, depth = frontier.popleft()
+                        self.discovered += 1
+                        pending.add(asyncio.create_task(self._fetch(client, url, depth)))
+                    if not pending:
+                        break
+
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        page = task.result()
+                        if follow_links and page.depth < self.max_depth:
+                            for link in page.links:
+                                if link not in seen and in_scope(link):
+                                    seen.add(link)
+                                    frontier.append((link, page.depth + 1))
+                        yield page
+            finally:
+                for task in pending:
+                    task.cancel()
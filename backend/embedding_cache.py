@@ -0,0 +1,192 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+
+# Persistent store location and limits
+EMBEDDING_CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE_PATH", str(Path(__file__).parent / ".cache" / "embeddings.sqlite")
+)
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+EMBEDDING_CACHE_LRU_SIZE = int(os.environ.get("EMBEDDING_CACHE_LRU_SIZE", "2048"))
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() != "false"
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different copies of a chunk share a key."""
+    return " ".join(text.split())
+
+
+def cache_key(model: str, task_type: str, text: str) -> str:
+    """Content-addressed key: (model, task_type, normalized text hash)."""
+    text_hash = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{task_type}:{text_hash}"
+
+
+class EmbeddingCache:
+    """
+    Two-level embedding cache: an in-process LRU in front of a SQLite store.
+    Vectors are stored as float32 blobs; the store is trimmed to `max_bytes`
+    by evicting the least recently used rows. The stored byte total is kept in a
+    one-row table, updated in the same transaction as the rows, so a put never
+    has to scan the store.
+    """
+
+    def __init__(self, path: str, max_bytes: int, lru_size: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lru_size = lru_size
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._total_bytes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("pragma journal_mode=wal")
+            self._conn.execute(
+                "create table if not exists embeddings ("
+                " key text primary key,"
+                " vector blob not null,"
+                " size integer not null,"
+                " last_access real not null)"
+            )
+            # Covers the eviction scan, which then never reads the (overflowing) vector blobs
+            self._conn.execute("drop index if exists embeddings_last_access")
+            self._conn.execute(
+                "create index if not exists embeddings_lru on embeddings (last_access, key, size)"
+            )
+            self._conn.execute(
+                "create table if not exists embeddings_size ("
+                " id integer primary key check (id = 0),"
+                " total integer not null)"
+            )
+            row = self._conn.execute("select total from embeddings_size where id = 0").fetchone()
+            if row is None:
+                # First open of a store created before the total was tracked
+                total = self._conn.execute("select coalesce(sum(size), 0) from embeddings").fetchone()[0]
+                self._conn.execute("insert into embeddings_size (id, total) values (0, ?)", (total,))
+                self._conn.commit()
+            else:
+                total = row[0]
+            self._total_bytes = total
+        return self._conn
+
+    def _remember(self, key: str, embedding: list[float]):
+        self._lru[key] = embedding
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get_many(self, model: str, task_type: str, texts: list[str]) -> dict[int, list[float]]:
+        """Look up several texts; returns {index: embedding} for the hits."""
+        found = {}
+        with self._lock:
+            missing = {}
+            for i, text in enumerate(texts):
+                key = cache_key(model, task_type, text)
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[i] = self._lru[key]
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing:
+                conn = self._connect()
+                keys = list(missing)
+                # Stay under SQLite's bound-parameter limit
+                for start in range(0, len(keys), 500):
+                    part = keys[start:start + 500]
+                    placeholders = ",".join("?" * len(part))
+                    rows = conn.execute(
+                        f"select key, vector from embeddings where key in ({placeholders})", part
+                    ).fetchall()
+                    for key, blob in rows:
+                        embedding = array("f", blob).tolist()
+                        self._remember(key, embedding)
+                        for i in missing[key]:
+                            found[i] = embedding
+                    if rows:
+                        conn.executemany(
+                            "update embeddings set last_access = ? where key = ?",
+                            [(time.time(), key) for key, _ in rows]
+                        )
+                conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+    def get(self, model: str, task_type: str, text: str) -> list[float] | None:
+        return self.get_many(model, task_type, [text]).get(0)
+
+    def put_many(self, model: str, task_type: str, texts: list[str], embeddings: list[list[float]]):
+        """Store embeddings for texts and evict old rows if over the size limit."""
+        now = time.time()
+        rows = {}
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = cache_key(model, task_type, text)
+                blob = array("f", embedding).tobytes()
+                rows[key] = (key, blob, len(blob), now)
+                self._remember(key, embedding)
+
+            conn = self._connect()
+            # Rows being replaced (e.g. two workers embedding the same text) no longer count
+            keys = list(rows)
+            replaced = 0
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                replaced += conn.execute(
+                    f"select coalesce(sum(size), 0) from embeddings where key in ({placeholders})", part
+                ).fetchone()[0]
+            conn.executemany(
+                "insert or replace into embeddings (key, vector, size, last_access) values (?, ?, ?, ?)",
+                rows.values()
+            )
+            total = self._total_bytes + sum(row[2] for row in rows.values()) - replaced
+            if total > self.max_bytes:
+                total -= self._evict(conn, total)
+            conn.execute("update embeddings_size set total = ? where id = 0", (total,))
+            conn.commit()
+            self._total_bytes = total
+
+    def put(self, model: str, task_type: str, text: str, embedding: list[float]):
+        self.put_many(model, task_type, [text], [embedding])
+
+    def _evict(self, conn: sqlite3.Connection, total: int) -> int:
+        """Delete least recently used rows; returns the bytes freed."""
+        # Drop least recently used rows until we are back under ~90% of the limit
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        stale = []
+        for key, size in conn.execute("select key, size from embeddings order by last_access"):
+            if total - freed <= target:
+                break
+            stale.append((key,))
+            freed += size
+        conn.executemany("delete from embeddings where key = ?", stale)
+        for (key,) in stale:
+            self._lru.pop(key, None)
+        print(f"[EmbeddingCache] Evicted {len(stale)} entries ({freed} bytes)")
+        return freed
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES, EMBEDDING_CACHE_LRU_SIZE)
@@ -1,39 +1,217 @@
 from fastapi import UploadFile, HTTPException
+from typing import BinaryIO, Iterator
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import asyncio
+import codecs
+import multiprocessing
+import os
+import signal
+import threading
 import pypdf
-import io
 
-async def process_file(file: UploadFile) -> str:
+# Block size for streaming plain-text uploads
+TEXT_READ_BLOCK_SIZE = 1024 * 1024
+
+# PDF extraction: worker processes, pages per task, and how long a single page may take
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "8"))
+PDF_PAGE_TIMEOUT_SECONDS = int(os.environ.get("PDF_PAGE_TIMEOUT_SECONDS", "30"))
+
+class PageText(str):
+    """Text of one PDF page; `page` is its 1-based page number (kept in chunk metadata)."""
+
+    def __new__(cls, text: str, page: int):
+        segment = super().__new__(cls, text)
+        segment.page = page
+        return segment
+
+class ExtractionProgress:
+    """How much of a document has been extracted: pages for PDFs, bytes for text."""
+
+    def __init__(self):
+        self.done = 0
+        self.total = 0
+
+def iter_file_text(file: UploadFile) -> Iterator[str]:
     """
-    Extract text content from uploaded file (PDF or TXT).
+    Stream text content from an uploaded file (PDF or TXT) segment by segment.
+    PDFs yield one page at a time; text files yield decoded blocks. The upload is
+    read from its spooled file, so the whole document is never held in memory.
     """
-    content = ""
-    
     if file.filename.endswith(".pdf"):
-        try:
-            # Read PDF file
-            pdf_bytes = await file.read()
-            pdf_reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
-            
-            # Extract text from each page
-            for page in pdf_reader.pages:
-                text = page.extract_text()
-                if text:
-                    content += text + "\n"
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
-            
+        return _iter_pdf_pages(file.file)
     elif file.filename.endswith(".txt") or file.filename.endswith(".md"):
-        try:
-            # Read text file
-            content_bytes = await file.read()
-            content = content_bytes.decode("utf-8")
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f"Error reading text file: {str(e)}")
-            
+        return _iter_text_blocks(file.file)
+    else:
+        raise HTTPException(status_code=400, detail="Unsupported file format. Please upload .pdf, .txt, or .md")
+
+def iter_path_text(path: str, filename: str, progress: ExtractionProgress | None = None) -> Iterator[str]:
+    """
+    Like iter_file_text, for a document saved on disk (used by background ingest jobs).
+    PDF pages are extracted in parallel by the PDF process pool.
+    """
+    if filename.endswith(".pdf"):
+        return _iter_pdf_pages_parallel(path, progress)
+    elif filename.endswith(".txt") or filename.endswith(".md"):
+        iter_segments = _iter_text_blocks
     else:
         raise HTTPException(status_code=400, detail="Unsupported file format. Please upload .pdf, .txt, or .md")
-        
+
+    def generate():
+        with open(path, "rb") as stream:
+            yield from iter_segments(stream, progress)
+    return generate()
+
+def _iter_pdf_pages(stream: BinaryIO, progress: ExtractionProgress | None = None) -> Iterator[str]:
+    try:
+        pdf_reader = pypdf.PdfReader(stream)
+        if progress:
+            progress.total = len(pdf_reader.pages)
+        # Extract text from each page lazily
+        for number, page in enumerate(pdf_reader.pages, start=1):
+            text = page.extract_text()
+            if progress:
+                progress.done += 1
+            if text:
+                yield PageText(text + "\n", number)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+class _PageTimeout(Exception):
+    pass
+
+def _raise_page_timeout(signum, frame):
+    raise _PageTimeout()
+
+def _extract_page_range(path: str, start: int, stop: int, page_timeout: int) -> list[tuple[int, str]]:
+    """
+    Runs in a worker process: extract pages [start, stop); a page over the timeout yields ''.
+    The reader only lives for this call, so an idle worker holds no parsed document.
+    """
+    # SIGALRM is Unix-only; elsewhere pages run without a timeout
+    use_alarm = page_timeout > 0 and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_page_timeout)
+    pages = []
+    with open(path, "rb") as stream:
+        reader = pypdf.PdfReader(stream)
+        for index in range(start, stop):
+            try:
+                if use_alarm:
+                    signal.alarm(page_timeout)
+                text = reader.pages[index].extract_text() or ""
+            except _PageTimeout:
+                print(f"[PDF] Page {index + 1} of {path} timed out after {page_timeout}s; skipped")
+                text = ""
+            finally:
+                if use_alarm:
+                    signal.alarm(0)
+            pages.append((index + 1, text))
+    return pages
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # Spawned, not forked: forking the threaded server could copy held locks into the workers
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pdf_pool
+
+def shutdown_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+            _pdf_pool = None
+
+def _iter_pdf_pages_parallel(path: str, progress: ExtractionProgress | None = None) -> Iterator[str]:
+    """
+    Extract PDF pages in the process pool, split into PDF_PAGES_PER_TASK ranges.
+    At most two ranges per worker are in flight and pages are yielded in order,
+    so memory stays bounded while extraction scales with cores.
+    Small documents (or PDF_EXTRACT_WORKERS=1) are extracted in-process.
+    """
+    try:
+        with open(path, "rb") as stream:
+            page_count = len(pypdf.PdfReader(stream).pages)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
+
+    if PDF_EXTRACT_WORKERS <= 1 or page_count <= PDF_PAGES_PER_TASK:
+        with open(path, "rb") as stream:
+            yield from _iter_pdf_pages(stream, progress)
+        return
+
+    if progress:
+        progress.total = page_count
+    pool = _get_pdf_pool()
+    ranges = iter(range(0, page_count, PDF_PAGES_PER_TASK))
+    in_flight = deque()
+
+    def submit_next():
+        start = next(ranges, None)
+        if start is not None:
+            stop = min(start + PDF_PAGES_PER_TASK, page_count)
+            in_flight.append((stop - start, pool.submit(
+                _extract_page_range, path, start, stop, PDF_PAGE_TIMEOUT_SECONDS
+            )))
+
+    for _ in range(PDF_EXTRACT_WORKERS * 2):
+        submit_next()
+    try:
+        while in_flight:
+            size, future = in_flight.popleft()
+            # Backstop in case a page cannot be interrupted by its own timeout
+            pages = future.result(timeout=PDF_PAGE_TIMEOUT_SECONDS * size + 60 if PDF_PAGE_TIMEOUT_SECONDS > 0 else None)
+            submit_next()
+            if progress:
+                progress.done += size
+            for number, text in pages:
+                if text:
+                    yield PageText(text + "\n", number)
+    except FutureTimeoutError:
+        raise HTTPException(status_code=400, detail="Error reading PDF: page extraction timed out")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+
+def _iter_text_blocks(stream: BinaryIO, progress: ExtractionProgress | None = None) -> Iterator[str]:
+    try:
+        if progress:
+            progress.total = stream.seek(0, 2)
+            stream.seek(0)
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        while True:
+            block = stream.read(TEXT_READ_BLOCK_SIZE)
+            if progress:
+                progress.done += len(block)
+            text = decoder.decode(block, final=not block)
+            if text:
+                yield text
+            if not block:
+                break
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error reading text file: {str(e)}")
+
+async def process_file(file: UploadFile) -> str:
+    """
+    Extract text content from uploaded file (PDF or TXT).
+    Prefer iter_file_text for large uploads; this joins the whole document.
+    """
+    segments = iter_file_text(file)
+    content = await asyncio.to_thread(lambda: "".join(segments))
+
     if not content.strip():
         raise HTTPException(status_code=400, detail="File is empty or could not extract text")
-        
+
     return content
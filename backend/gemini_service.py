@@ -1,8 +1,15 @@
+import asyncio
+import hashlib
+import math
+import random
+import threading
 import time
-import google.generativeai as genai
 import os
 from pathlib import Path
 from dotenv import load_dotenv
+from backend.admission import AdmissionController, INTERACTIVE, Overloaded, SingleFlight, call_priority
+from backend.embedding_cache import embedding_cache, EMBEDDING_CACHE_ENABLED
+from backend.telemetry import registry
 
 env_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path=env_path)
@@ -12,82 +19,348 @@ GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     raise ValueError("Gemini API Key not found")
 
-genai.configure(api_key=GEMINI_API_KEY)
-
 # Initialize models
 embedding_model = "models/gemini-embedding-001"
+# Output dimensionality of the embeddings (e.g. 768 or 1536; 0 keeps the model's full 3072).
+# The documents table must use the same size (see reduced_embeddings.sql).
+EMBEDDING_DIMENSIONS = int(os.environ.get("EMBEDDING_DIMENSIONS", "0"))
+# Cached vectors are keyed by model and size, so changing the size never serves stale vectors
+embedding_cache_model = f"{embedding_model}:{EMBEDDING_DIMENSIONS}d" if EMBEDDING_DIMENSIONS else embedding_model
 # Use gemini-flash-latest for best stability
-generative_model = genai.GenerativeModel('models/gemini-flash-latest', generation_config={"response_mime_type": "text/plain"})
+GENERATIVE_MODEL_NAME = "models/gemini-flash-latest"
+
+# The SDK (and its gRPC stack) is imported and configured on first use, not at import
+_genai = None
+_generative_model = None
+_init_lock = threading.Lock()
+
+def _client():
+    """The configured google.generativeai module (thread-safe lazy init)."""
+    global _genai
+    if _genai is None:
+        with _init_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=GEMINI_API_KEY)
+                _genai = genai
+    return _genai
+
+def _model():
+    """The generative model client, created on first use."""
+    global _generative_model
+    if _generative_model is None:
+        genai = _client()
+        with _init_lock:
+            if _generative_model is None:
+                _generative_model = genai.GenerativeModel(
+                    GENERATIVE_MODEL_NAME, generation_config={"response_mime_type": "text/plain"}
+                )
+    return _generative_model
+
+def _embed_args(content, task_type: str) -> dict:
+    args = {"model": embedding_model, "content": content, "task_type": task_type}
+    if EMBEDDING_DIMENSIONS:
+        args["output_dimensionality"] = EMBEDDING_DIMENSIONS
+    return args
+
+def _unit(vector: list[float]) -> list[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+def _embedding_result(result):
+    """The embedding(s) of an embed_content result; reduced-size outputs are not unit length, so normalize them."""
+    embedding = result['embedding']
+    if not EMBEDDING_DIMENSIONS:
+        return embedding
+    if embedding and isinstance(embedding[0], list):
+        return [_unit(vector) for vector in embedding]
+    return _unit(embedding)
+
+def warmup():
+    """Import and configure the SDK ahead of the first request (makes no API call)."""
+    _model()
+
+# Retry metrics, labelled by the wrapped function
+retries_total = registry.counter("gemini_retries_total", "Gemini calls retried after a retryable error", ("function",))
+backoff_seconds_total = registry.counter("gemini_backoff_seconds_total", "Time spent waiting between retries", ("function",))
+retries_exhausted_total = registry.counter(
+    "gemini_retries_exhausted_total", "Gemini calls that failed after every retry", ("function",)
+)
+
+
+# Batch embedding limits. The API accepts up to 100 texts per batchEmbedContents call.
+EMBED_BATCH_MAX = int(os.environ.get("EMBED_BATCH_MAX", "100"))
+# Rough per-request token budget (estimated at ~4 characters per token)
+EMBED_BATCH_TOKEN_BUDGET = int(os.environ.get("EMBED_BATCH_TOKEN_BUDGET", "20000"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for request budgeting."""
+    return max(1, len(text) // 4)
+
+
+def _is_payload_error(error: Exception) -> bool:
+    """
+    True if the request was rejected for being too large rather than transient.
+    Only explicit size errors count: a split batch is retried as two requests, which
+    must not happen for rate limits or quotas ("too many requests", "quota exceeded").
+    """
+    error_str = str(error).lower()
+    # google.api_core.exceptions.InvalidArgument (400), matched by name so the check
+    # does not import the client library; a rejected API key is also a 400
+    if type(error).__name__ == "InvalidArgument" and "api key" not in error_str:
+        return True
+    return any(x in error_str for x in ["payload size", "too large", "request exceeds the maximum"])
+
+
+def _pack_batch(texts: list[str], start: int, size: int) -> list[str]:
+    """Take the next batch within the size and token budget (always at least one text)."""
+    batch = [texts[start]]
+    tokens = estimate_tokens(texts[start])
+    while len(batch) < size and start + len(batch) < len(texts):
+        next_tokens = estimate_tokens(texts[start + len(batch)])
+        if tokens + next_tokens > EMBED_BATCH_TOKEN_BUDGET:
+            break
+        batch.append(texts[start + len(batch)])
+        tokens += next_tokens
+    return batch
+
+
+async def _lookup_cached(texts: list[str]):
+    """Split texts into cache hits and misses; returns (embeddings, miss_indexes)."""
+    if not EMBEDDING_CACHE_ENABLED:
+        return [None] * len(texts), list(range(len(texts)))
+    # The cache is SQLite-backed, so it is read off the event loop
+    found = await asyncio.to_thread(embedding_cache.get_many, embedding_cache_model, "retrieval_document", texts)
+    embeddings = [found.get(i) for i in range(len(texts))]
+    return embeddings, [i for i in range(len(texts)) if i not in found]
+
+
+async def _fill_misses(texts: list[str], embeddings: list, misses: list[int], miss_embeddings: list[list[float]]):
+    for i, embedding in zip(misses, miss_embeddings):
+        embeddings[i] = embedding
+    if EMBEDDING_CACHE_ENABLED and misses:
+        await asyncio.to_thread(
+            embedding_cache.put_many, embedding_cache_model, "retrieval_document", [texts[i] for i in misses], miss_embeddings
+        )
+    return embeddings
+
+
+# --- Client ---
+# Every call is async, so that backoff and API latency never block the event loop.
+
+# Maximum number of Gemini requests in flight per worker
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "16"))
+# Sustained request rate and burst size of the shared token bucket
+GEMINI_REQUESTS_PER_SECOND = float(os.environ.get("GEMINI_REQUESTS_PER_SECOND", "5"))
+GEMINI_BURST = int(os.environ.get("GEMINI_BURST", "10"))
+# Bulk (ingestion) calls may hold at most this many slots and must leave this many tokens
+# in the bucket, so that chat requests arriving during an ingest are admitted at once
+GEMINI_BULK_MAX_CONCURRENCY = int(os.environ.get("GEMINI_BULK_MAX_CONCURRENCY", str(max(1, GEMINI_MAX_CONCURRENCY // 2))))
+GEMINI_INTERACTIVE_RESERVE = int(os.environ.get("GEMINI_INTERACTIVE_RESERVE", "2"))
+# Interactive calls are shed (503 + Retry-After) instead of queueing longer than this,
+# or when this many are already waiting
+GEMINI_MAX_ADMISSION_WAIT_SECONDS = float(os.environ.get("GEMINI_MAX_ADMISSION_WAIT_SECONDS", "5"))
+GEMINI_MAX_INTERACTIVE_QUEUE = int(os.environ.get("GEMINI_MAX_INTERACTIVE_QUEUE", "64"))
+# Interactive retries back off for at most this long, and give up once the deadline has passed
+GEMINI_INTERACTIVE_MAX_BACKOFF_SECONDS = float(os.environ.get("GEMINI_INTERACTIVE_MAX_BACKOFF_SECONDS", "2"))
+GEMINI_INTERACTIVE_DEADLINE_SECONDS = float(os.environ.get("GEMINI_INTERACTIVE_DEADLINE_SECONDS", "15"))
+
+admission = AdmissionController(
+    rate=GEMINI_REQUESTS_PER_SECOND,
+    burst=GEMINI_BURST,
+    max_concurrency=GEMINI_MAX_CONCURRENCY,
+    bulk_max_concurrency=min(GEMINI_BULK_MAX_CONCURRENCY, GEMINI_MAX_CONCURRENCY),
+    interactive_reserve=GEMINI_INTERACTIVE_RESERVE,
+    max_wait=GEMINI_MAX_ADMISSION_WAIT_SECONDS,
+    max_queue=GEMINI_MAX_INTERACTIVE_QUEUE,
+)
+# Identical embed/generate calls in flight at the same time share one API request
+_single_flight = SingleFlight()
+
+attempt_duration = registry.histogram(
+    "gemini_request_duration_seconds", "Duration of single Gemini API attempts", ("function", "outcome")
+)
+# Time queued for the rate limiter and a concurrency slot before an attempt starts
+admission_wait = registry.histogram(
+    "gemini_admission_wait_seconds", "Wait for the rate limiter and a concurrency slot", ("function", "priority")
+)
+shed_total = registry.counter("gemini_shed_total", "Interactive Gemini calls rejected as overloaded", ("function", "reason"))
+coalesced_total = registry.counter("gemini_coalesced_total", "Calls served by an identical call already in flight", ("function",))
+
+
+def _should_retry(error: Exception) -> bool:
+    error_str = str(error).lower()
+    return any(x in error_str for x in [
+        "429", "rate", "quota", "resource_exhausted",
+        "500", "502", "503", "504", "unavailable",
+        "timeout", "connection", "deadline"
+    ])
+
 
-def retry_with_backoff(func, max_retries=5, initial_delay=1):
+def _is_rate_limited(error: Exception) -> bool:
+    error_str = str(error).lower()
+    return any(x in error_str for x in ["429", "rate", "quota", "resource_exhausted"])
+
+
+def async_retry_with_backoff(func, max_retries=5, initial_delay=1, max_delay=30):
     """
-    Retry decorator with exponential backoff.
-    Handles rate limits (429), server errors (5xx), and transient network issues.
+    Retry decorator for Gemini calls on rate limits (429), server errors (5xx) and
+    transient network issues. Every attempt is admitted by the shared AdmissionController at the priority of
+    the calling task (call_priority), and waits between attempts with full-jitter
+    exponential backoff via asyncio.sleep.
+    Interactive calls back off briefly and stop at a deadline: when Gemini keeps
+    rate limiting them, or the next retry would pass the deadline, they raise
+    Overloaded (a fast 503) instead of holding the user for half a minute.
     """
-    def wrapper(*args, **kwargs):
+    async def wrapper(*args, **kwargs):
+        priority = call_priority.get()
+        interactive = priority == INTERACTIVE
+        delay_cap = min(max_delay, GEMINI_INTERACTIVE_MAX_BACKOFF_SECONDS) if interactive else max_delay
+        deadline = time.monotonic() + GEMINI_INTERACTIVE_DEADLINE_SECONDS
         retries = 0
         last_exception = None
-        
+
         while retries < max_retries:
+            queued = time.perf_counter()
+            started = None
+            try:
+                await admission.acquire(priority)
+            except Overloaded:
+                shed_total.inc(function=func.__name__, reason="queue")
+                raise
             try:
-                return func(*args, **kwargs)
+                started = time.perf_counter()
+                admission_wait.observe(started - queued, function=func.__name__, priority=priority)
+                result = await func(*args, **kwargs)
+                attempt_duration.observe(time.perf_counter() - started, function=func.__name__, outcome="ok")
+                return result
             except Exception as e:
-                error_str = str(e).lower()
                 last_exception = e
-                
-                # Retry on rate limits, server errors, or network issues
-                should_retry = any(x in error_str for x in [
-                    "429", "rate", "quota", "resource_exhausted",
-                    "500", "502", "503", "504", "unavailable", 
-                    "timeout", "connection", "deadline"
-                ])
-                
-                if should_retry:
-                    wait_time = initial_delay * (2 ** retries)
-                    print(f"[Retry {retries + 1}/{max_retries}] API error: {e}. Waiting {wait_time}s...")
-                    time.sleep(wait_time)
-                    retries += 1
-                else:
-                    # Non-retryable error, raise immediately
+                attempt_duration.observe(time.perf_counter() - started, function=func.__name__, outcome="error")
+                if not _should_retry(e):
                     raise e
-        
-        # All retries exhausted
+            finally:
+                admission.release(priority)
+
+            wait_time = random.uniform(0, min(delay_cap, initial_delay * (2 ** retries)))
+            if interactive and time.monotonic() + wait_time > deadline:
+                shed_total.inc(function=func.__name__, reason="deadline")
+                raise Overloaded(f"The model did not respond in time ({last_exception})", delay_cap)
+            print(f"[Retry {retries + 1}/{max_retries}] API error: {last_exception}. Waiting {wait_time:.2f}s...")
+            retries_total.inc(function=func.__name__)
+            backoff_seconds_total.inc(wait_time, function=func.__name__)
+            await asyncio.sleep(wait_time)
+            retries += 1
+
+        retries_exhausted_total.inc(function=func.__name__)
+        if interactive and _is_rate_limited(last_exception):
+            shed_total.inc(function=func.__name__, reason="rate_limited")
+            raise Overloaded("The model is rate limited", delay_cap)
         raise Exception(f"Max retries ({max_retries}) exceeded. Last error: {last_exception}")
     return wrapper
 
-@retry_with_backoff
-def get_embedding(text: str) -> list[float]:
-    """Generate embeddings for text using Gemini API."""
-    result = genai.embed_content(
-        model=embedding_model,
-        content=text,
-        task_type="retrieval_document"
-    )
-    return result['embedding']
-
-@retry_with_backoff
-def generate_response(prompt: str) -> str:
-    """Generate response using Gemini Flash Lite."""
-    response = generative_model.generate_content(prompt)
+
+def _flight_key(*parts: str) -> str:
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+async def _coalesce(function: str, key: str, factory):
+    if key in _single_flight:
+        coalesced_total.inc(function=function)
+    return await _single_flight.run(key, factory)
+
+
+async def aget_embedding(text: str, task_type: str = "retrieval_document") -> list[float]:
+    """Embedding of one text (served from the embedding cache when possible)."""
+    if EMBEDDING_CACHE_ENABLED:
+        cached = await asyncio.to_thread(embedding_cache.get, embedding_cache_model, task_type, text)
+        if cached is not None:
+            return cached
+
+    async def embed():
+        embedding = await _aembed_text(text, task_type)
+        if EMBEDDING_CACHE_ENABLED:
+            await asyncio.to_thread(embedding_cache.put, embedding_cache_model, task_type, text, embedding)
+        return embedding
+
+    # Concurrent misses for the same text (e.g. a popular question) make one request
+    return await _coalesce("embed", _flight_key(embedding_cache_model, task_type, text), embed)
+
+
+@async_retry_with_backoff
+async def _aembed_text(text: str, task_type: str) -> list[float]:
+    result = await _client().embed_content_async(**_embed_args(text, task_type))
+    return _embedding_result(result)
+
+
+@async_retry_with_backoff
+async def _aembed_batch(texts: list[str]) -> list[list[float]]:
+    result = await _client().embed_content_async(**_embed_args(texts, "retrieval_document"))
+    return _embedding_result(result)
+
+
+async def agenerate_response(prompt: str) -> str:
+    """Generate a response; identical prompts in flight share one request."""
+    return await _coalesce("generate", _flight_key(GENERATIVE_MODEL_NAME, prompt), lambda: _agenerate(prompt))
+
+
+@async_retry_with_backoff
+async def _agenerate(prompt: str) -> str:
+    response = await _model().generate_content_async(prompt)
     return response.text
 
 
-def get_embeddings_batch(texts: list[str], batch_size: int = 5) -> list[list[float]]:
+@async_retry_with_backoff
+async def _astart_stream(prompt: str):
+    return await _model().generate_content_async(prompt, stream=True)
+
+
+async def astream_response(prompt: str):
     """
-    Get embeddings for multiple texts with rate limiting.
-    Processes in small batches with delays to avoid hitting rate limits.
+    Stream the generated response as text pieces.
+    Retries (and the rate limiter) apply to opening the stream; once tokens
+    have been sent, an error ends the stream instead of restarting it.
     """
-    embeddings = []
-    
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        
-        for text in batch:
-            embedding = get_embedding(text)
-            embeddings.append(embedding)
-        
-        # Small delay between batches to avoid rate limits
-        if i + batch_size < len(texts):
-            time.sleep(0.5)
-    
-    return embeddings
+    response = await _astart_stream(prompt)
+    async for chunk in response:
+        if chunk.text:
+            yield chunk.text
+
+
+async def aget_embeddings_batch(texts: list[str], batch_size: int = EMBED_BATCH_MAX) -> list[list[float]]:
+    """Embeddings of several texts with multi-text requests; cached chunks never hit the API."""
+    embeddings, misses = await _lookup_cached(texts)
+    if not misses:
+        return embeddings
+    miss_embeddings = await _aembed_texts_batched([texts[i] for i in misses], batch_size)
+    return await _fill_misses(texts, embeddings, misses, miss_embeddings)
+
+
+async def _aembed_texts_batched(texts: list[str], batch_size: int = EMBED_BATCH_MAX) -> list[list[float]]:
+    """
+    Embed texts with concurrent multi-text requests.
+    Batches are packed up front and embedded concurrently, bounded by the shared
+    limiter; a batch rejected as too large is split in half and retried.
+    """
+    size = max(1, min(batch_size, EMBED_BATCH_MAX))
+    batches = []
+    i = 0
+    while i < len(texts):
+        batch = _pack_batch(texts, i, size)
+        batches.append(batch)
+        i += len(batch)
+
+    async def embed(batch: list[str]) -> list[list[float]]:
+        try:
+            return await _aembed_batch(batch)
+        except Exception as e:
+            if len(batch) > 1 and _is_payload_error(e):
+                half = len(batch) // 2
+                print(f"[Embed] Batch of {len(batch)} rejected ({e}). Splitting...")
+                first, second = await asyncio.gather(embed(batch[:half]), embed(batch[half:]))
+                return first + second
+            raise
+
+    results = await asyncio.gather(*(embed(batch) for batch in batches))
+    return [embedding for batch_embeddings in results for embedding in batch_embeddings]
@@ -0,0 +1,403 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from backend.admission import BULK, call_priority
+from backend.file_processor import ExtractionProgress, iter_path_text
+from backend.rag_pipeline import ingest_stream
+from backend.chunking import DEFAULT_CHUNKER, chunker_name
+from backend.scraper import scrape_url
+from backend.crawler import Crawler
+
+# Local persistent job queue (survives restarts) and where uploads are kept until processed
+INGEST_JOBS_DB_PATH = os.environ.get(
+    "INGEST_JOBS_DB_PATH", str(Path(__file__).parent / ".cache" / "ingest_jobs.sqlite")
+)
+INGEST_PAYLOAD_DIR = os.environ.get(
+    "INGEST_PAYLOAD_DIR", str(Path(__file__).parent / ".cache" / "ingest_payloads")
+)
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+# A running job whose heartbeat is older than this is considered abandoned and requeued
+INGEST_JOB_STALE_SECONDS = int(os.environ.get("INGEST_JOB_STALE_SECONDS", "120"))
+# Crawl jobs: changed pages ingested concurrently while the crawl continues
+CRAWL_INGEST_CONCURRENCY = int(os.environ.get("CRAWL_INGEST_CONCURRENCY", "2"))
+
+_JOB_COLUMNS = [
+    "id", "user_id", "kind", "source", "filename", "payload_path", "url", "upsert", "chunker",
+    "options", "status", "error", "chunks_read", "chunks_committed", "chunks_total", "units_done",
+    "units_total", "run_started_at", "run_start_chunks", "created_at", "heartbeat", "finished_at",
+]
+
+
+class JobStore:
+    """
+    SQLite-backed ingestion job queue.
+    Jobs do not store the user's bearer token: it would expire before a queued or
+    resumed job runs. Workers write with the service client, scoped by user_id.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("pragma journal_mode=wal")
+            self._conn.execute(
+                "create table if not exists jobs ("
+                " id text primary key,"
+                " user_id text not null,"
+                " kind text not null,"
+                " source text not null,"
+                " filename text,"
+                " payload_path text,"
+                " url text,"
+                " upsert integer not null default 0,"
+                " chunker text,"
+                " options text,"
+                " status text not null default 'queued',"
+                " error text,"
+                " chunks_read integer not null default 0,"
+                " chunks_committed integer not null default 0,"
+                " chunks_total integer,"
+                " units_done integer not null default 0,"
+                " units_total integer not null default 0,"
+                " run_started_at real,"
+                " run_start_chunks integer not null default 0,"
+                " created_at real not null,"
+                " heartbeat real,"
+                " finished_at real)"
+            )
+            self._conn.execute("create index if not exists jobs_status_idx on jobs (status, created_at)")
+            # Databases created before these columns existed
+            columns = {row[1] for row in self._conn.execute("pragma table_info(jobs)")}
+            for column in ("chunker", "options"):
+                if column not in columns:
+                    self._conn.execute(f"alter table jobs add column {column} text")
+            # Databases from before jobs stopped keeping bearer tokens: drop the stored tokens
+            if "token" in columns:
+                self._conn.execute("alter table jobs drop column token")
+        return self._conn
+
+    def _row(self, row) -> dict | None:
+        return dict(zip(_JOB_COLUMNS, row)) if row else None
+
+    def create(self, user_id: str, kind: str, source: str, filename: str = None,
+               payload_path: str = None, url: str = None, upsert: bool = False, chunker: str = None,
+               options: dict = None, job_id: str = None) -> dict:
+        job_id = job_id or str(uuid.uuid4())
+        with self._lock:
+            self._connect().execute(
+                "insert into jobs (id, user_id, kind, source, filename, payload_path, url, upsert, chunker,"
+                " options, created_at) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, kind, source, filename, payload_path, url, int(upsert), chunker,
+                 json.dumps(options) if options else None, time.time())
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._connect().execute(
+                f"select {', '.join(_JOB_COLUMNS)} from jobs where id = ?", (job_id,)
+            ).fetchone()
+        return self._row(row)
+
+    def list_for_user(self, user_id: str, limit: int = 20) -> list[dict]:
+        with self._lock:
+            rows = self._connect().execute(
+                f"select {', '.join(_JOB_COLUMNS)} from jobs where user_id = ? order by created_at desc limit ?",
+                (user_id, limit)
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def claim_next(self) -> dict | None:
+        """Atomically move the oldest queued job to running."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("begin immediate")
+            try:
+                row = conn.execute(
+                    "select id, chunks_committed from jobs where status = 'queued' order by created_at limit 1"
+                ).fetchone()
+                if row:
+                    now = time.time()
+                    conn.execute(
+                        "update jobs set status = 'running', run_started_at = ?, run_start_chunks = ?,"
+                        " heartbeat = ? where id = ?",
+                        (now, row[1], now, row[0])
+                    )
+                conn.execute("commit")
+            except Exception:
+                conn.execute("rollback")
+                raise
+        return self.get(row[0]) if row else None
+
+    def update(self, job_id: str, **fields):
+        fields["heartbeat"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._connect().execute(
+                f"update jobs set {assignments} where id = ?", (*fields.values(), job_id)
+            )
+
+    def requeue_stale(self) -> int:
+        """Requeue running jobs whose worker died; they resume from chunks_committed."""
+        with self._lock:
+            cursor = self._connect().execute(
+                "update jobs set status = 'queued' where status = 'running' and heartbeat < ?",
+                (time.time() - INGEST_JOB_STALE_SECONDS,)
+            )
+        return cursor.rowcount
+
+
+job_store = JobStore(INGEST_JOBS_DB_PATH)
+_job_available = asyncio.Event()
+_workers = []
+
+
+def save_payload(job_id: str, filename: str, stream) -> str:
+    """Copy an upload to the payload directory so the job outlives the request."""
+    Path(INGEST_PAYLOAD_DIR).mkdir(parents=True, exist_ok=True)
+    path = str(Path(INGEST_PAYLOAD_DIR) / f"{job_id}{Path(filename).suffix}")
+    with open(path, "wb") as out:
+        shutil.copyfileobj(stream, out, 1024 * 1024)
+    return path
+
+
+async def enqueue_file(user_id: str, source: str, filename: str, stream, upsert: bool = False,
+                       chunker: str = None) -> dict:
+    # Resolve the chunker now so a resumed job chunks exactly as it started
+    chunker = chunker_name(chunker)
+    job_id = str(uuid.uuid4())
+    payload_path = await asyncio.to_thread(save_payload, job_id, filename, stream)
+    job = await asyncio.to_thread(job_store.create, user_id, "file", source, filename=filename,
+                                  payload_path=payload_path, upsert=upsert, chunker=chunker, job_id=job_id)
+    _job_available.set()
+    return job
+
+
+async def enqueue_text(user_id: str, source: str, text: str, upsert: bool = False,
+                       chunker: str = None) -> dict:
+    chunker = chunker_name(chunker)
+    job_id = str(uuid.uuid4())
+    filename = "text.txt"
+    Path(INGEST_PAYLOAD_DIR).mkdir(parents=True, exist_ok=True)
+    payload_path = str(Path(INGEST_PAYLOAD_DIR) / f"{job_id}.txt")
+    await asyncio.to_thread(Path(payload_path).write_text, text, encoding="utf-8")
+    job = await asyncio.to_thread(job_store.create, user_id, "text", source, filename=filename,
+                                  payload_path=payload_path, upsert=upsert, chunker=chunker, job_id=job_id)
+    _job_available.set()
+    return job
+
+
+async def enqueue_url(user_id: str, url: str, upsert: bool = False, chunker: str = None) -> dict:
+    chunker = chunker_name(chunker)
+    job = await asyncio.to_thread(job_store.create, user_id, "url", url, url=url, upsert=upsert, chunker=chunker)
+    _job_available.set()
+    return job
+
+
+async def enqueue_crawl(user_id: str, url: str, max_pages: int = None, max_depth: int = None,
+                        sitemap: bool = False, chunker: str = None) -> dict:
+    """Crawl a site; every page is ingested (and later re-synced) as its own source."""
+    chunker = chunker_name(chunker)
+    options = {"max_pages": max_pages, "max_depth": max_depth, "sitemap": sitemap}
+    job = await asyncio.to_thread(job_store.create, user_id, "crawl", url, url=url, upsert=True, chunker=chunker,
+                                  options={k: v for k, v in options.items() if v is not None})
+    _job_available.set()
+    return job
+
+
+def job_status(job: dict) -> dict:
+    """Public view of a job with throughput (chunks/s) and ETA (s)."""
+    throughput = None
+    eta_seconds = None
+    chunks_estimate = job["chunks_total"]
+
+    if job["status"] == "running" and job["run_started_at"]:
+        elapsed = time.time() - job["run_started_at"]
+        processed = job["chunks_committed"] - job["run_start_chunks"]
+        if elapsed > 0 and processed > 0:
+            throughput = processed / elapsed
+        # Extrapolate the chunk total from how much of the document has been extracted
+        if job["units_done"] and job["units_total"]:
+            chunks_estimate = round(job["chunks_read"] * job["units_total"] / job["units_done"])
+        if throughput and chunks_estimate:
+            eta_seconds = max(0.0, (chunks_estimate - job["chunks_committed"]) / throughput)
+
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "source": job["source"],
+        "chunker": job["chunker"] or DEFAULT_CHUNKER,
+        "error": job["error"],
+        "chunks_read": job["chunks_read"],
+        "chunks_committed": job["chunks_committed"],
+        "chunks_total": chunks_estimate,
+        "progress": (job["chunks_committed"] / chunks_estimate) if chunks_estimate else None,
+        "throughput_chunks_per_s": throughput,
+        "eta_seconds": eta_seconds,
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+async def _run_crawl(job: dict):
+    """
+    Crawl job: pages are upserted as they arrive while the crawl continues.
+    Unchanged pages (304 or same text) are skipped; a page's crawl state is only
+    recorded once it is ingested, so a failed or interrupted page is refetched.
+    """
+    options = json.loads(job["options"] or "{}")
+    crawler = Crawler(job["user_id"], **{k: options[k] for k in ("max_pages", "max_depth") if k in options})
+    ingest_slots = asyncio.Semaphore(CRAWL_INGEST_CONCURRENCY)
+    page_progress = {}
+    counts = {"changed": 0, "not_modified": 0, "duplicate": 0, "skipped": 0, "failed": 0}
+    tasks = set()
+
+    async def report():
+        await asyncio.to_thread(
+            job_store.update, job["id"],
+            chunks_read=sum(read for read, _ in page_progress.values()),
+            chunks_committed=sum(committed for _, committed in page_progress.values()),
+            units_done=crawler.fetched,
+            units_total=crawler.discovered
+        )
+
+    async def ingest_page(page):
+        async def on_progress(chunks_read: int, chunks_committed: int):
+            page_progress[page.url] = (chunks_read, chunks_committed)
+            await report()
+
+        async with ingest_slots:
+            try:
+                await ingest_stream(
+                    [page.text], page.url, job["user_id"], None,
+                    upsert=True, on_progress=on_progress, chunker=job["chunker"]
+                )
+                await asyncio.to_thread(page.commit, job["user_id"])
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"[Crawl] Failed to ingest {page.url}: {e}")
+
+    try:
+        async for page in crawler.crawl(job["url"], sitemap=options.get("sitemap", False)):
+            counts[page.status] += 1
+            if page.text is not None:
+                task = asyncio.create_task(ingest_page(page))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            else:
+                await report()
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    print(f"[Crawl] Job {job['id']} finished: {crawler.fetched} fetched, " +
+          ", ".join(f"{count} {status}" for status, count in counts.items()))
+    return sum(read for read, _ in page_progress.values())
+
+
+async def _run_job(job: dict):
+    if job["kind"] == "crawl":
+        return await _run_crawl(job)
+
+    progress = ExtractionProgress()
+    if job["kind"] == "url":
+        text = await asyncio.to_thread(scrape_url, job["url"])
+        progress.done = progress.total = 1
+        segments = [text]
+    else:
+        segments = iter_path_text(job["payload_path"], job["filename"], progress)
+
+    async def on_progress(chunks_read: int, chunks_committed: int):
+        await asyncio.to_thread(
+            job_store.update, job["id"],
+            chunks_read=chunks_read,
+            chunks_committed=chunks_committed,
+            units_done=progress.done,
+            units_total=progress.total
+        )
+
+    # Upsert jobs re-diff from scratch: batches committed before a restart simply match by hash
+    start_chunk = 0 if job["upsert"] else job["chunks_committed"]
+    if start_chunk:
+        print(f"[Jobs] Resuming job {job['id']} from chunk {start_chunk}")
+
+    count = await ingest_stream(
+        segments, job["source"], job["user_id"], None,
+        upsert=bool(job["upsert"]), start_chunk=start_chunk, on_progress=on_progress,
+        chunker=job["chunker"]
+    )
+    return count
+
+
+async def _heartbeat(job_id: str):
+    while True:
+        await asyncio.sleep(INGEST_JOB_STALE_SECONDS / 4)
+        await asyncio.to_thread(job_store.update, job_id)
+
+
+async def _worker(worker_id: int):
+    # Ingestion yields Gemini capacity to chat requests (see backend/admission.py)
+    call_priority.set(BULK)
+    while True:
+        job = await asyncio.to_thread(job_store.claim_next)
+        if job is None:
+            _job_available.clear()
+            try:
+                await asyncio.wait_for(_job_available.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                # Pick up jobs abandoned by a crashed worker process
+                await asyncio.to_thread(job_store.requeue_stale)
+            continue
+
+        print(f"[Jobs] Worker {worker_id} started job {job['id']} ({job['source']})")
+        heartbeat = asyncio.create_task(_heartbeat(job["id"]))
+        try:
+            count = await _run_job(job)
+            await asyncio.to_thread(
+                job_store.update, job["id"], status="completed", chunks_total=count, finished_at=time.time()
+            )
+            print(f"[Jobs] Job {job['id']} completed: {count} chunks")
+        except asyncio.CancelledError:
+            # Shutdown: put the job back so it resumes from its last committed batch on restart
+            await asyncio.to_thread(job_store.update, job["id"], status="queued")
+            raise
+        except Exception as e:
+            print(f"[Jobs] Job {job['id']} failed: {e}")
+            await asyncio.to_thread(
+                job_store.update, job["id"], status="failed", error=str(getattr(e, "detail", e)), finished_at=time.time()
+            )
+        finally:
+            heartbeat.cancel()
+
+        job = await asyncio.to_thread(job_store.get, job["id"])
+        if job["status"] in ("completed", "failed") and job["payload_path"]:
+            await asyncio.to_thread(Path(job["payload_path"]).unlink, missing_ok=True)
+
+
+async def start_workers():
+    """Requeue jobs interrupted by a restart and start the worker pool."""
+    requeued = await asyncio.to_thread(job_store.requeue_stale)
+    if requeued:
+        print(f"[Jobs] Requeued {requeued} interrupted jobs")
+    for worker_id in range(INGEST_WORKERS):
+        _workers.append(asyncio.create_task(_worker(worker_id)))
+
+
+async def stop_workers():
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -1,20 +1,39 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+import asyncio
+import json
 import os
+import time
 from pathlib import Path
 from dotenv import load_dotenv
-from backend.rag_pipeline import ingest_document, answer_query_rag
-from backend.file_processor import process_file
-from backend.auth import get_current_user
+from backend.rag_pipeline import answer_query_rag, answer_query_rag_stream
+from backend.ingest_jobs import (
+    enqueue_file, enqueue_text, enqueue_url, enqueue_crawl, job_store, job_status, start_workers, stop_workers
+)
+from backend.auth import get_current_user, get_current_user_strict
 from backend.chat_history import (
-    create_chat, get_user_chats, get_chat_messages, save_message, delete_chat
+    create_chat, get_user_chats, get_chat_messages, delete_chat
 )
-from backend.models import Chat, Message, ChatCreate
+from backend.models import Chat, Message, ChatCreate, ChatHistoryResponse, ChatMessagesResponse
+from backend.chat_writer import chat_writer, new_chat_id, now_iso
+from backend.embedding_cache import embedding_cache
+from backend.answer_cache import answer_cache, ANSWER_CACHE_ENABLED
+from backend.reranker import rerank_service
+from backend.file_processor import shutdown_pdf_pool
+from backend.admission import Overloaded, call_arrival
+from backend.gemini_service import admission, warmup as warmup_gemini
+from backend.supabase_client import get_supabase_client
+from backend.telemetry import RequestMetricsMiddleware, registry, METRICS_ENABLED
 
 env_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# Preload the reranker (with one dummy inference) and the API clients at startup.
+# GET /ready answers 503 until this has finished, so new instances only get traffic once warm.
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "false").lower() == "true"
+
 app = FastAPI(title="Predusk RAG API", version="1.0.0")
 
 # CORS Configuration
@@ -31,8 +50,60 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Per-route latency histograms and per-request traces of the pipeline stages
+app.add_middleware(RequestMetricsMiddleware)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    # Shed load quickly: the client backs off instead of waiting on a saturated model
+    return JSONResponse(
+        status_code=503,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+_readiness = {"ready": False, "warmup": "disabled", "error": None}
+_warmup_task = None
+
+async def _warmup():
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(warmup_gemini)
+        await asyncio.to_thread(get_supabase_client)
+        await rerank_service.warmup()
+    except Exception as e:
+        print(f"[Warmup] Failed: {e}")
+        _readiness.update(warmup="failed", error=str(e))
+        return
+    print(f"[Warmup] Ready after {time.perf_counter() - started:.1f}s")
+    _readiness.update(ready=True, warmup="done")
 
+@app.on_event("startup")
+async def startup():
+    global _warmup_task
+    # Background ingestion workers (resume jobs interrupted by a restart)
+    await start_workers()
+    chat_writer.start()
+    if WARMUP_ON_STARTUP:
+        # In the background: the server starts (and /health answers) while models load
+        _readiness["warmup"] = "running"
+        _warmup_task = asyncio.create_task(_warmup())
+    else:
+        # Models and clients load on first use
+        _readiness["ready"] = True
 
+@app.on_event("shutdown")
+async def shutdown():
+    _readiness["ready"] = False
+    if _warmup_task and not _warmup_task.done():
+        _warmup_task.cancel()
+    await stop_workers()
+    # Flush pending chat/message writes before exiting
+    await chat_writer.stop()
+    rerank_service.shutdown()
+    shutdown_pdf_pool()
 
 class ChatRequest(BaseModel):
     query: str
@@ -44,102 +115,243 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats()
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness (as opposed to /health liveness): 503 until startup and warmup have finished."""
+    if not _readiness["ready"]:
+        raise HTTPException(status_code=503, detail=_readiness)
+    return {"status": "ready", "warmup": _readiness["warmup"]}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text-format metrics (stage and request latency histograms, retry counters)."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 @app.post("/ingest")
 async def ingest_route(
     file: UploadFile = File(None),
     text: str = Form(None),
     source: str = Form(...),
+    upsert: bool = Form(False),
+    chunker: str = Form(None),
     user: dict = Depends(get_current_user)
 ):
     try:
-        content = ""
         # user is now a dict {"id": "...", "token": "..."}
         user_id = user["id"]
-        token = user["token"]
 
+        # Ingestion runs in a background job; poll GET /ingest/jobs/{job_id} for progress
         if file:
-            content = await process_file(file)
+            if not file.filename.endswith((".pdf", ".txt", ".md")):
+                raise HTTPException(status_code=400, detail="Unsupported file format. Please upload .pdf, .txt, or .md")
             # Use filename as source if not provided, or append
             if not source or source == "undefined":
                  source = file.filename
+            job = await enqueue_file(user_id, source, file.filename, file.file, upsert=upsert, chunker=chunker)
         elif text:
-            content = text
+            job = await enqueue_text(user_id, source, text, upsert=upsert, chunker=chunker)
         else:
             raise HTTPException(status_code=400, detail="Either 'file' or 'text' must be provided")
 
-        count = ingest_document(content, source, user_id, token)
-        return {"message": "Ingestion successful", "chunks_count": count}
+        return {"message": "Ingestion queued", "job_id": job["id"], "status": job["status"]}
+    except HTTPException:
+        raise
+    except ValueError as e:
+        # Unknown chunker
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error in /ingest: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+def _admit_chat(user_id: str, query: str):
+    """
+    Shed a chat request (Overloaded -> 503) before anything is written if the model is saturated.
+    Exact repeats are answered from the answer cache without Gemini, so they are always admitted.
+    Later Gemini calls of the request queue by its arrival time.
+    """
+    call_arrival.set(time.monotonic())
+    if not (ANSWER_CACHE_ENABLED and answer_cache.contains(user_id, query)):
+        admission.check()
+
 @app.post("/chat")
 async def chat_route(request: ChatRequest, user: dict = Depends(get_current_user)):
     try:
         user_id = user["id"]
         token = user["token"]
+        _admit_chat(user_id, request.query)
 
         # 1. Handle Chat Session
         chat_id = request.chat_id
         if not chat_id:
-             # Create new chat if not provided
+             # Create new chat if not provided; the id is generated here so the
+             # chat row can be written behind like the messages
              # Generate title from query (simplify for now)
              title = request.query[:50] + "..."
-             new_chat = create_chat(user_id, token, title)
-             chat_id = str(new_chat['id'])
+             chat_id = new_chat_id()
+             chat_writer.write_chat(token, chat_id, user_id, title)
 
-        # 2. Save User Message
-        save_message(chat_id, "user", request.query, user_id, token)
+        # 2. Generate Answer
+        asked_at = now_iso()
+        try:
+            response = await answer_query_rag(request.query, user_id, token)
+        except Exception:
+            # Keep the user's turn even if answering failed
+            chat_writer.write_message(token, chat_id, "user", request.query, asked_at)
+            raise
 
-        # 3. Generate Answer
-        response = answer_query_rag(request.query, user_id, token)
-        
-        # 4. Save Assistant Message
-        save_message(chat_id, "assistant", response["answer"], user_id, token)
+        # 3. Save both messages off the critical path (one bulk insert). The user's
+        # turn is deliberately deferred until the answer is ready (not written
+        # alongside retrieval); asked_at keeps it ordered before the answer
+        chat_writer.write_message(token, chat_id, "user", request.query, asked_at)
+        chat_writer.write_message(token, chat_id, "assistant", response["answer"])
 
-        # 5. Return Response with Chat ID
+        # 4. Return Response with Chat ID
         response["chat_id"] = chat_id
         return response
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error in /chat: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_route(request: ChatRequest, user: dict = Depends(get_current_user)):
+    """
+    Streaming chat over Server-Sent Events.
+    Events: `chat` (chat_id), `citations`, `token` (answer text pieces), then `done`
+    or `error`. The assistant message is saved once the answer is complete.
+    """
+    user_id = user["id"]
+    token = user["token"]
+    # Once the stream has started the status is 200, so shed before answering
+    _admit_chat(user_id, request.query)
+
+    chat_id = request.chat_id
+    if not chat_id:
+        title = request.query[:50] + "..."
+        chat_id = new_chat_id()
+        chat_writer.write_chat(token, chat_id, user_id, title)
+    asked_at = now_iso()
+
+    async def events():
+        yield _sse("chat", {"chat_id": chat_id})
+        answered = False
+        try:
+            async for event, data in answer_query_rag_stream(request.query, user_id, token):
+                if event == "token":
+                    yield _sse("token", {"text": data})
+                elif event == "citations":
+                    yield _sse("citations", data)
+                elif event == "done":
+                    chat_writer.write_message(token, chat_id, "user", request.query, asked_at)
+                    chat_writer.write_message(token, chat_id, "assistant", data["answer"])
+                    answered = True
+                    yield _sse("done", {"chat_id": chat_id, "cached": data.get("cached", False)})
+        except Overloaded as e:
+            yield _sse("error", {"detail": e.detail, "retry_after": e.retry_after})
+        except Exception as e:
+            print(f"Error in /chat/stream: {e}")
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            if not answered:
+                chat_writer.write_message(token, chat_id, "user", request.query, asked_at)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Disable proxy buffering so tokens reach the client as they are generated
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # --- Chat History Endpoints ---
 
-@app.get("/chats")
-async def get_chats_route(user: dict = Depends(get_current_user)):
-    return get_user_chats(user["id"], user["token"])
+@app.get("/chats", response_model=ChatHistoryResponse)
+async def get_chats_route(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None,
+    user: dict = Depends(get_current_user)
+):
+    try:
+        return await asyncio.to_thread(get_user_chats, user["id"], user["token"], limit, cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @app.post("/chats")
 async def create_chat_route(chat: ChatCreate, user: dict = Depends(get_current_user)):
     return create_chat(user["id"], user["token"], chat.title)
 
-@app.get("/chats/{chat_id}/messages")
-async def get_messages_route(chat_id: str, user: dict = Depends(get_current_user)):
-    return get_chat_messages(chat_id, user["id"], user["token"])
+@app.get("/chats/{chat_id}/messages", response_model=ChatMessagesResponse)
+async def get_messages_route(
+    chat_id: str,
+    limit: int = Query(100, ge=1, le=200),
+    cursor: str | None = None,
+    user: dict = Depends(get_current_user)
+):
+    try:
+        return await asyncio.to_thread(get_chat_messages, chat_id, user["id"], user["token"], limit, cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @app.delete("/chats/{chat_id}")
-async def delete_chat_route(chat_id: str, user: dict = Depends(get_current_user)):
+async def delete_chat_route(chat_id: str, user: dict = Depends(get_current_user_strict)):
     delete_chat(chat_id, user["id"], user["token"])
     return {"message": "Chat deleted"}
 
 # --- Scraper Endpoint ---
-from backend.scraper import scrape_url
 
 @app.post("/ingest/url")
 async def ingest_url_route(
     url: str = Form(...),
+    upsert: bool = Form(False),
+    chunker: str = Form(None),
+    crawl: bool = Form(False),
+    sitemap: bool = Form(False),
+    max_pages: int = Form(None),
+    max_depth: int = Form(None),
     user: dict = Depends(get_current_user)
 ):
+    """
+    Ingest a single page, or with crawl=true the site behind it: same-origin
+    links up to max_depth (or the URLs of its sitemap with sitemap=true).
+    Crawled pages are stored per page URL and re-synced on later crawls.
+    """
     try:
-        content = scrape_url(url)
-        count = ingest_document(content, url, user["id"], user["token"])
-        return {"message": "URL ingested successfully", "chunks_count": count}
+        if crawl or sitemap:
+            job = await enqueue_crawl(user["id"], url, max_pages=max_pages,
+                                      max_depth=max_depth, sitemap=sitemap, chunker=chunker)
+            return {"message": "Crawl queued", "job_id": job["id"], "status": job["status"]}
+        job = await enqueue_url(user["id"], url, upsert=upsert, chunker=chunker)
+        return {"message": "URL ingestion queued", "job_id": job["id"], "status": job["status"]}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+# --- Ingestion Job Endpoints ---
+
+@app.get("/ingest/jobs")
+async def list_ingest_jobs_route(user: dict = Depends(get_current_user)):
+    jobs = await asyncio.to_thread(job_store.list_for_user, user["id"])
+    return [job_status(job) for job in jobs]
+
+@app.get("/ingest/jobs/{job_id}")
+async def get_ingest_job_route(job_id: str, user: dict = Depends(get_current_user)):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if not job or job["user_id"] != user["id"]:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_status(job)
@@ -25,6 +25,8 @@ class MessageCreate(BaseModel):
 
 class ChatHistoryResponse(BaseModel):
     chats: List[Chat]
+    next_cursor: Optional[str] = None
 
 class ChatMessagesResponse(BaseModel):
     messages: List[Message]
+    next_cursor: Optional[str] = None
@@ -1,63 +1,346 @@
-from backend.gemini_service import get_embedding, generate_response
+from backend.gemini_service import aget_embedding, aget_embeddings_batch, agenerate_response, astream_response
 from backend.supabase_client import get_supabase_client, get_scoped_client
-from backend.utils import recursive_character_text_splitter
-from flashrank import Ranker, RerankRequest
+from backend.utils import chunk_hash, reciprocal_rank_fusion
+from backend.chunking import get_chunker
+from backend.embedding_cache import embedding_cache
+from backend.vector_store import retrieval_backend
+from backend.answer_cache import answer_cache, ANSWER_CACHE_ENABLED
+from backend.reranker import rerank_service
+from backend.context_packing import pack_context
+from backend.telemetry import record, span
+import asyncio
 import os
+import re
 import time
+from typing import Iterable
 
-# Initialize FlashRank (lite model)
-ranker = Ranker(model_name="ms-marco-TinyBERT-L-2-v2", cache_dir="./flashrank_cache")
+# Retrieval: minimum cosine similarity for vector candidates, candidates pulled from
+# each of vector and lexical search, and how many fused candidates go to the reranker
+VECTOR_MATCH_THRESHOLD = float(os.environ.get("VECTOR_MATCH_THRESHOLD", "0.5"))
+HYBRID_SEARCH_ENABLED = os.environ.get("HYBRID_SEARCH_ENABLED", "true").lower() != "false"
+RETRIEVAL_CANDIDATES = int(os.environ.get("RETRIEVAL_CANDIDATES", "20"))
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "15"))
 
-def ingest_document(text: str, source: str, user_id: str, token: str):
-    """Chunk, embed, and store document in Supabase for a specific user."""
-    chunks = recursive_character_text_splitter(text)
-    # Use scoped client to respect RLS
-    supabase = get_scoped_client(token)
-    
-    records = []
-    total_chunks = len(chunks)
-    print(f"[Ingest] Processing {total_chunks} chunks for source: {source}")
-    
-    for i, chunk in enumerate(chunks):
-        # Rate limiting: add small delay between API calls to avoid hitting limits
-        if i > 0 and i % 5 == 0:
-            print(f"[Ingest] Processed {i}/{total_chunks} chunks, pausing briefly...")
-            time.sleep(0.5)  # Pause every 5 chunks
-        
-        embedding = get_embedding(chunk)
-        records.append({
-            "content": chunk,
-            "metadata": {"source": source, "chunk_index": i},
-            "embedding": embedding,
-            "user_id": user_id
-        })
-        
-    # Batch insert
-    print(f"[Ingest] Inserting {len(records)} records to database...")
-    response = supabase.table("documents").insert(records).execute()
+NO_CONTEXT_ANSWER = "I couldn't find any relevant information in your documents to answer your question."
+
+# Streaming ingestion: chunks per embed/insert batch, and how many embedded
+# batches may wait for insertion before chunking pauses (backpressure)
+INGEST_BATCH_CHUNKS = int(os.environ.get("INGEST_BATCH_CHUNKS", "100"))
+INGEST_QUEUE_DEPTH = int(os.environ.get("INGEST_QUEUE_DEPTH", "2"))
+
+async def ingest_document(text: str, source: str, user_id: str, token: str, upsert: bool = False, chunker: str = None):
+    """
+    Chunk, embed, and store document in Supabase for a specific user.
+    With upsert=True, the source is re-synced instead: only new or changed chunks
+    are embedded and written, and chunks no longer present are deleted.
+    """
+    return await ingest_stream([text], source, user_id, token, upsert=upsert, chunker=chunker)
+
+async def ingest_stream(
+    segments: Iterable[str],
+    source: str,
+    user_id: str,
+    token: str | None,
+    upsert: bool = False,
+    start_chunk: int = 0,
+    on_progress=None,
+    chunker: str = None
+):
+    """
+    Streaming ingestion: text segments -> chunks -> batched embedding -> batched insert.
+    Segments are pulled lazily in a worker thread, and at most INGEST_QUEUE_DEPTH
+    embedded batches are buffered, so memory stays bounded and early chunks become
+    searchable while later pages are still being extracted.
+
+    Chunks before `start_chunk` are skipped (used to resume a job from its last
+    committed batch). `on_progress(chunks_read, chunks_committed)` is awaited after
+    every committed batch, where chunks_committed counts every chunk up to the last
+    one known to be stored.
+
+    `chunker` selects the chunking engine ("recursive" or "structured", see
+    backend.chunking); it defaults to DEFAULT_CHUNKER.
+
+    With a user `token` the writes go through RLS. Background jobs pass None and
+    write with the service client; every read and write is scoped by user_id.
+    """
+    supabase = get_scoped_client(token) if token else get_supabase_client()
+    diff = None
+    if upsert:
+        with span("ingest.load_existing") as attributes:
+            diff = await _SourceDiff.load(supabase, source, user_id)
+            attributes["rows"] = sum(len(rows) for rows in diff.by_hash.values())
+    pages = _PageTracker(segments)
+    chunk_iter = get_chunker(chunker)(pages)
+    queue = asyncio.Queue(maxsize=INGEST_QUEUE_DEPTH)
+    total_chunks = 0
+    inserted = 0
+
+    print(f"[Ingest] Streaming chunks for source: {source}")
+
+    async def produce():
+        nonlocal total_chunks
+        batch = []
+        # Extraction and chunking time, recorded once per batch rather than per chunk
+        chunking_seconds = 0.0
+        chunks_read = 0
+        while True:
+            started = time.perf_counter()
+            chunk = await asyncio.to_thread(next, chunk_iter, None)
+            chunking_seconds += time.perf_counter() - started
+            if chunk is not None:
+                index = total_chunks
+                total_chunks += 1
+                chunks_read += 1
+                page_range = pages.locate(chunk)
+                if index < start_chunk:
+                    continue
+                content_hash = chunk_hash(chunk)
+                if diff is None or not diff.match(index, content_hash, page_range):
+                    batch.append((index, chunk, content_hash, page_range))
+
+            if batch and (chunk is None or len(batch) >= INGEST_BATCH_CHUNKS):
+                record("ingest.chunk", chunking_seconds, chunks=chunks_read)
+                chunking_seconds, chunks_read = 0.0, 0
+                # Embed chunks with multi-text requests instead of one call per chunk
+                with span("ingest.embed", chunks=len(batch)):
+                    embeddings = await aget_embeddings_batch([c for _, c, _, _ in batch])
+                records = [{
+                    "content": c,
+                    "metadata": {"source": source, "chunk_index": i, "content_hash": h, **p},
+                    "embedding": embedding,
+                    "user_id": user_id
+                } for (i, c, h, p), embedding in zip(batch, embeddings)]
+                await queue.put(records)
+                batch = []
+
+            if chunk is None:
+                break
+        await queue.put(None)
+
+    async def consume():
+        nonlocal inserted
+        while (records := await queue.get()) is not None:
+            with span("ingest.insert", rows=len(records)):
+                response = await asyncio.to_thread(supabase.table("documents").insert(records).execute)
+            with span("ingest.index", rows=len(records)):
+                await asyncio.to_thread(retrieval_backend.add, user_id, [
+                    {**row_record, "id": row["id"]} for row_record, row in zip(records, response.data)
+                ])
+            inserted += len(records)
+            # Newly searchable chunks can change answers
+            answer_cache.invalidate(user_id)
+            print(f"[Ingest] Inserted {inserted} records ({total_chunks} chunks read) for: {source}")
+            if on_progress:
+                await on_progress(total_chunks, records[-1]["metadata"]["chunk_index"] + 1)
+
+    with span("ingest", upsert=upsert) as attributes:
+        tasks = [asyncio.create_task(produce()), asyncio.create_task(consume())]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            attributes.update(chunks=total_chunks, inserted=inserted)
+
+    if total_chunks == 0:
+        raise ValueError("No text content could be extracted to ingest")
+
+    if diff is not None:
+        with span("ingest.sync"):
+            await diff.apply(supabase)
+    if on_progress:
+        await on_progress(total_chunks, total_chunks)
+    print(f"[Ingest] Embedding cache hit ratio: {embedding_cache.stats()['hit_ratio']:.1%}")
     print(f"[Ingest] Ingestion complete for: {source}")
-    return len(records)
+    return total_chunks
+
+# Words matched to find a chunk's start (and end) in the extracted text
+_LOCATE_WORDS = 12
+
+class _PageTracker:
+    """
+    Maps chunks back to the PDF pages they were cut from.
+    Wraps the segment stream, recording where each page (segments carrying a
+    `page` attribute) starts in the concatenated text, and finds each chunk by
+    its leading text. Only a window from the last located chunk onward is kept.
+    """
+
+    def __init__(self, segments: Iterable[str]):
+        self.segments = segments
+        self.text = ""
+        self.text_offset = 0  # offset of self.text[0] in the whole document
+        self.page_starts = []  # (offset, page), ascending
+        self.located = False
+
+    def __iter__(self):
+        for segment in self.segments:
+            page = getattr(segment, "page", None)
+            if page is not None:
+                self.page_starts.append((self.text_offset + len(self.text), page))
+            if self.page_starts:
+                self.text += segment
+            else:
+                self.text_offset += len(segment)
+            yield segment
 
-def retrieve_and_rank(query: str, user_id: str, token: str, top_k: int = 5):
-    """Retrieve documents using vector search and rerank them, scoped to user."""
+    def _page_at(self, offset: int) -> int:
+        page = self.page_starts[0][1]
+        for start, number in self.page_starts:
+            if start > offset:
+                break
+            page = number
+        return page
+
+    @staticmethod
+    def _words_pattern(words: list[str]) -> re.Pattern:
+        # Chunkers may rewrite whitespace (the structured one joins blocks with "\n\n"),
+        # so chunk text is matched word by word across any run of whitespace
+        return re.compile(r"\s+".join(re.escape(word) for word in words))
+
+    def locate(self, chunk: str) -> dict:
+        """{"page_start", "page_end"} for a chunk (chunks arrive in order); {} without pages."""
+        if not self.page_starts:
+            return {}
+        words = chunk.split()
+        # Each chunk starts after the previous one (which sits at the window start)
+        match = self._words_pattern(words[:_LOCATE_WORDS]).search(self.text, 1 if self.located else 0) if words else None
+        if match is None:
+            page = self.page_starts[-1][1]
+            return {"page_start": page, "page_end": page}
+
+        position = match.start()
+        end = self._words_pattern(words[-_LOCATE_WORDS:]).search(self.text, position)
+        last = (end.end() if end else position + len(chunk)) - 1
+        start = self.text_offset + position
+        pages = {"page_start": self._page_at(start), "page_end": self._page_at(self.text_offset + last)}
+        # Later chunks start at or after this one: drop text and pages before it
+        self.text = self.text[position:]
+        self.text_offset = start
+        self.located = True
+        while len(self.page_starts) > 1 and self.page_starts[1][0] <= start:
+            self.page_starts.pop(0)
+        return pages
+
+class _SourceDiff:
+    """
+    Chunk-level diff of a re-ingested source against its stored chunks.
+    Unchanged chunks are kept (their chunk_index is updated if it shifted);
+    rows that were never matched are deleted once the new version is stored.
+    """
+
+    def __init__(self, source: str, user_id: str, rows: list[dict]):
+        self.source = source
+        self.user_id = user_id
+        self.by_hash = {}
+        self.reindexed = []
+        self.unchanged = 0
+        # Rows from before hashing was added never match and are replaced
+        for row in rows:
+            row_hash = (row.get("metadata") or {}).get("content_hash")
+            self.by_hash.setdefault(row_hash, []).append(row)
+
+    @classmethod
+    async def load(cls, supabase, source: str, user_id: str, page_size: int = 1000):
+        """Fetch id and metadata (no embeddings) of every stored chunk for a source."""
+        rows = []
+        start = 0
+        while True:
+            response = await asyncio.to_thread(
+                supabase.table("documents")
+                .select("id, metadata")
+                .eq("user_id", user_id)
+                .eq("metadata->>source", source)
+                .order("id")
+                .range(start, start + page_size - 1)
+                .execute
+            )
+            rows.extend(response.data)
+            if len(response.data) < page_size:
+                return cls(source, user_id, rows)
+            start += page_size
+
+    def match(self, index: int, content_hash: str, extra: dict | None = None) -> bool:
+        """
+        True if an identical chunk is already stored (so it needs no embedding).
+        The stored row's chunk_index (and `extra` metadata, e.g. pages) is updated if it shifted.
+        """
+        candidates = self.by_hash.get(content_hash)
+        if not candidates:
+            return False
+        # Prefer the row already at this position
+        row = next((r for r in candidates if r["metadata"].get("chunk_index") == index), candidates[0])
+        candidates.remove(row)
+        updates = {"chunk_index": index, **(extra or {})}
+        if any(row["metadata"].get(key) != value for key, value in updates.items()):
+            self.reindexed.append((row, updates))
+        self.unchanged += 1
+        return True
+
+    async def apply(self, supabase):
+        stale_ids = [row["id"] for rows in self.by_hash.values() for row in rows]
+        print(f"[Ingest] Sync {self.source}: {self.unchanged} unchanged, "
+              f"{len(self.reindexed)} moved, {len(stale_ids)} stale")
+
+        # Shifted chunks are rewritten 500 per call (see update_document_metadata in incremental_ingest.sql)
+        updates = [{"id": row["id"], "metadata": {**row["metadata"], **changes}} for row, changes in self.reindexed]
+        for start in range(0, len(updates), 500):
+            await asyncio.to_thread(supabase.rpc("update_document_metadata", {
+                "updates": updates[start:start + 500],
+                "filter_user_id": self.user_id
+            }).execute)
+        for update in updates:
+            retrieval_backend.update_metadata(self.user_id, update["id"], update["metadata"])
+        for start in range(0, len(stale_ids), 500):
+            await asyncio.to_thread(
+                supabase.table("documents").delete()
+                .eq("user_id", self.user_id)
+                .in_("id", stale_ids[start:start + 500])
+                .execute
+            )
+        if stale_ids:
+            await asyncio.to_thread(retrieval_backend.remove, self.user_id, stale_ids)
+        if stale_ids or self.reindexed:
+            answer_cache.invalidate(self.user_id)
+
+async def retrieve_and_rank(query: str, user_id: str, token: str, top_k: int = 5, query_embedding: list[float] | None = None):
+    """
+    Retrieve documents with hybrid search and rerank them, scoped to user.
+    Vector and lexical (full-text) candidates are fused with reciprocal-rank
+    fusion, and only the best fused candidates are passed to the reranker.
+    """
     # Use scoped client to respect RLS
     supabase = get_scoped_client(token)
-    query_embedding = get_embedding(query)
-    
-    # Semantic Search via Supabase RPC
-    # Now that we use a scoped client, RLS (auth.uid()) should work if the policy allows.
-    # However, for 'match_documents' RPC, RLS inside the function depends on how it's defined (SECURITY INVOKER vs DEFINER).
-    # If it's SECURITY INVOKER (default), it uses the current user's permissions.
-    # The SQL I provided in auth_schema.sql filters by `documents.user_id = auth.uid()`.
-    # So valid auth context is required.
     
-    response = supabase.rpc("match_documents", {
-        "query_embedding": query_embedding,
-        "match_threshold": 0.5,
-        "match_count": top_k * 5
-    }).execute()
+    # Semantic + lexical search via the configured retrieval backend (Supabase RPCs by default)
+    # The RPCs filter by the explicit user id before scoring; RLS still applies
+    # because the functions are SECURITY INVOKER and we use a scoped client.
+    async def vector_search():
+        embedding = query_embedding
+        if embedding is None:
+            with span("rag.embed_query"):
+                embedding = await aget_embedding(query)
+        with span("rag.vector_search") as attributes:
+            results = await retrieval_backend.match(
+                supabase, user_id, embedding,
+                match_threshold=VECTOR_MATCH_THRESHOLD, match_count=RETRIEVAL_CANDIDATES
+            )
+            attributes["results"] = len(results)
+        return results
+
+    async def lexical_search():
+        with span("rag.lexical_search") as attributes:
+            results = await retrieval_backend.lexical_match(supabase, user_id, query, match_count=RETRIEVAL_CANDIDATES)
+            attributes["results"] = len(results)
+        return results
+
+    if HYBRID_SEARCH_ENABLED:
+        vector_results, lexical_results = await asyncio.gather(vector_search(), lexical_search())
+        results = reciprocal_rank_fusion([vector_results, lexical_results])[:max(RERANK_CANDIDATES, top_k)]
+    else:
+        results = (await vector_search())[:max(RERANK_CANDIDATES, top_k)]
     
-    results = response.data
     if not results:
         return []
 
@@ -67,36 +350,63 @@ def retrieve_and_rank(query: str, user_id: str, token: str, top_k: int = 5):
     if not relevant_docs:
         return []
 
-    # Rerank with FlashRank
-    rerank_request = RerankRequest(
-        query=query, 
-        passages=[{"id": str(doc['id']), "text": doc['content'], "meta": doc['metadata']} for doc in relevant_docs]
-    )
-    ranked_results = ranker.rerank(rerank_request)
+    # Rerank with FlashRank on the rerank executor, batched with concurrent queries
+    with span("rag.rerank", candidates=len(relevant_docs)):
+        ranked_results = await rerank_service.rerank(
+            query,
+            [{"id": str(doc['id']), "text": doc['content'], "meta": doc['metadata']} for doc in relevant_docs]
+        )
     
     # Return top K ranked results
     return ranked_results[:top_k]
 
-def answer_query_rag(query: str, user_id: str, token: str):
-    """End-to-end RAG pipeline: Retrieve -> Rerank -> Generate."""
-    relevant_docs = retrieve_and_rank(query, user_id, token)
+async def answer_query_rag(query: str, user_id: str, token: str):
+    """
+    End-to-end RAG pipeline: Retrieve -> Rerank -> Generate.
+    Answers are cached per user; repeated or near-identical questions against an
+    unchanged corpus are served from the answer cache without calling Gemini.
+    """
+    if ANSWER_CACHE_ENABLED:
+        cached = answer_cache.get(user_id, query)
+        if cached:
+            return cached
+
+    with span("rag.embed_query"):
+        query_embedding = await aget_embedding(query)
+    if ANSWER_CACHE_ENABLED:
+        cached = answer_cache.get(user_id, query, query_embedding)
+        if cached:
+            print(f"[RAG] Answer cache hit for user {user_id}")
+            return cached
+
+    response = await _generate_answer(query, user_id, token, query_embedding)
+    if ANSWER_CACHE_ENABLED:
+        answer_cache.put(user_id, query, query_embedding, response)
+    return {**response}
+
+async def _prepare_answer(query: str, user_id: str, token: str, query_embedding: list[float]):
+    """Retrieve context and build the prompt; returns (prompt, citations), prompt is None without context."""
+    with span("rag.retrieve"):
+        relevant_docs = await retrieve_and_rank(query, user_id, token, query_embedding=query_embedding)
     
     if not relevant_docs:
-        return {
-            "answer": "I couldn't find any relevant information in your documents to answer your question.",
-            "citations": []
-        }
+        return None, []
     
     context_str = ""
     citations = []
     
-    for i, doc in enumerate(relevant_docs):
+    # Dedupe overlapping chunks, merge neighbours and fit the token budget;
+    # each packed block keeps its own citation number
+    with span("rag.pack_context", candidates=len(relevant_docs)) as attributes:
+        blocks = pack_context(relevant_docs)
+        attributes["blocks"] = len(blocks)
+    for i, block in enumerate(blocks):
         citation_id = i + 1
-        context_str += f"[Source {citation_id}]: {doc['text']}\n"
+        context_str += f"[Source {citation_id}]: {block['text']}\n"
         citations.append({
             "id": citation_id,
-            "content": doc['text'],
-            "metadata": doc['meta']
+            "content": block['text'],
+            "metadata": block['meta']
         })
         
     prompt = f"""
@@ -113,11 +423,59 @@ def answer_query_rag(query: str, user_id: str, token: str):
     - Cite your sources using [1], [2], etc.
     - Be concise and professional.
     """
-    
-    answer = generate_response(prompt)
+    return prompt, citations
+
+async def _generate_answer(query: str, user_id: str, token: str, query_embedding: list[float]):
+    prompt, citations = await _prepare_answer(query, user_id, token, query_embedding)
+    if prompt is None:
+        return {"answer": NO_CONTEXT_ANSWER, "citations": []}
+
+    with span("rag.generate"):
+        answer = await agenerate_response(prompt)
     
     return {
         "answer": answer,
         "citations": citations
     }
 
+async def answer_query_rag_stream(query: str, user_id: str, token: str):
+    """
+    Streaming variant of answer_query_rag.
+    Yields ("citations", list) once retrieval is done, then ("token", str) pieces
+    as Gemini generates them, then ("done", response) with the full answer.
+    """
+    cached = answer_cache.get(user_id, query) if ANSWER_CACHE_ENABLED else None
+    query_embedding = None
+    if not cached:
+        with span("rag.embed_query"):
+            query_embedding = await aget_embedding(query)
+        if ANSWER_CACHE_ENABLED:
+            cached = answer_cache.get(user_id, query, query_embedding)
+    if cached:
+        yield "citations", cached["citations"]
+        yield "token", cached["answer"]
+        yield "done", cached
+        return
+
+    prompt, citations = await _prepare_answer(query, user_id, token, query_embedding)
+    yield "citations", citations
+
+    if prompt is None:
+        answer = NO_CONTEXT_ANSWER
+        yield "token", answer
+    else:
+        # Recorded rather than wrapped in spans: the generator is suspended at each yield
+        pieces = []
+        started = time.perf_counter()
+        async for piece in astream_response(prompt):
+            if not pieces:
+                record("rag.generate_first_token", time.perf_counter() - started)
+            pieces.append(piece)
+            yield "token", piece
+        record("rag.generate", time.perf_counter() - started)
+        answer = "".join(pieces)
+
+    response = {"answer": answer, "citations": citations}
+    if ANSWER_CACHE_ENABLED:
+        answer_cache.put(user_id, query, query_embedding, response)
+    yield "done", {**response}
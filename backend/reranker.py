@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "ms-marco-TinyBERT-L-2-v2")
+RERANK_CACHE_DIR = os.environ.get("RERANK_CACHE_DIR", "./flashrank_cache")
+# Threads running the cross-encoder (ONNX Runtime releases the GIL while scoring)
+RERANK_WORKERS = int(os.environ.get("RERANK_WORKERS", "2"))
+# Micro-batching: wait up to this long for concurrent queries, and cap pairs per model call
+RERANK_BATCH_WAIT_MS = float(os.environ.get("RERANK_BATCH_WAIT_MS", "5"))
+RERANK_MAX_BATCH_PAIRS = int(os.environ.get("RERANK_MAX_BATCH_PAIRS", "128"))
+# Passages are cut to this many characters before scoring (the model sees 512 tokens at most)
+RERANK_MAX_PASSAGE_CHARS = int(os.environ.get("RERANK_MAX_PASSAGE_CHARS", "2000"))
+RERANK_SCORE_CACHE_SIZE = int(os.environ.get("RERANK_SCORE_CACHE_SIZE", "20000"))
+
+
+class RerankService:
+    """
+    Cross-encoder reranking off the event loop.
+    Queries arriving within RERANK_BATCH_WAIT_MS of each other are scored in a
+    single model invocation on a dedicated thread pool, and (query, passage id)
+    scores are cached so repeated candidates are not rescored.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str, workers: int):
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self._ranker = None
+        self._ranker_lock = threading.Lock()
+        # Set once the model is loaded: listwise (LLM) models only rank within one candidate list
+        self._listwise = False
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rerank")
+        self._pending = []
+        self._flush_handle = None
+        self._scores = OrderedDict()
+        self._scores_lock = threading.Lock()
+
+    def _get_ranker(self):
+        """Load the FlashRank model on first use (thread-safe)."""
+        if self._ranker is None:
+            with self._ranker_lock:
+                if self._ranker is None:
+                    from flashrank import Ranker
+                    ranker = Ranker(model_name=self.model_name, cache_dir=self.cache_dir)
+                    self._listwise = getattr(ranker, "llm_model", None) is not None
+                    self._ranker = ranker
+        return self._ranker
+
+    def _score_listwise(self, ranker, pairs: list[tuple[str, str]]) -> list[float]:
+        """Listwise models score a query's whole candidate list at once: one Ranker.rerank per query."""
+        from flashrank import RerankRequest
+        by_query = OrderedDict()
+        for index, (query, passage) in enumerate(pairs):
+            by_query.setdefault(query, []).append(index)
+
+        scores = [0.0] * len(pairs)
+        for query, indices in by_query.items():
+            passages = [{"id": index, "text": pairs[index][1]} for index in indices]
+            for result in ranker.rerank(RerankRequest(query=query, passages=passages)):
+                scores[result["id"]] = float(result["score"])
+        return scores
+
+    def _score_pairs(self, pairs: list[tuple[str, str]]) -> list[float]:
+        """Score (query, passage) pairs; runs on the rerank thread pool."""
+        ranker = self._get_ranker()
+        if self._listwise:
+            return self._score_listwise(ranker, pairs)
+
+        scores = []
+        for start in range(0, len(pairs), RERANK_MAX_BATCH_PAIRS):
+            # Same pairwise scoring as Ranker.rerank, over pairs from several queries
+            encoded = ranker.tokenizer.encode_batch([list(pair) for pair in pairs[start:start + RERANK_MAX_BATCH_PAIRS]])
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            token_type_ids = np.array([e.type_ids for e in encoded], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+
+            onnx_input = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if not np.all(token_type_ids == 0):
+                onnx_input["token_type_ids"] = token_type_ids
+
+            logits = ranker.session.run(None, onnx_input)[0]
+            if logits.shape[1] == 1:
+                batch_scores = 1 / (1 + np.exp(-logits.flatten()))
+            else:
+                exp_logits = np.exp(logits)
+                batch_scores = exp_logits[:, 1] / np.sum(exp_logits, axis=1)
+            scores.extend(float(score) for score in batch_scores)
+        return scores
+
+    def _cache_key(self, query_hash: str, passage_id: str) -> tuple:
+        return (query_hash, passage_id)
+
+    def _cached_scores(self, query_hash: str, passages: list[dict]) -> dict:
+        with self._scores_lock:
+            found = {}
+            for passage in passages:
+                key = self._cache_key(query_hash, passage["id"])
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    found[passage["id"]] = self._scores[key]
+            return found
+
+    def _store_scores(self, query_hash: str, scored: dict):
+        with self._scores_lock:
+            for passage_id, score in scored.items():
+                self._scores[self._cache_key(query_hash, passage_id)] = score
+            while len(self._scores) > RERANK_SCORE_CACHE_SIZE:
+                self._scores.popitem(last=False)
+
+    async def rerank(self, query: str, passages: list[dict]) -> list[dict]:
+        """
+        Rerank passages ({"id", "text", "meta"}) for a query.
+        Returns the passages with a "score", best first (like Ranker.rerank).
+        """
+        query_hash = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        # Listwise scores are only comparable within one candidate list, so they are not cached
+        scores = {} if self._listwise else self._cached_scores(query_hash, passages)
+        misses = [p for p in passages if p["id"] not in scores]
+
+        if misses:
+            pairs = [(query, p["text"][:RERANK_MAX_PASSAGE_CHARS]) for p in misses]
+            new_scores = await self._submit(pairs)
+            scored = {p["id"]: score for p, score in zip(misses, new_scores)}
+            if not self._listwise:
+                self._store_scores(query_hash, scored)
+            scores.update(scored)
+
+        results = [{**p, "score": scores[p["id"]]} for p in passages]
+        results.sort(key=lambda p: p["score"], reverse=True)
+        return results
+
+    async def _submit(self, pairs: list[tuple[str, str]]) -> list[float]:
+        """Queue pairs for the next micro-batch and wait for their scores."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((pairs, future))
+
+        pending_pairs = sum(len(p) for p, _ in self._pending)
+        if pending_pairs >= RERANK_MAX_BATCH_PAIRS:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(RERANK_BATCH_WAIT_MS / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch: list[tuple]):
+        all_pairs = [pair for pairs, _ in batch for pair in pairs]
+        try:
+            scores = await asyncio.get_running_loop().run_in_executor(self._executor, self._score_pairs, all_pairs)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for pairs, future in batch:
+            if not future.done():
+                future.set_result(scores[offset:offset + len(pairs)])
+            offset += len(pairs)
+
+    async def warmup(self):
+        """Load the model and run one dummy inference, so the first query does not pay for either."""
+        await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._score_pairs, [("warmup query", "warmup passage")]
+        )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+rerank_service = RerankService(RERANK_MODEL, RERANK_CACHE_DIR, RERANK_WORKERS)
@@ -1,8 +1,15 @@
-from supabase import create_client, Client, ClientOptions
+from collections import OrderedDict
+import jwt
 import os
+import threading
+import time
 from pathlib import Path
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    from supabase import Client
+
 env_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path=env_path)
 
@@ -12,13 +19,62 @@ key: str = os.environ.get("SUPABASE_KEY")
 if not url or not key:
     raise ValueError("Supabase credentials not found in env variables")
 
-supabase: Client = create_client(url, key)
+# Scoped clients are reused per token until the token expires (or falls out of the LRU)
+SCOPED_CLIENT_CACHE_SIZE = int(os.environ.get("SCOPED_CLIENT_CACHE_SIZE", "256"))
+SCOPED_CLIENT_TTL_SECONDS = int(os.environ.get("SCOPED_CLIENT_TTL_SECONDS", "3600"))
+
+# The supabase package and the shared client are loaded on first use, not at import
+_supabase = None
+_supabase_lock = threading.Lock()
+
+_scoped_clients = OrderedDict()
+_scoped_clients_lock = threading.Lock()
 
-def get_supabase_client():
-    return supabase
+def get_supabase_client() -> "Client":
+    """
+    Shared service client (SUPABASE_KEY, the service role key), created on first use
+    (thread-safe). It bypasses RLS, so callers must filter by user_id themselves.
+    """
+    global _supabase
+    if _supabase is None:
+        with _supabase_lock:
+            if _supabase is None:
+                from supabase import create_client
+                _supabase = create_client(url, key)
+    return _supabase
 
-def get_scoped_client(token: str) -> Client:
-    """Create a Supabase client scoped to the user's token for RLS."""
+def _token_expiry(token: str) -> float:
+    """Expiry of the JWT (not verified here; auth.get_current_user does that)."""
+    try:
+        payload = jwt.decode(token, options={"verify_signature": False})
+        return float(payload["exp"])
+    except Exception:
+        return time.time() + SCOPED_CLIENT_TTL_SECONDS
+
+def get_scoped_client(token: str) -> "Client":
+    """
+    Supabase client scoped to the user's token for RLS.
+    Clients are cached by token, so every call in a request (and later requests
+    with the same token) reuses one client and its keep-alive HTTP connections.
+    """
+    now = time.time()
+    with _scoped_clients_lock:
+        entry = _scoped_clients.get(token)
+        if entry and entry[1] > now:
+            _scoped_clients.move_to_end(token)
+            return entry[0]
+
+    from supabase import create_client, ClientOptions
     # Pass the user's JWT in the Authorization header via ClientOptions
     options = ClientOptions().replace(headers={'Authorization': f'Bearer {token}'})
-    return create_client(url, key, options=options)
+    client = create_client(url, key, options=options)
+    expires_at = min(_token_expiry(token), now + SCOPED_CLIENT_TTL_SECONDS)
+
+    with _scoped_clients_lock:
+        _scoped_clients[token] = (client, expires_at)
+        _scoped_clients.move_to_end(token)
+        for cached_token in [t for t, (_, expiry) in _scoped_clients.items() if expiry <= now]:
+            del _scoped_clients[cached_token]
+        while len(_scoped_clients) > SCOPED_CLIENT_CACHE_SIZE:
+            _scoped_clients.popitem(last=False)
+    return client
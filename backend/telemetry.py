@@ -0,0 +1,254 @@
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() != "false"
+# Requests slower than this log their spans as one JSON line (0 logs every request, -1 none)
+TRACE_SLOW_REQUEST_MS = float(os.environ.get("TRACE_SLOW_REQUEST_MS", "2000"))
+
+# Histogram buckets in seconds, from cache hits to slow generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += [line for key, value in items for line in self._render_value(key, value)]
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_value(self, key: tuple, value: float) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts with a final +Inf bucket, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            else:
+                state[0][-1] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_value(self, key: tuple, state: list) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), state[0]):
+            cumulative += count
+            le = 'le="%s"' % _format_value(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(state[1])}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {state[2]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics in the Prometheus text format (no client library needed).
+    With several server workers each process has its own registry, so scrape
+    every worker (or run one worker per container).
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+registry = MetricsRegistry()
+
+stage_duration = registry.histogram(
+    "rag_stage_duration_seconds", "Duration of pipeline stages (see telemetry.span)", ("stage", "outcome")
+)
+request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request duration, until the last body byte is sent",
+    ("method", "route", "status")
+)
+
+# The request trace collecting spans, and the enclosing span's name
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+
+
+class Trace:
+    """Spans recorded while handling one request (shared by its tasks and threads)."""
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, name: str, parent: str | None, started: float, duration: float, outcome: str, attributes: dict):
+        # list.append is atomic, so spans from worker threads need no lock
+        self.spans.append({
+            "name": name,
+            "parent": parent,
+            "start_ms": round((started - self.started) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+            "outcome": outcome,
+            **({"attributes": attributes} if attributes else {}),
+        })
+
+    def log(self, duration: float, **fields):
+        spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        print("[Trace] " + json.dumps({
+            "trace_id": self.id, "name": self.name, "duration_ms": round(duration * 1000, 2),
+            **fields, "spans": spans,
+        }, default=str))
+
+
+def record(name: str, seconds: float, outcome: str = "ok", **attributes):
+    """Record an already measured stage (for stages that cannot be wrapped in `span`)."""
+    stage_duration.observe(seconds, stage=name, outcome=outcome)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, _current_span.get(), time.perf_counter() - seconds, seconds, outcome, attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a stage: observed in rag_stage_duration_seconds{stage=name} and, inside
+    a request, added to its trace. Works around sync and async code alike (the
+    span context follows asyncio tasks and to_thread calls). Yields the
+    attributes dict, so results such as row counts can be attached to the span.
+    """
+    started = time.perf_counter()
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    outcome = "ok"
+    try:
+        yield attributes
+    except BaseException as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        duration = time.perf_counter() - started
+        stage_duration.observe(duration, stage=name, outcome=outcome)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, parent, started, duration, outcome, attributes)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware: per-route latency histogram and a trace per request.
+    Timing ends with the last body chunk, so streamed responses are measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(f"{scope['method']} {scope['path']}")
+        trace_token = _current_trace.set(trace)
+        status = 500
+        finished = False
+
+        def finish():
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            duration = time.perf_counter() - trace.started
+            # The route template (not the raw path) keeps label cardinality bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            request_duration.observe(duration, method=scope["method"], route=route, status=str(status))
+            if 0 <= TRACE_SLOW_REQUEST_MS <= duration * 1000 and trace.spans:
+                trace.log(duration, route=route, status=status)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
+            _current_trace.reset(trace_token)
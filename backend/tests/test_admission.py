@@ -0,0 +1,93 @@
+import asyncio
+from backend.admission import AdmissionController, BULK, INTERACTIVE, Overloaded, SingleFlight
+
+
+def _controller(**overrides) -> AdmissionController:
+    settings = dict(rate=50, burst=4, max_concurrency=4, bulk_max_concurrency=2,
+                    interactive_reserve=1, max_wait=1.0, max_queue=10)
+    settings.update(overrides)
+    return AdmissionController(**settings)
+
+
+def test_reserve_at_or_above_burst_is_clamped():
+    controller = _controller(burst=2, interactive_reserve=5)
+    assert controller.interactive_reserve == 1
+
+
+def test_bulk_is_admitted_when_reserve_equals_burst():
+    controller = _controller(burst=2, interactive_reserve=2)
+
+    async def run():
+        await asyncio.wait_for(controller.acquire(BULK), timeout=1)
+        controller.release(BULK)
+
+    asyncio.run(run())
+
+
+def test_interactive_is_admitted_ahead_of_queued_bulk():
+    controller = _controller(rate=20, burst=1, interactive_reserve=0)
+    order = []
+
+    async def call(priority: str, name: str):
+        await controller.acquire(priority)
+        order.append(name)
+        controller.release(priority)
+
+    async def run():
+        bulk = [asyncio.create_task(call(BULK, f"bulk{i}")) for i in range(4)]
+        await asyncio.sleep(0)
+        await call(INTERACTIVE, "chat")
+        await asyncio.gather(*bulk)
+
+    asyncio.run(run())
+    assert order.index("chat") <= 1
+
+
+def test_interactive_is_shed_when_the_wait_is_too_long():
+    controller = _controller(rate=1, burst=1, interactive_reserve=0, max_wait=1.5)
+
+    async def call():
+        await controller.acquire(INTERACTIVE)
+        controller.release(INTERACTIVE)
+
+    async def run():
+        return await asyncio.gather(*(call() for _ in range(5)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    shed = [r for r in results if isinstance(r, Overloaded)]
+    assert shed and all(r.retry_after >= 1 for r in shed)
+    assert results[0] is None
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def run():
+        return await asyncio.gather(*(flight.run("key", work) for _ in range(5)))
+
+    assert asyncio.run(run()) == [1] * 5
+    assert calls == 1 and "key" not in flight
+
+
+def test_single_flight_survives_a_cancelled_caller():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def run():
+        first = asyncio.create_task(flight.run("key", work))
+        second = asyncio.create_task(flight.run("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "done"
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+import jwt
+import pytest
+
+os.environ.setdefault("SUPABASE_URL", "http://supabase.invalid")
+os.environ.setdefault("SUPABASE_KEY", "test")
+
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+from fastapi.security import HTTPAuthorizationCredentials  # noqa: E402
+from backend import auth  # noqa: E402
+
+SECRET = "test-secret-that-is-long-enough-for-hs256"
+
+
+@pytest.fixture(autouse=True)
+def fresh_auth(monkeypatch):
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", SECRET)
+    monkeypatch.setattr(auth, "_jwks_client", None)
+    monkeypatch.setattr(auth, "_verified_tokens", type(auth._verified_tokens)())
+
+    def no_remote(token):
+        raise AssertionError("tokens in these tests must be verified locally")
+    monkeypatch.setattr(auth, "_verify_remotely", no_remote)
+
+
+def _token(key=SECRET, algorithm="HS256", ttl=3600, headers=None, **claims) -> str:
+    now = int(time.time())
+    payload = {"sub": "user-1", "aud": "authenticated", "iat": now, "exp": now + ttl, **claims}
+    return jwt.encode(payload, key, algorithm=algorithm, headers=headers)
+
+
+def _authenticate(token: str) -> dict:
+    return auth.get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+
+
+def _rejected(token: str) -> HTTPException:
+    with pytest.raises(HTTPException) as raised:
+        _authenticate(token)
+    return raised.value
+
+
+def test_valid_token_is_verified_locally():
+    token = _token()
+    assert _authenticate(token) == {"id": "user-1", "token": token}
+
+
+def test_expired_token_is_rejected():
+    assert _rejected(_token(ttl=-120)).status_code == 401
+
+
+def test_wrong_audience_is_rejected():
+    assert _rejected(_token(aud="service_role")).status_code == 401
+
+
+def test_bad_signature_is_rejected():
+    assert _rejected(_token(key="some-other-secret-that-is-long-enough")).status_code == 401
+
+
+def _jwk(private_key, kid: str) -> dict:
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    return {**jwk, "kid": kid, "alg": "RS256", "use": "sig"}
+
+
+def test_unknown_kid_refreshes_the_jwks(monkeypatch):
+    old_key, new_key = (rsa.generate_private_key(public_exponent=65537, key_size=2048) for _ in range(2))
+    published = {"keys": [_jwk(old_key, "old")]}
+    fetches = []
+
+    def fetch_data(client):
+        fetches.append(time.time())
+        return published
+    monkeypatch.setattr(jwt.PyJWKClient, "fetch_data", fetch_data)
+
+    assert _authenticate(_token(old_key, "RS256", headers={"kid": "old"}))["id"] == "user-1"
+    assert _authenticate(_token(old_key, "RS256", headers={"kid": "old"}, sub="user-2"))["id"] == "user-2"
+    assert len(fetches) == 1  # the key set is cached
+
+    # The signing key rotates: a token with the new kid makes the client refetch the key set
+    published["keys"].append(_jwk(new_key, "new"))
+    assert _authenticate(_token(new_key, "RS256", headers={"kid": "new"}))["id"] == "user-1"
+    assert len(fetches) == 2
+
+
+def test_cached_tokens_expire_at_their_exp(monkeypatch):
+    monkeypatch.setattr(auth, "AUTH_CACHE_TTL_SECONDS", 600)
+    token = _token(ttl=30)
+    exp = jwt.decode(token, options={"verify_signature": False})["exp"]
+    _authenticate(token)
+    assert auth._recall(token) is not None
+
+    # The cache TTL is longer than the token's lifetime, so the entry ends at exp
+    clock = {"now": exp - 1}
+    monkeypatch.setattr(auth.time, "time", lambda: clock["now"])
+    assert auth._recall(token) is not None
+    clock["now"] = exp
+    assert auth._recall(token) is None
+    assert token not in auth._verified_tokens
@@ -0,0 +1,98 @@
+import asyncio
+import base64
+import os
+import pytest
+
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("SUPABASE_URL", "http://supabase.invalid")
+os.environ.setdefault("SUPABASE_KEY", "test")
+
+from fastapi import HTTPException  # noqa: E402
+from backend import chat_history  # noqa: E402
+from backend.benchmarks.fakes import FakeDatabase, FakeSupabase  # noqa: E402
+from backend.chat_history import decode_cursor, encode_cursor, get_chat_messages, get_user_chats  # noqa: E402
+
+USER = "user-1"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDatabase(latency_ms=0)
+    monkeypatch.setattr(chat_history, "get_scoped_client", lambda token: FakeSupabase(db, USER))
+    return db
+
+
+def _chats(db: FakeDatabase, created_at: list[str]) -> list[str]:
+    # Ids are inserted out of order so ties on created_at are broken by id, not insertion order
+    ids = [f"{i:04d}-{j}" for j, i in enumerate(reversed(range(len(created_at))))]
+    db.tables["chats"] += [{"id": chat_id, "user_id": USER, "title": "t", "created_at": when}
+                           for chat_id, when in zip(ids, created_at)]
+    return ids
+
+
+def _all_pages(fetch, key: str, limit: int) -> list[list[dict]]:
+    pages, cursor = [], None
+    while True:
+        page = fetch(limit=limit, cursor=cursor)
+        pages.append(page[key])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trips():
+    row = {"created_at": "2024-05-01T10:00:00.123456+00:00", "id": "3f1c"}
+    assert decode_cursor(encode_cursor(row)) == ("2024-05-01T10:00:00.123456+00:00", "3f1c")
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"{not json").decode(),
+    base64.urlsafe_b64encode(b'["2024-05-01", 7]').decode(),
+    base64.urlsafe_b64encode(b'["2024-05-01\\")", "x"]').decode(),
+])
+def test_bad_cursors_are_rejected(cursor):
+    with pytest.raises((ValueError, TypeError)):
+        decode_cursor(cursor)
+
+
+def test_chat_pages_follow_the_keyset_with_ties_on_created_at(db):
+    # Every other pair of chats shares a timestamp, and page boundaries fall inside the ties
+    stamps = [f"2024-05-01T10:00:{i // 2:02d}+00:00" for i in range(9)]
+    _chats(db, stamps)
+    expected = sorted(db.tables["chats"], key=lambda row: (row["created_at"], row["id"]), reverse=True)
+
+    pages = _all_pages(lambda **kwargs: get_user_chats(USER, "token", **kwargs), "chats", limit=3)
+
+    assert [len(page) for page in pages] == [3, 3, 3]
+    assert [chat["id"] for page in pages for chat in page] == [row["id"] for row in expected]
+
+
+def test_last_page_has_no_cursor(db):
+    _chats(db, ["2024-05-01T10:00:00+00:00", "2024-05-01T10:00:01+00:00"])
+    assert get_user_chats(USER, "token", limit=2)["next_cursor"] is None
+    first = get_user_chats(USER, "token", limit=1)
+    last = get_user_chats(USER, "token", limit=1, cursor=first["next_cursor"])
+    assert len(last["chats"]) == 1 and last["next_cursor"] is None
+
+
+def test_message_pages_are_oldest_first(db):
+    chat_id = _chats(db, ["2024-05-01T10:00:00+00:00"])[0]
+    db.tables["messages"] += [{"id": f"m{i:02d}", "chat_id": chat_id, "role": "user", "content": str(i),
+                               "created_at": f"2024-05-01T10:01:{i // 3:02d}+00:00"} for i in range(7)]
+
+    pages = _all_pages(lambda **kwargs: get_chat_messages(chat_id, USER, "token", **kwargs), "messages", limit=2)
+
+    assert [message["content"] for page in pages for message in page] == [str(i) for i in range(7)]
+
+
+@pytest.mark.parametrize("route", ["get_chats_route", "get_messages_route"])
+def test_routes_return_400_for_a_bad_cursor(db, route):
+    from backend import main
+
+    kwargs = {"limit": 10, "cursor": "not base64!", "user": {"id": USER, "token": "token"}}
+    if route == "get_messages_route":
+        kwargs["chat_id"] = "chat"
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(getattr(main, route)(**kwargs))
+    assert raised.value.status_code == 400
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import pytest
+from types import SimpleNamespace
+
+os.environ.setdefault("SUPABASE_URL", "http://supabase.invalid")
+os.environ.setdefault("SUPABASE_KEY", "test")
+
+from backend import chat_writer as chat_writer_module  # noqa: E402
+from backend.chat_writer import CHAT_WRITE_RETRIES, ChatWriter  # noqa: E402
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Records (table, rows, token) per insert; tables listed in `failures` fail that many times first."""
+    writes = SimpleNamespace(calls=[], failures={}, delays=[])
+
+    def writer(table):
+        def write(rows, token):
+            writes.calls.append((table, list(rows), token))
+            if writes.failures.get(table, 0):
+                writes.failures[table] -= 1
+                raise RuntimeError(f"{table} insert failed")
+        return write
+
+    async def sleep(seconds):
+        writes.delays.append(seconds)
+
+    monkeypatch.setattr(chat_writer_module, "create_chats", writer("chats"))
+    monkeypatch.setattr(chat_writer_module, "save_messages", writer("messages"))
+    monkeypatch.setattr(chat_writer_module.asyncio, "sleep", sleep)
+    return writes
+
+
+def _converse(writer: ChatWriter):
+    writer.write_chat("token-a", "chat-1", "user-a", "Title")
+    writer.write_message("token-a", "chat-1", "user", "question")
+    writer.write_message("token-a", "chat-1", "assistant", "answer")
+    writer.write_message("token-b", "chat-2", "user", "other user")
+
+
+def test_queued_writes_are_flushed_on_stop(writes):
+    async def run():
+        # A long flush window: nothing is written until the writer is stopped
+        writer = ChatWriter(flush_ms=60_000, max_batch=500)
+        writer.start()
+        _converse(writer)
+        assert writes.calls == []
+        await writer.stop()
+    asyncio.run(run())
+
+    # One bulk insert per table and token (tokens are written concurrently),
+    # chats before the messages that reference them
+    by_token = {}
+    for table, rows, token in writes.calls:
+        by_token.setdefault(token, []).append((table, [row.get("content") for row in rows]))
+    assert by_token == {
+        "token-a": [("chats", [None]), ("messages", ["question", "answer"])],
+        "token-b": [("messages", ["other user"])],
+    }
+
+
+def test_failed_writes_are_retried_with_backoff(writes):
+    writes.failures["messages"] = 1
+
+    async def run():
+        writer = ChatWriter(flush_ms=10, max_batch=500)
+        writer.start()
+        _converse(writer)
+        await writer.stop()
+    asyncio.run(run())
+
+    attempts = [(table, token) for table, rows, token in writes.calls]
+    assert attempts.count(("messages", "token-a")) + attempts.count(("messages", "token-b")) == 3
+    assert writes.delays == [0.5]
+
+
+def test_rows_are_dropped_after_the_last_attempt(writes):
+    writes.failures["chats"] = CHAT_WRITE_RETRIES
+
+    async def run():
+        writer = ChatWriter(flush_ms=10, max_batch=500)
+        writer.start()
+        writer.write_chat("token-a", "chat-1", "user-a", "Title")
+        await writer.stop()
+    asyncio.run(run())
+
+    assert [table for table, rows, token in writes.calls] == ["chats"] * CHAT_WRITE_RETRIES
+    assert writes.delays == [0.5 * 2 ** attempt for attempt in range(CHAT_WRITE_RETRIES - 1)]
@@ -0,0 +1,80 @@
+import os
+import random
+import re
+import pytest
+from backend.chunking import count_tokens, iter_structured_chunks, _PIECE_PATTERN
+from backend.benchmarks.common import synthetic_corpus
+from backend.file_processor import PageText
+
+for name, value in (("GEMINI_API_KEY", "test"), ("SUPABASE_URL", "http://supabase.invalid"), ("SUPABASE_KEY", "test")):
+    os.environ.setdefault(name, value)
+
+from backend.rag_pipeline import _PageTracker  # noqa: E402
+
+
+def _sentence(rng: random.Random, words: int = 12) -> str:
+    return " ".join(rng.choice(["alpha", "beta", "gamma", "delta", "invoice", "ledger", "quarterly"])
+                    for _ in range(words)).capitalize() + "."
+
+
+def _paragraph(rng: random.Random, sentences: int) -> str:
+    return " ".join(_sentence(rng) for _ in range(sentences))
+
+
+@pytest.mark.parametrize("text", [
+    "", "word", "x" * 17, "don't stop_me now!!", "naïve café — 漢字 ²³", "a\tb\x0bc\x1cd ... (e)",
+    synthetic_corpus(sections=5),
+])
+def test_count_tokens_matches_the_piece_pattern(text):
+    assert count_tokens(text) == len(_PIECE_PATTERN.findall(text))
+
+
+def test_chunks_stay_within_the_token_budget():
+    blocks = [synthetic_corpus(sections=10),
+              # A run-on sentence and an unbroken token longer than a whole chunk
+              " ".join(["word"] * 400),
+              "QUJD" * 600]
+    chunks = list(iter_structured_chunks(["\n\n".join(blocks)], chunk_tokens=120, overlap_tokens=0))
+    assert all(count_tokens(chunk) <= 120 for chunk in chunks)
+    # Without overlap, the chunks hold exactly the input text (up to whitespace)
+    assert "".join("".join(chunks).split()) == "".join("".join(blocks).split())
+
+
+def test_headings_and_paragraphs_are_chunk_boundaries():
+    rng = random.Random(1)
+    sections = []
+    for number in range(6):
+        paragraphs = [_paragraph(rng, 3) for _ in range(3)]
+        sections.append((f"## Section {number}", paragraphs))
+    text = "\n\n".join(heading + "\n\n" + "\n\n".join(paragraphs) for heading, paragraphs in sections)
+
+    chunks = list(iter_structured_chunks([text], chunk_tokens=200, overlap_tokens=0))
+    paragraphs = {p for _, section in sections for p in section}
+    for chunk in chunks:
+        # Each section (about 130 tokens) starts its own chunk once the current one is half full
+        assert chunk.startswith("## Section")
+        for block in chunk.split("\n\n")[1:]:
+            assert block in paragraphs
+
+
+def test_segment_boundaries_do_not_change_the_chunks():
+    text = synthetic_corpus(sections=8)
+    whole = list(iter_structured_chunks([text], chunk_tokens=150))
+    pieces = [text[i:i + 777] for i in range(0, len(text), 777)]
+    assert list(iter_structured_chunks(pieces, chunk_tokens=150)) == whole
+
+
+def test_pages_are_attributed_with_whitespace_only_paragraph_breaks():
+    rng = random.Random(2)
+    # PDF extraction often separates paragraphs with lines holding only spaces
+    # Short one-sentence paragraphs, each naming its page, so chunks join several of them with "\n\n"
+    pages = [PageText("\n \n".join(f"Page{number}marker {_sentence(rng, 4)}" for _ in range(12)) + "\n", number)
+             for number in range(1, 9)]
+    tracker = _PageTracker(pages)
+    located = [(chunk, tracker.locate(chunk)) for chunk in iter_structured_chunks(tracker, chunk_tokens=90, overlap_tokens=0)]
+
+    assert len(located) > 8
+    for chunk, pages_found in located:
+        markers = [int(n) for n in re.findall(r"Page(\d+)marker", chunk)]
+        assert pages_found["page_start"] == markers[0]
+        assert pages_found["page_end"] == markers[-1]
@@ -0,0 +1,27 @@
+from backend.benchmarks.common import synthetic_corpus
+from backend.chunking import count_tokens
+from backend.context_packing import pack_context
+from backend.utils import iter_text_chunks
+
+
+def _docs(chunks: list[str]) -> list[dict]:
+    return [{
+        "text": chunk, "meta": {"source": f"doc{i}.txt", "chunk_index": 0}, "score": 1.0 - i / 10
+    } for i, chunk in enumerate(chunks)]
+
+
+def test_default_budget_keeps_five_full_size_chunks():
+    chunks = sorted(iter_text_chunks([synthetic_corpus()]), key=len, reverse=True)[:5]
+    assert all(len(chunk) > 3500 for chunk in chunks)
+    packed = pack_context(_docs(chunks))
+    assert [block["text"] for block in packed] == chunks
+
+
+def test_budget_is_measured_with_the_chunker_estimate():
+    chunks = list(iter_text_chunks([synthetic_corpus()]))[:8]
+    budget = count_tokens(chunks[0]) + count_tokens(chunks[1]) + 150
+    packed = pack_context(_docs(chunks), token_budget=budget)
+    assert [block["text"] for block in packed[:2]] == chunks[:2]
+    # The third block is trimmed to the remaining budget, and nothing follows it
+    assert len(packed) == 3 and packed[2]["text"].endswith(" ...")
+    assert count_tokens(packed[2]["text"]) <= 150 + 3
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from backend import crawler
+from backend.crawler import CrawlState, Crawler
+
+
+def _page(title: str, body: str, links: list[str] = ()) -> str:
+    anchors = "".join(f'<a href="{link}">{link}</a>' for link in links)
+    return f"<html><head><title>{title}</title></head><body><p>{body}</p>{anchors}</body></html>"
+
+
+class _Site:
+    """In-memory pages served over HTTP with ETags; records every request."""
+
+    def __init__(self, pages: dict[str, str]):
+        self.pages = dict(pages)
+        self.requests = []
+
+    def etag(self, path: str) -> str:
+        return '"' + hashlib.sha256(self.pages[path].encode("utf-8")).hexdigest()[:16] + '"'
+
+
+@pytest.fixture
+def site():
+    site = _Site({})
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            site.requests.append((self.path, self.headers.get("If-None-Match")))
+            if self.path not in site.pages:
+                self.send_error(404)
+                return
+            etag = site.etag(self.path)
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            body = site.pages[self.path].encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    site.base = f"http://127.0.0.1:{server.server_port}"
+    yield site
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def state(tmp_path, monkeypatch):
+    state = CrawlState(str(tmp_path / "crawl_state.sqlite"))
+    monkeypatch.setattr(crawler, "crawl_state", state)
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1,localhost")
+    return state
+
+
+def _crawl(site, user_id: str = "user", commit: bool = True, **limits) -> dict:
+    """Run a crawl from the site root; returns {path: page}. Changed pages are committed like after ingestion."""
+    async def run():
+        pages = {}
+        async for page in Crawler(user_id, **limits).crawl(site.base + "/"):
+            if commit and page.text is not None:
+                page.commit(user_id)
+            pages[page.url[len(site.base):] if page.url.startswith(site.base) else page.url] = page
+        return pages
+    return asyncio.run(run())
+
+
+def _default_site(site, other_origin: str = None):
+    site.pages.update({
+        "/": _page("Home", "Welcome to the handbook home page.",
+                   ["/a", "/b", "/copy", "/a#section"] + ([other_origin] if other_origin else [])),
+        "/a": _page("A", "Page A explains the onboarding process.", ["/c"]),
+        "/b": _page("B", "Page B lists the holiday calendar."),
+        "/copy": _page("B", "Page B lists the holiday calendar."),
+        "/c": _page("C", "Page C covers expense reports.", ["/d"]),
+        "/d": _page("D", "Page D is three links deep."),
+    })
+
+
+def test_stays_on_the_start_origin(site):
+    # Same server under another host name: a different origin, so it must not be fetched
+    other = site.base.replace("127.0.0.1", "localhost") + "/b"
+    _default_site(site, other_origin=other)
+    pages = _crawl(site, max_depth=3)
+    assert other not in pages
+    assert all(url.startswith("/") for url in pages)
+    # The fragment link is the same page as /a
+    assert [path for path, _ in site.requests].count("/a") == 1
+
+
+def test_max_depth_limits_link_following(site):
+    _default_site(site)
+    pages = _crawl(site, max_depth=1)
+    assert set(pages) == {"/", "/a", "/b", "/copy"}
+    assert "/c" not in {path for path, _ in site.requests}
+
+
+def test_max_pages_limits_fetches(site):
+    _default_site(site)
+    pages = _crawl(site, max_pages=3, max_depth=3)
+    assert len(pages) == 3
+    assert len(site.requests) == 3
+
+
+def test_identical_content_is_deduplicated(site):
+    _default_site(site)
+    pages = _crawl(site, max_depth=1)
+    statuses = sorted(pages[path].status for path in ("/b", "/copy"))
+    assert statuses == ["changed", "duplicate"]
+    duplicate = next(pages[path] for path in ("/b", "/copy") if pages[path].status == "duplicate")
+    assert duplicate.text is None
+
+
+def test_recrawl_sends_etags_and_skips_unchanged_pages(site):
+    _default_site(site)
+    first = _crawl(site, max_depth=3)
+    assert {page.status for page in first.values()} <= {"changed", "duplicate"}
+
+    site.requests.clear()
+    site.pages["/b"] = _page("B", "Page B now lists next year's holidays.")
+    second = _crawl(site, max_depth=3)
+
+    assert set(second) == set(first)
+    # Every known page is fetched conditionally
+    assert all(etag is not None for _, etag in site.requests)
+    assert second["/b"].status == "changed" and second["/b"].text
+    unchanged = {path: page.status for path, page in second.items() if path != "/b"}
+    assert set(unchanged.values()) == {"not_modified"}
+    # 304s carry the links from the previous crawl, so pages below them are still visited
+    assert "/d" in second
+
+
+def test_uncommitted_pages_are_fetched_in_full_again(site):
+    _default_site(site)
+    _crawl(site, max_depth=1, commit=False)
+    site.requests.clear()
+    second = _crawl(site, max_depth=1)
+    changed = {path for path, page in second.items() if page.status == "changed"}
+    assert {"/", "/a"} <= changed
+    assert dict(site.requests)["/a"] is None
@@ -0,0 +1,30 @@
+from backend.embedding_cache import EmbeddingCache
+
+VECTOR = [0.5] * 256  # 1 KiB as float32
+
+
+def _stored(cache: EmbeddingCache) -> tuple[int, int]:
+    return cache._connect().execute("select coalesce(sum(size), 0), count(*) from embeddings").fetchone()
+
+
+def test_byte_total_tracks_inserts_replacements_and_eviction(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    cache = EmbeddingCache(path, max_bytes=1024 * 50, lru_size=4)
+    for i in range(40):
+        cache.put("model", "task", f"text {i}", VECTOR)
+    # Replacing an existing key (and repeating one within a batch) does not grow the total
+    cache.put_many("model", "task", ["text 1", "text 1", "text 2"], [VECTOR, VECTOR, VECTOR])
+    assert _stored(cache) == (40 * 1024, 40)
+    assert cache._total_bytes == 40 * 1024
+
+    for i in range(40, 60):
+        cache.put("model", "task", f"text {i}", VECTOR)
+    total, count = _stored(cache)
+    assert total == cache._total_bytes <= 1024 * 50
+    # The oldest rows went first
+    assert cache.get("model", "task", "text 59") == VECTOR
+    assert cache.get_many("model", "task", ["text 0"]) == {}
+
+    reopened = EmbeddingCache(path, max_bytes=1024 * 50, lru_size=4)
+    reopened._connect()
+    assert reopened._total_bytes == total
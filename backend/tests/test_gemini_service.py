@@ -0,0 +1,25 @@
+import os
+import pytest
+
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+from backend.gemini_service import _is_payload_error  # noqa: E402
+
+
+class InvalidArgument(Exception):
+    """Stand-in for google.api_core.exceptions.InvalidArgument (matched by name)."""
+
+
+@pytest.mark.parametrize("error, expected", [
+    (Exception("400 Request payload size exceeds the limit: 36000 bytes."), True),
+    (Exception("413 Request entity too large"), True),
+    (Exception("The request exceeds the maximum allowed number of tokens"), True),
+    (InvalidArgument("400 at most 100 requests can be in one batch"), True),
+    (Exception("429 Too many requests"), False),
+    (Exception("Quota exceeds the per-minute limit"), False),
+    (Exception("429 Resource has been exhausted (e.g. check quota)."), False),
+    (Exception("Max retries (5) exceeded. Last error: 503 upstream 400ms timeout"), False),
+    (InvalidArgument("400 API key not valid. Please pass a valid API key."), False),
+])
+def test_only_size_errors_split_a_batch(error, expected):
+    assert _is_payload_error(error) is expected
@@ -0,0 +1,45 @@
+import asyncio
+from backend.benchmarks.fakes import FakeDatabase, FakeSupabase
+from backend.vector_store import LocalRetrievalBackend
+
+
+def _database(user_id: str) -> FakeDatabase:
+    db = FakeDatabase(latency_ms=50)
+    db.tables["documents"] = [{
+        "id": i, "user_id": user_id, "content": f"passage {i} about invoices",
+        "metadata": {"source": "doc.txt", "chunk_index": i}, "embedding": [float(i), 1.0, 0.0]
+    } for i in range(1, 4)]
+    return db
+
+
+def test_cancelled_caller_does_not_cancel_a_shared_index_build(tmp_path):
+    db = _database("user")
+    backend = LocalRetrievalBackend(str(tmp_path))
+    supabase = FakeSupabase(db)
+
+    async def run():
+        first = asyncio.ensure_future(backend.lexical_match(supabase, "user", "invoices", 5))
+        second = asyncio.ensure_future(backend.lexical_match(supabase, "user", "invoices", 5))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    results = asyncio.run(run())
+    assert len(results) == 3
+    # Both callers shared one build
+    assert db.calls["select:documents"] == 1
+
+
+def test_metadata_updates_survive_a_reload(tmp_path):
+    db = _database("user")
+    backend = LocalRetrievalBackend(str(tmp_path))
+    asyncio.run(backend.lexical_match(FakeSupabase(db), "user", "invoices", 5))
+
+    backend.update_metadata("user", 2, {"source": "doc.txt", "chunk_index": 7, "page": 3})
+    reloaded = LocalRetrievalBackend(str(tmp_path))
+    results = asyncio.run(reloaded.lexical_match(FakeSupabase(db), "user", "invoices", 5))
+    metadata = {row["id"]: row["metadata"] for row in results}
+    assert metadata[2] == {"source": "doc.txt", "chunk_index": 7, "page": 3}
+    assert metadata[1]["chunk_index"] == 1
+    # Served from the index on disk, not rebuilt from the database
+    assert db.calls["select:documents"] == 1
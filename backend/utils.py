@@ -1,3 +1,7 @@
+import hashlib
+import re
+from typing import Iterable, Iterator
+
 def recursive_character_text_splitter(
     text: str, 
     chunk_size: int = 4000, 
@@ -32,3 +36,68 @@ def recursive_character_text_splitter(
             start = end
 
     return chunks
+
+
+def iter_text_chunks(
+    segments: Iterable[str],
+    chunk_size: int = 4000,
+    chunk_overlap: int = 400
+) -> Iterator[str]:
+    """
+    Streaming version of recursive_character_text_splitter.
+    Consumes text segments (e.g. PDF pages) lazily and yields the same chunks the
+    splitter would produce for their concatenation, holding at most about one
+    chunk plus one segment in memory.
+    """
+    buffer = ""
+    for segment in segments:
+        buffer = buffer + segment if buffer else segment
+        start = 0
+
+        # Only cut when more than a full chunk is buffered; the tail may still grow
+        while len(buffer) - start > chunk_size:
+            end = start + chunk_size
+
+            # Try to find the last space within the chunk to avoid splitting words
+            last_space = buffer.rfind(' ', start, end)
+            if last_space != -1 and last_space > start:
+                end = last_space
+
+            yield buffer[start:end]
+            start = end - chunk_overlap
+
+            # Ensure progress
+            if start >= end:
+                start = end
+
+        buffer = buffer[start:]
+
+    if buffer:
+        yield buffer
+
+
+def chunk_hash(chunk: str) -> str:
+    """Stable content hash of a chunk, stored in metadata for incremental re-ingestion."""
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased word tokens; keeps identifiers like error codes and snake_case names intact."""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def reciprocal_rank_fusion(result_lists: list[list[dict]], k: int = 60) -> list[dict]:
+    """
+    Fuse ranked result lists by reciprocal rank: score(d) = sum(1 / (k + rank)).
+    Documents are identified by their 'id'; the first occurrence of each is kept.
+    """
+    scores = {}
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            scores[doc["id"]] = scores.get(doc["id"], 0.0) + 1.0 / (k + rank)
+            docs.setdefault(doc["id"], doc)
+    ranked_ids = sorted(scores, key=scores.get, reverse=True)
+    return [{**docs[doc_id], "rrf_score": scores[doc_id]} for doc_id in ranked_ids]
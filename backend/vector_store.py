@@ -0,0 +1,499 @@
+import asyncio
+import json
+import math
+import os
+import shutil
+import threading
+from pathlib import Path
+import numpy as np
+from collections import Counter
+from backend.utils import tokenize
+
+# Retrieval backend: "supabase" (match_documents RPC, default) or "local" (in-process index)
+RETRIEVAL_BACKEND = os.environ.get("RETRIEVAL_BACKEND", "supabase").lower()
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", str(Path(__file__).parent / ".cache" / "vectors"))
+# Vector storage: float32, float16, int8 (per-vector scale) or binary (sign bits, 32x smaller than float32)
+LOCAL_INDEX_DTYPE = os.environ.get("LOCAL_INDEX_DTYPE", "float32").lower()
+# Quantized (int8/binary) indexes also keep float32 vectors on disk and rescore the best
+# match_count * factor first-pass candidates with them (0 disables, saving that disk space)
+LOCAL_INDEX_RESCORE_FACTOR = int(os.environ.get("LOCAL_INDEX_RESCORE_FACTOR", "10"))
+# Tenants with at least this many rows are searched through an IVF index
+LOCAL_INDEX_IVF_MIN_ROWS = int(os.environ.get("LOCAL_INDEX_IVF_MIN_ROWS", "50000"))
+LOCAL_INDEX_IVF_NPROBE = int(os.environ.get("LOCAL_INDEX_IVF_NPROBE", "8"))
+
+# Rows scored per block during a brute-force scan (bounds temporary memory)
+_SCAN_BLOCK_ROWS = 65536
+_QUANTIZED_DTYPES = ("int8", "binary")
+# Set bits per byte value, for Hamming distances over packed sign bits (numpy < 2.0)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+# BM25 parameters for the local lexical index
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+
+class SupabaseRetrievalBackend:
+    """
+    Default backend: vector search via the match_documents RPC.
+    The user id is passed explicitly so the database filters to the user's
+    partition before computing distances (see partition_documents.sql).
+    """
+
+    async def match(self, supabase, user_id: str, query_embedding: list[float],
+                    match_threshold: float, match_count: int) -> list[dict]:
+        response = await asyncio.to_thread(supabase.rpc("match_documents", {
+            "query_embedding": query_embedding,
+            "match_threshold": match_threshold,
+            "match_count": match_count,
+            "filter_user_id": user_id
+        }).execute)
+        return response.data or []
+
+    async def lexical_match(self, supabase, user_id: str, query_text: str, match_count: int) -> list[dict]:
+        """Full-text search over the generated fts column (see hybrid_search.sql)."""
+        response = await asyncio.to_thread(supabase.rpc("match_documents_lexical", {
+            "query_text": query_text,
+            "match_count": match_count,
+            "filter_user_id": user_id
+        }).execute)
+        return response.data or []
+
+    # Write hooks are no-ops: the documents table is the index
+    def add(self, user_id: str, rows: list[dict]):
+        pass
+
+    def remove(self, user_id: str, ids: list):
+        pass
+
+    def update_metadata(self, user_id: str, doc_id, metadata: dict):
+        pass
+
+
+class LocalUserIndex:
+    """
+    One tenant's vectors in an append-only, memory-mapped matrix of normalized vectors.
+    Files: vectors.bin (N x D of LOCAL_INDEX_DTYPE, or N x D/8 packed bits for binary),
+    scales.bin (int8 only), full.bin (N x D float32, quantized indexes with rescoring),
+    rows.jsonl (id, metadata, content per row), metadata.jsonl (later metadata updates,
+    replayed over rows.jsonl on load) and deleted.json (tombstoned ids).
+    """
+
+    def __init__(self, path: Path, dtype: str = LOCAL_INDEX_DTYPE):
+        self.path = path
+        self.dtype = dtype
+        self.rescore = dtype in _QUANTIZED_DTYPES and LOCAL_INDEX_RESCORE_FACTOR > 0
+        self.lock = threading.Lock()
+        self.dim = None
+        self.ids = []
+        self.metadata = []
+        self.offsets = []
+        self.deleted = set()
+        self._positions = {}
+        self._alive = None
+        self._vectors = None
+        self._scales = None
+        self._full = None
+        self._ivf = None
+        self._bm25 = None
+        self._load()
+
+    @property
+    def ready(self) -> bool:
+        return (self.path / "ready").exists()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _load(self):
+        rows_path = self.path / "rows.jsonl"
+        if not rows_path.exists():
+            return
+        with open(rows_path, "rb") as f:
+            offset = 0
+            for line in f:
+                row = json.loads(line)
+                self._positions[row["id"]] = len(self.ids)
+                self.ids.append(row["id"])
+                self.metadata.append(row["metadata"])
+                self.offsets.append(offset)
+                offset += len(line)
+        info_path = self.path / "info.json"
+        if info_path.exists():
+            info = json.loads(info_path.read_text())
+            self.dim = info["dim"]
+            self.dtype = info["dtype"]
+            self.rescore = info.get("rescore", False)
+        updates_path = self.path / "metadata.jsonl"
+        if updates_path.exists():
+            with open(updates_path, "rb") as f:
+                for line in f:
+                    update = json.loads(line)
+                    if update["id"] in self._positions:
+                        self.metadata[self._positions[update["id"]]] = update["metadata"]
+        deleted_path = self.path / "deleted.json"
+        if deleted_path.exists():
+            self.deleted = set(json.loads(deleted_path.read_text()))
+
+    def _storage_dtype(self):
+        return {"float32": np.float32, "float16": np.float16, "int8": np.int8, "binary": np.uint8}[self.dtype]
+
+    def _matrix(self):
+        """Memory-mapped (N, D) view of the stored vectors ((N, D/8) packed bits for binary)."""
+        if self._vectors is None and self.ids:
+            width = (self.dim + 7) // 8 if self.dtype == "binary" else self.dim
+            self._vectors = np.memmap(
+                self.path / "vectors.bin", dtype=self._storage_dtype(), mode="r", shape=(len(self.ids), width)
+            )
+            if self.dtype == "int8":
+                self._scales = np.memmap(self.path / "scales.bin", dtype=np.float32, mode="r", shape=(len(self.ids),))
+            if self.rescore:
+                self._full = np.memmap(self.path / "full.bin", dtype=np.float32, mode="r", shape=(len(self.ids), self.dim))
+        return self._vectors
+
+    def _dense(self, rows: np.ndarray | slice) -> np.ndarray:
+        """Float32 vectors of some rows (full precision if kept, else dequantized)."""
+        matrix = self._matrix()
+        if self.rescore:
+            return np.array(self._full[rows])
+        block = matrix[rows]
+        if self.dtype == "int8":
+            return block.astype(np.float32) * self._scales[rows][:, None]
+        if self.dtype == "binary":
+            signs = np.unpackbits(block, axis=1, count=self.dim).astype(np.float32) * 2 - 1
+            return signs / np.sqrt(self.dim)
+        return block.astype(np.float32)
+
+    def add(self, rows: list[dict]):
+        """Append rows ({id, content, metadata, embedding}) to the index."""
+        if not rows:
+            return
+        vectors = _normalize(np.asarray([row["embedding"] for row in rows], dtype=np.float32))
+        with self.lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                (self.path / "info.json").write_text(json.dumps({
+                    "dim": self.dim, "dtype": self.dtype, "rescore": self.rescore
+                }))
+
+            if self.dtype == "int8":
+                scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+                stored = np.round(vectors / scales[:, None]).astype(np.int8)
+                with open(self.path / "scales.bin", "ab") as f:
+                    f.write(scales.astype(np.float32).tobytes())
+            elif self.dtype == "binary":
+                stored = np.packbits(vectors > 0, axis=1)
+            else:
+                stored = vectors.astype(self._storage_dtype())
+            with open(self.path / "vectors.bin", "ab") as f:
+                f.write(stored.tobytes())
+            if self.rescore:
+                with open(self.path / "full.bin", "ab") as f:
+                    f.write(vectors.astype(np.float32).tobytes())
+
+            rows_path = self.path / "rows.jsonl"
+            offset = rows_path.stat().st_size if rows_path.exists() else 0
+            with open(rows_path, "ab") as f:
+                for row in rows:
+                    line = (json.dumps({
+                        "id": row["id"], "metadata": row["metadata"], "content": row["content"]
+                    }) + "\n").encode("utf-8")
+                    f.write(line)
+                    if self._bm25 is not None:
+                        self._index_terms(len(self.ids), row["content"])
+                    self._positions[row["id"]] = len(self.ids)
+                    self.ids.append(row["id"])
+                    self.metadata.append(row["metadata"])
+                    self.offsets.append(offset)
+                    offset += len(line)
+
+            # Re-map on next search; rebuild IVF once the tenant has grown noticeably
+            self._vectors = None
+            self._alive = None
+            if self._ivf and len(self.ids) > self._ivf["rows"] * 1.2:
+                self._ivf = None
+
+    def remove(self, ids: list):
+        with self.lock:
+            self.deleted.update(ids)
+            self._alive = None
+            (self.path / "deleted.json").write_text(json.dumps(sorted(self.deleted)))
+
+    def update_metadata(self, doc_id, metadata: dict):
+        # Context packing merges neighbours by chunk_index and citations use the pages,
+        # so updates are appended to metadata.jsonl and survive a restart
+        with self.lock:
+            if doc_id in self._positions:
+                self.metadata[self._positions[doc_id]] = metadata
+                with open(self.path / "metadata.jsonl", "ab") as f:
+                    f.write((json.dumps({"id": doc_id, "metadata": metadata}) + "\n").encode("utf-8"))
+
+    def _alive_mask(self) -> np.ndarray:
+        if self._alive is None:
+            self._alive = np.ones(len(self.ids), dtype=bool)
+            for doc_id in self.deleted:
+                if doc_id in self._positions:
+                    self._alive[self._positions[doc_id]] = False
+        return self._alive
+
+    def _read_content(self, row_index: int) -> str:
+        with open(self.path / "rows.jsonl", "rb") as f:
+            f.seek(self.offsets[row_index])
+            return json.loads(f.readline())["content"]
+
+    def _score(self, rows: np.ndarray | slice, query: np.ndarray) -> np.ndarray:
+        """First-pass similarity of some rows to the (normalized) query."""
+        block = self._matrix()[rows]
+        if self.dtype == "int8":
+            return (block.astype(np.float32) @ query) * self._scales[rows]
+        if self.dtype == "binary":
+            # Hamming distance between sign bits, mapped onto [-1, 1] like a cosine
+            differing = block ^ np.packbits(query > 0)
+            if hasattr(np, "bitwise_count"):
+                if differing.shape[1] % 8 == 0:
+                    differing = differing.view(np.uint64)
+                distances = np.bitwise_count(differing).sum(axis=1, dtype=np.int32)
+            else:
+                distances = _POPCOUNT[differing].sum(axis=1, dtype=np.int32)
+            return 1.0 - 2.0 * distances / self.dim
+        return block.astype(np.float32, copy=False) @ query
+
+    def _rescore(self, candidates: np.ndarray, scores: np.ndarray, query: np.ndarray, match_count: int):
+        """Exact similarities for the best first-pass candidates (quantized indexes)."""
+        shortlist = np.flatnonzero(np.isfinite(scores))
+        k = min(match_count * LOCAL_INDEX_RESCORE_FACTOR, len(shortlist))
+        if k < len(shortlist):
+            shortlist = shortlist[np.argpartition(-scores[shortlist], k - 1)[:k]]
+        rows = np.sort(candidates[shortlist])
+        return rows, np.asarray(self._full[rows]) @ query
+
+    def _index_terms(self, row_index: int, content: str):
+        tokens = tokenize(content or "")
+        self._bm25["lengths"].append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            rows, tfs = self._bm25["postings"].setdefault(term, ([], []))
+            rows.append(row_index)
+            tfs.append(tf)
+
+    def _build_bm25(self):
+        """Inverted index over the stored chunk texts; new rows are indexed on add."""
+        self._bm25 = {"postings": {}, "lengths": []}
+        with open(self.path / "rows.jsonl", "rb") as f:
+            for row_index, line in enumerate(f):
+                self._index_terms(row_index, json.loads(line)["content"])
+
+    def lexical_search(self, query_text: str, match_count: int) -> list[dict]:
+        """BM25 search; returns rows shaped like match_documents_lexical."""
+        with self.lock:
+            if not self.ids:
+                return []
+            if self._bm25 is None:
+                self._build_bm25()
+
+            n = len(self.ids)
+            lengths = np.asarray(self._bm25["lengths"], dtype=np.float32)
+            avgdl = max(float(lengths.mean()), 1.0)
+            scores = np.zeros(n, dtype=np.float32)
+            for term in set(tokenize(query_text)):
+                if term not in self._bm25["postings"]:
+                    continue
+                rows, tfs = self._bm25["postings"][term]
+                rows = np.asarray(rows)
+                tfs = np.asarray(tfs, dtype=np.float32)
+                idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+                norm = tfs + _BM25_K1 * (1 - _BM25_B + _BM25_B * lengths[rows] / avgdl)
+                scores[rows] += idf * tfs * (_BM25_K1 + 1) / norm
+
+            if self.deleted:
+                scores = np.where(self._alive_mask(), scores, 0.0)
+            matched = np.flatnonzero(scores > 0)
+            top = matched[np.argsort(-scores[matched])[:match_count]]
+            return [{
+                "id": self.ids[i],
+                "content": self._read_content(int(i)),
+                "metadata": self.metadata[i],
+                "rank": float(scores[i]),
+            } for i in top]
+
+    def _build_ivf(self):
+        """Coarse k-means quantizer (IVF) over the stored vectors."""
+        n = len(self.ids)
+        nlist = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample = self._dense(np.sort(rng.choice(n, size=min(n, nlist * 64), replace=False)))
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(10):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+
+        assignments = np.empty(n, dtype=np.int32)
+        for start in range(0, n, _SCAN_BLOCK_ROWS):
+            block = self._dense(slice(start, min(start + _SCAN_BLOCK_ROWS, n)))
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        lists = [np.flatnonzero(assignments == c) for c in range(nlist)]
+        self._ivf = {"rows": n, "centroids": centroids, "lists": lists}
+        print(f"[VectorStore] Built IVF index ({nlist} lists) over {n} rows")
+
+    def search(self, query_embedding: list[float], match_threshold: float, match_count: int) -> list[dict]:
+        """Top-k cosine similarity search; returns rows shaped like match_documents."""
+        with self.lock:
+            if not self.ids:
+                return []
+            query = _normalize(np.asarray(query_embedding, dtype=np.float32)[None, :])[0]
+            n = len(self.ids)
+
+            if n >= LOCAL_INDEX_IVF_MIN_ROWS:
+                if self._ivf is None:
+                    self._build_ivf()
+                probe = np.argsort(self._ivf["centroids"] @ query)[::-1][:LOCAL_INDEX_IVF_NPROBE]
+                candidates = np.sort(np.concatenate([self._ivf["lists"][c] for c in probe]))
+                # Rows appended since the IVF build are always scanned
+                candidates = np.concatenate([candidates, np.arange(self._ivf["rows"], n)])
+                scores = self._score(candidates, query)
+            else:
+                candidates = np.arange(n)
+                scores = np.concatenate([
+                    self._score(slice(start, min(start + _SCAN_BLOCK_ROWS, n)), query)
+                    for start in range(0, n, _SCAN_BLOCK_ROWS)
+                ])
+
+            if self.deleted:
+                scores = np.where(self._alive_mask()[candidates], scores, -np.inf)
+            if self.rescore:
+                candidates, scores = self._rescore(candidates, scores, query, match_count)
+                if not len(scores):
+                    return []
+
+            k = min(match_count, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            results = []
+            for position in top:
+                if scores[position] <= match_threshold:
+                    break
+                row_index = int(candidates[position])
+                results.append({
+                    "id": self.ids[row_index],
+                    "content": self._read_content(row_index),
+                    "metadata": self.metadata[row_index],
+                    "similarity": float(scores[position]),
+                })
+            return results
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class LocalRetrievalBackend:
+    """
+    In-process retrieval over per-user memory-mapped indexes.
+    A user's index is built from Supabase on first query, then kept in sync by
+    the ingestion write hooks; Supabase remains the source of truth.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._building = {}
+
+    def _index(self, user_id: str) -> LocalUserIndex:
+        with self._lock:
+            if user_id not in self._indexes:
+                self._indexes[user_id] = LocalUserIndex(self.root / user_id)
+            return self._indexes[user_id]
+
+    async def _ensure_built(self, supabase, user_id: str) -> LocalUserIndex:
+        index = self._index(user_id)
+        if index.ready:
+            return index
+        # Only one coroutine builds a given user's index. The build is shielded, so a
+        # cancelled caller (e.g. a client disconnecting) does not cancel it for the others
+        build = self._building.get(user_id)
+        if build is None:
+            build = asyncio.ensure_future(self._build(supabase, user_id))
+            self._building[user_id] = build
+            build.add_done_callback(lambda done: self._build_done(user_id, done))
+        await asyncio.shield(build)
+        return self._index(user_id)
+
+    def _build_done(self, user_id: str, build: asyncio.Future):
+        self._building.pop(user_id, None)
+        # Retrieve the error even if every caller went away, so it is not logged as unhandled
+        if not build.cancelled():
+            build.exception()
+
+    async def _build(self, supabase, user_id: str, page_size: int = 500):
+        print(f"[VectorStore] Building local index for user {user_id}")
+        path = self.root / user_id
+        await asyncio.to_thread(shutil.rmtree, path, True)
+        with self._lock:
+            self._indexes[user_id] = LocalUserIndex(path)
+        index = self._indexes[user_id]
+
+        start = 0
+        while True:
+            response = await asyncio.to_thread(
+                supabase.table("documents")
+                .select("id, content, metadata, embedding")
+                .eq("user_id", user_id)
+                .order("id")
+                .range(start, start + page_size - 1)
+                .execute
+            )
+            rows = [{
+                **row,
+                # PostgREST returns vector columns as their text form
+                "embedding": json.loads(row["embedding"]) if isinstance(row["embedding"], str) else row["embedding"]
+            } for row in response.data]
+            await asyncio.to_thread(index.add, rows)
+            if len(response.data) < page_size:
+                break
+            start += page_size
+
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "ready").touch()
+        print(f"[VectorStore] Local index for user {user_id} has {len(index)} rows")
+
+    async def match(self, supabase, user_id: str, query_embedding: list[float],
+                    match_threshold: float, match_count: int) -> list[dict]:
+        index = await self._ensure_built(supabase, user_id)
+        results = await asyncio.to_thread(index.search, query_embedding, match_threshold, match_count)
+        for row in results:
+            row["user_id"] = user_id
+        return results
+
+    async def lexical_match(self, supabase, user_id: str, query_text: str, match_count: int) -> list[dict]:
+        index = await self._ensure_built(supabase, user_id)
+        results = await asyncio.to_thread(index.lexical_search, query_text, match_count)
+        for row in results:
+            row["user_id"] = user_id
+        return results
+
+    # Write hooks only touch indexes that are already built; unbuilt ones load from Supabase
+    def add(self, user_id: str, rows: list[dict]):
+        index = self._index(user_id)
+        if index.ready:
+            index.add(rows)
+
+    def remove(self, user_id: str, ids: list):
+        index = self._index(user_id)
+        if index.ready:
+            index.remove(ids)
+
+    def update_metadata(self, user_id: str, doc_id, metadata: dict):
+        index = self._index(user_id)
+        if index.ready:
+            index.update_metadata(doc_id, metadata)
+
+
+if RETRIEVAL_BACKEND == "local":
+    retrieval_backend = LocalRetrievalBackend(LOCAL_INDEX_DIR)
+else:
+    retrieval_backend = SupabaseRetrievalBackend()
@@ -53,3 +53,10 @@ create policy "Users can insert messages to their chats"
       and chats.user_id = auth.uid()
     )
   );
+
+-- 6. Indexes for keyset pagination of the history endpoints
+create index if not exists chats_user_created_idx
+  on chats (user_id, created_at desc, id desc);
+
+create index if not exists messages_chat_created_idx
+  on messages (chat_id, created_at, id);
@@ -48,17 +48,24 @@ export default function ChatInterface({ chatId, onUpdateChat }: ChatInterfacePro
       const { data: { session } } = await supabase.auth.getSession();
       if (!session) return;
 
-      const res = await fetch(`${API_URL}/chats/${chatIdToLoad}/messages`, {
-        headers: { "Authorization": `Bearer ${session.access_token}` }
-      });
-      if (res.ok) {
+      // Messages are paginated; follow the cursor until the thread is loaded
+      const loaded: Message[] = [];
+      let cursor: string | null = null;
+      do {
+        const params: string = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+        const res = await fetch(`${API_URL}/chats/${chatIdToLoad}/messages${params}`, {
+          headers: { "Authorization": `Bearer ${session.access_token}` }
+        });
+        if (!res.ok) break;
         const data = await res.json();
-        setMessages(data.map((m: any) => ({
+        loaded.push(...data.messages.map((m: any) => ({
           role: m.role,
           content: m.content,
           citations: m.citations
         })));
-      }
+        cursor = data.next_cursor;
+      } while (cursor);
+      setMessages(loaded);
     } catch (error) {
       console.error("Failed to load chat history", error);
     }
@@ -81,7 +88,7 @@ export default function ChatInterface({ chatId, onUpdateChat }: ChatInterfacePro
       const { data: { session } } = await supabase.auth.getSession();
       if (!session) throw new Error("Not authenticated");
 
-      const res = await fetch(`${API_URL}/chat`, {
+      const res = await fetch(`${API_URL}/chat/stream`, {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -93,27 +100,62 @@ export default function ChatInterface({ chatId, onUpdateChat }: ChatInterfacePro
         }),
       });
 
-      if (!res.ok) throw new Error("Failed to get response");
+      if (!res.ok || !res.body) throw new Error("Failed to get response");
 
-      const endTime = performance.now();
-      const responseTime = Math.round(endTime - startTime);
-      setLastResponseTime(responseTime);
+      // Server-Sent Events: chat -> citations -> token* -> done | error
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      const stream: { started: boolean; chatId: string | null } = { started: false, chatId: null };
 
-      setAvatarState("streaming");
-      const data = await res.json();
+      const updateAssistant = (update: (msg: Message) => Message) => {
+        setMessages(prev => {
+          const next = [...prev];
+          next[next.length - 1] = update(next[next.length - 1]);
+          return next;
+        });
+      };
 
-      const answerContent = data.answer || data.response || "No response received";
-      
-      setMessages(prev => [...prev, {
-        role: "assistant",
-        content: answerContent,
-        citations: data.citations,
-        timing: responseTime
-      }]);
+      const handleEvent = (event: string, data: any) => {
+        if (event === "chat") {
+          stream.chatId = data.chat_id;
+        } else if (event === "citations") {
+          if (!stream.started) {
+            stream.started = true;
+            const responseTime = Math.round(performance.now() - startTime);
+            setLastResponseTime(responseTime);
+            setAvatarState("streaming");
+            setMessages(prev => [...prev, { role: "assistant", content: "", citations: data, timing: responseTime }]);
+          }
+        } else if (event === "token") {
+          updateAssistant(msg => ({ ...msg, content: msg.content + data.text }));
+        } else if (event === "error") {
+          throw new Error(data.detail || "Streaming failed");
+        }
+      };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          let event = "message";
+          let data = "";
+          for (const line of rawEvent.split("\n")) {
+            if (line.startsWith("event: ")) event = line.slice(7);
+            else if (line.startsWith("data: ")) data += line.slice(6);
+          }
+          handleEvent(event, data ? JSON.parse(data) : null);
+        }
+      }
 
-      if (!currentChatId && data.chat_id) {
-        setCurrentChatId(data.chat_id);
-        onUpdateChat(data.chat_id);
+      if (!currentChatId && stream.chatId) {
+        setCurrentChatId(stream.chatId);
+        onUpdateChat(stream.chatId);
       }
     } catch (error) {
       console.error(error);
@@ -15,6 +15,7 @@ interface ChatSidebarProps {
 
 export default function ChatSidebar({ currentChatId, onSelectChat, onNewChat, onToggleIngest }: ChatSidebarProps) {
   const [chats, setChats] = useState<Chat[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [userEmail, setUserEmail] = useState<string | null>(null);
   const [isOpen, setIsOpen] = useState(false);
   const supabase = createClient();
@@ -25,7 +26,7 @@ export default function ChatSidebar({ currentChatId, onSelectChat, onNewChat, on
     fetchUserAndChats();
   }, [currentChatId]);
 
-  const fetchUserAndChats = async () => {
+  const fetchUserAndChats = async (cursor: string | null = null) => {
     const { data: { session } } = await supabase.auth.getSession();
     if (!session) return;
     
@@ -33,12 +34,14 @@ export default function ChatSidebar({ currentChatId, onSelectChat, onNewChat, on
     const token = session.access_token;
 
     try {
-      const res = await fetch(`${API_URL}/chats`, {
+      const params = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+      const res = await fetch(`${API_URL}/chats${params}`, {
         headers: { "Authorization": `Bearer ${token}` }
       });
       if (res.ok) {
         const data = await res.json();
-        setChats(data);
+        setChats(prev => cursor ? [...prev, ...data.chats] : data.chats);
+        setNextCursor(data.next_cursor);
       }
     } catch (error) {
       console.error("Failed to fetch chats", error);
@@ -144,6 +147,14 @@ export default function ChatSidebar({ currentChatId, onSelectChat, onNewChat, on
                   </button>
                 </div>
               ))}
+              {nextCursor && (
+                <button
+                  onClick={() => fetchUserAndChats(nextCursor)}
+                  className="w-full p-2 text-xs text-gray-500 hover:text-gray-300 transition-colors"
+                >
+                  Load more
+                </button>
+              )}
             </div>
           )}
         </div>
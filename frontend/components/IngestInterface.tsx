@@ -10,6 +10,7 @@ export default function IngestInterface() {
   const [sourceName, setSourceName] = useState("");
   const [file, setFile] = useState<File | null>(null);
   const [url, setUrl] = useState("");
+  const [crawlSite, setCrawlSite] = useState(false);
   const [status, setStatus] = useState<"idle" | "loading" | "success" | "error">("idle");
   const [message, setMessage] = useState("");
   const fileInputRef = useRef<HTMLInputElement>(null);
@@ -57,6 +58,7 @@ export default function IngestInterface() {
           formData.append("source", sourceName || file.name);
       } else if (ingestMode === "url" && url) {
           formData.append("url", url);
+          if (crawlSite) formData.append("crawl", "true");
       } else {
           formData.append("text", text);
           formData.append("source", sourceName || "Text Paste");
@@ -78,8 +80,31 @@ export default function IngestInterface() {
       }
 
       const data = await res.json();
+
+      // Ingestion runs as a background job; poll until it finishes
+      let job = data;
+      while (job.status === "queued" || job.status === "running") {
+          setMessage(
+            job.progress != null
+              ? `Ingesting... ${Math.round(job.progress * 100)}%${job.eta_seconds != null ? ` (about ${Math.ceil(job.eta_seconds)}s left)` : ""}`
+              : "Ingesting..."
+          );
+          await new Promise((resolve) => setTimeout(resolve, 1500));
+          const jobRes = await fetch(`${API_URL}/ingest/jobs/${data.job_id}`, {
+            headers: { "Authorization": `Bearer ${token}` },
+          });
+          if (!jobRes.ok) {
+              throw new Error("Failed to fetch ingestion status");
+          }
+          job = await jobRes.json();
+      }
+
+      if (job.status === "failed") {
+          throw new Error(job.error || "Ingestion failed");
+      }
+
       setStatus("success");
-      setMessage(`Successfully ingested ${data.chunks_count} chunks.`);
+      setMessage(`Successfully ingested ${job.chunks_total} chunks.`);
       setText("");
       setSourceName("");
       setFile(null);
@@ -167,9 +192,20 @@ export default function IngestInterface() {
                                     className="w-full bg-white/5 border border-white/10 rounded-xl pl-11 pr-4 py-3 focus:outline-none focus:ring-2 focus:ring-cyan-500/50 text-white placeholder-gray-600 text-sm transition-all"
                                 />
                             </div>
+                            <label className="flex items-center gap-2 text-xs text-gray-400 mt-3 cursor-pointer select-none">
+                                <input
+                                    type="checkbox"
+                                    checked={crawlSite}
+                                    onChange={(e) => setCrawlSite(e.target.checked)}
+                                    className="accent-cyan-500"
+                                />
+                                Crawl linked pages on the same site
+                            </label>
                             <p className="flex items-center gap-2 text-[10px] text-gray-500 mt-3 bg-blue-500/10 p-2 rounded-lg border border-blue-500/20">
                                 <Sparkles size={10} className="text-blue-400" />
-                                Text will be automatically extracted from the provided webpage.
+                                {crawlSite
+                                    ? "Pages are fetched and indexed as they arrive; re-crawls only re-index pages that changed."
+                                    : "Text will be automatically extracted from the provided webpage."}
                             </p>
                          </div>
                     )}
@@ -0,0 +1,50 @@
+-- Run this in Supabase SQL Editor (after partition_documents.sql) to enable hybrid search
+
+-- 1. Full-text vector maintained alongside each chunk at insert time
+alter table documents
+add column if not exists fts tsvector
+generated always as (to_tsvector('english', coalesce(content, ''))) stored;
+
+create index if not exists documents_fts_idx on documents using gin (fts);
+
+-- 2. User-scoped lexical search. Query terms are OR-ed together so exact identifiers,
+--    error codes and names match even when the rest of the question does not.
+create or replace function match_documents_lexical (
+  query_text text,
+  match_count int,
+  filter_user_id uuid
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  rank float,
+  user_id uuid
+)
+language plpgsql
+as $$
+declare
+  query tsquery;
+begin
+  select to_tsquery('simple', string_agg(quote_literal(lexeme), ' | '))
+  into query
+  from unnest(tsvector_to_array(to_tsvector('english', query_text))) as lexeme;
+
+  if query is null then
+    return;
+  end if;
+
+  return query
+  select
+    documents.id,
+    documents.content,
+    documents.metadata,
+    ts_rank_cd(documents.fts, query, 1)::float as rank,
+    documents.user_id
+  from documents
+  where documents.user_id = filter_user_id
+    and documents.fts @@ query
+  order by rank desc
+  limit match_count;
+end;
+$$;
@@ -0,0 +1,28 @@
+-- Run this in Supabase SQL Editor to support incremental re-ingestion (upsert by source)
+
+-- 1. Look up a user's chunks for a source without scanning the whole table
+create index if not exists documents_user_source_idx
+  on documents (user_id, (metadata->>'source'));
+
+-- 2. Allow users to update their OWN documents (chunk_index is rewritten when chunks shift)
+create policy "Users can update their own documents"
+on documents for update
+to authenticated
+using (auth.uid() = user_id)
+with check (auth.uid() = user_id);
+
+-- 3. Rewrite the metadata of many chunks in one statement (a shifted source moves all
+--    chunks after the edit). Runs with the caller's rights, so RLS still applies.
+create or replace function update_document_metadata (
+  updates jsonb,
+  filter_user_id uuid
+)
+returns void
+language sql
+as $$
+  update documents
+  set metadata = batch.metadata
+  from jsonb_to_recordset(updates) as batch(id bigint, metadata jsonb)
+  where documents.user_id = filter_user_id
+    and documents.id = batch.id;
+$$;
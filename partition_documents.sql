@@ -0,0 +1,97 @@
+-- Run this in Supabase SQL Editor to make vector search per-user and index-backed
+-- Requires pgvector >= 0.8 (halfvec HNSW indexes and iterative index scans)
+
+-- 1. Recreate documents as a table hash-partitioned by user_id.
+--    Each partition gets its own HNSW index, so a query only searches the graph of
+--    the partition that holds the user's rows.
+create table documents_partitioned (
+  id bigint not null default nextval('documents_id_seq'),
+  content text,
+  metadata jsonb,
+  embedding vector(3072),
+  user_id uuid not null references auth.users(id),
+  primary key (user_id, id)
+) partition by hash (user_id);
+
+create table documents_p0 partition of documents_partitioned for values with (modulus 8, remainder 0);
+create table documents_p1 partition of documents_partitioned for values with (modulus 8, remainder 1);
+create table documents_p2 partition of documents_partitioned for values with (modulus 8, remainder 2);
+create table documents_p3 partition of documents_partitioned for values with (modulus 8, remainder 3);
+create table documents_p4 partition of documents_partitioned for values with (modulus 8, remainder 4);
+create table documents_p5 partition of documents_partitioned for values with (modulus 8, remainder 5);
+create table documents_p6 partition of documents_partitioned for values with (modulus 8, remainder 6);
+create table documents_p7 partition of documents_partitioned for values with (modulus 8, remainder 7);
+
+-- 2. Copy existing rows (rows without an owner are unreachable through RLS and are dropped)
+insert into documents_partitioned (id, content, metadata, embedding, user_id)
+select id, content, metadata, embedding, user_id from documents where user_id is not null;
+
+alter sequence documents_id_seq owned by documents_partitioned.id;
+drop table documents cascade;
+alter table documents_partitioned rename to documents;
+
+-- 3. Indexes
+-- pgvector indexes are limited to 2000 dims for `vector`; 3072-dim embeddings are
+-- indexed as halfvec (up to 4000 dims), which also halves the index size.
+create index documents_embedding_hnsw_idx on documents
+  using hnsw ((embedding::halfvec(3072)) halfvec_cosine_ops);
+create index documents_user_source_idx on documents (user_id, (metadata->>'source'));
+
+-- 4. Row Level Security (policies do not survive the table swap)
+alter table documents enable row level security;
+
+create policy "Users can insert their own documents"
+on documents for insert to authenticated
+with check (auth.uid() = user_id);
+
+create policy "Users can select their own documents"
+on documents for select to authenticated
+using (auth.uid() = user_id);
+
+create policy "Users can update their own documents"
+on documents for update to authenticated
+using (auth.uid() = user_id)
+with check (auth.uid() = user_id);
+
+create policy "Users can delete their own documents"
+on documents for delete to authenticated
+using (auth.uid() = user_id);
+
+-- 5. User-scoped search. The user filter prunes to one partition before any distance
+--    is computed, and the distance is computed once per row in the inner query.
+--    Iterative scans keep walking the HNSW graph until match_count rows pass the filter.
+create or replace function match_documents (
+  query_embedding vector(3072),
+  match_threshold float,
+  match_count int,
+  filter_user_id uuid
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  user_id uuid
+)
+language plpgsql
+set hnsw.iterative_scan = relaxed_order
+as $$
+begin
+  return query
+  select *
+  from (
+    select
+      documents.id,
+      documents.content,
+      documents.metadata,
+      1 - (documents.embedding::halfvec(3072) <=> query_embedding::halfvec(3072)) as similarity,
+      documents.user_id
+    from documents
+    where documents.user_id = filter_user_id
+    order by documents.embedding::halfvec(3072) <=> query_embedding::halfvec(3072)
+    limit match_count
+  ) as candidates
+  where candidates.similarity > match_threshold
+  order by candidates.similarity desc;
+end;
+$$;
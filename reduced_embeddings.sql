@@ -0,0 +1,77 @@
+-- Run this in Supabase SQL Editor (after partition_documents.sql) to store smaller embeddings
+-- and search them through a binary-quantized first pass.
+-- Requires pgvector >= 0.7 (subvector, l2_normalize, binary_quantize, bit HNSW indexes).
+--
+-- Written for 768 dimensions: set EMBEDDING_DIMENSIONS=768 on the backend, or replace every
+-- 768 below with the size you use (e.g. 1536). Deploy the backend setting together with this
+-- migration; until then, inserts of 3072-dim vectors fail against the new column type.
+
+-- 1. The HNSW index over halfvec(3072) cannot survive the type change
+drop index if exists documents_embedding_hnsw_idx;
+
+-- 2. Shrink existing rows in place. gemini-embedding-001 is trained so that a prefix of its
+--    3072-dim vector is itself an embedding (what output_dimensionality returns); the prefix
+--    only needs re-normalizing, so no document has to be re-embedded.
+--    This rewrites the table: on large tables run it in a maintenance window.
+alter table documents
+alter column embedding type vector(768)
+using l2_normalize(subvector(embedding, 1, 768))::vector(768);
+
+-- 3. Sign-bit copy of each embedding (96 bytes for 768 dims, 32x smaller than float32),
+--    maintained by Postgres on insert and update, with a Hamming-distance HNSW index
+alter table documents
+add column if not exists embedding_bin bit(768)
+generated always as (binary_quantize(embedding)::bit(768)) stored;
+
+create index if not exists documents_embedding_bin_hnsw_idx on documents
+  using hnsw (embedding_bin bit_hamming_ops);
+
+-- 4. Two-phase search: the binary index shortlists match_count * rescore_factor rows of the
+--    user's partition, and only those are rescored with the full-precision vectors.
+--    The signature changes (vector size), so drop the 3072-dim version first.
+drop function if exists match_documents(vector, float, int, uuid);
+
+create or replace function match_documents (
+  query_embedding vector(768),
+  match_threshold float,
+  match_count int,
+  filter_user_id uuid,
+  rescore_factor int default 10
+)
+returns table (
+  id bigint,
+  content text,
+  metadata jsonb,
+  similarity float,
+  user_id uuid
+)
+language plpgsql
+set hnsw.iterative_scan = relaxed_order
+as $$
+begin
+  return query
+  select *
+  from (
+    select
+      shortlist.id,
+      shortlist.content,
+      shortlist.metadata,
+      1 - (shortlist.embedding <=> query_embedding) as similarity,
+      shortlist.user_id
+    from (
+      select documents.id, documents.content, documents.metadata, documents.embedding, documents.user_id
+      from documents
+      where documents.user_id = filter_user_id
+      order by documents.embedding_bin <~> binary_quantize(query_embedding)::bit(768)
+      limit match_count * rescore_factor
+    ) as shortlist
+    order by shortlist.embedding <=> query_embedding
+    limit match_count
+  ) as candidates
+  where candidates.similarity > match_threshold
+  order by candidates.similarity desc;
+end;
+$$;
+
+-- Storage check: average bytes per row for the full vector and the binary copy
+-- select avg(pg_column_size(embedding)), avg(pg_column_size(embedding_bin)) from documents;